@@ -1,5 +1,8 @@
 from .constants import *
+from .gguf_editor import *
 from .gguf_reader import *
 from .gguf_writer import *
+from .quants import *
 from .tensor_mapping import *
 from .vocab import *
+from .utility import *
@@ -11,6 +11,12 @@ from typing import Any
 GGUF_MAGIC             = 0x46554747  # "GGUF"
 GGUF_VERSION           = 3
 GGUF_DEFAULT_ALIGNMENT = 32
+# File name of shard no (from 1) of a model split into count files
+GGUF_SPLIT_PATH        = "{prefix}-{no:05d}-of-{count:05d}.gguf"
+# general.tensor_hashes has a hex digest of this hash of the data of every tensor as stored
+# in the file (without padding), in the order of the tensor infos
+GGUF_TENSOR_HASH_TYPE  = "blake2b-128"
+GGUF_TENSOR_HASH_SIZE  = 16
 
 #
 # metadata keys
@@ -30,6 +36,9 @@ class Keys:
         SOURCE_URL           = "general.source.url"
         SOURCE_HF_REPO       = "general.source.huggingface.repository"
         FILE_TYPE            = "general.file_type"
+        TENSOR_DATA_ORDER    = "general.tensor_data_order"
+        TENSOR_HASH_TYPE     = "general.tensor_hash_type"
+        TENSOR_HASHES        = "general.tensor_hashes"
 
     class LLM:
         CONTEXT_LENGTH        = "{arch}.context_length"
@@ -72,6 +81,12 @@ class Keys:
         RWKV          = "tokenizer.rwkv.world"
         CHAT_TEMPLATE = "tokenizer.chat_template"
 
+    class Split:
+        NO                = "split.no"
+        COUNT             = "split.count"
+        TENSORS_COUNT     = "split.tensors.count"
+        TENSORS_PER_SHARD = "split.tensors.per_shard"
+
 
 #
 # recommended mapping of model tensor names for storage in gguf
@@ -338,6 +353,32 @@ MODEL_TENSOR_SKIP: dict[MODEL_ARCH, list[MODEL_TENSOR]] = {
     ],
 }
 
+# order in which the tensors are used when evaluating a model, the ones
+# before the block tensors come before the first block, the others after the last
+MODEL_TENSOR_EXECUTION_ORDER: list[MODEL_TENSOR] = [
+    MODEL_TENSOR.TOKEN_EMBD,
+    MODEL_TENSOR.TOKEN_TYPES,
+    MODEL_TENSOR.POS_EMBD,
+    MODEL_TENSOR.TOKEN_EMBD_NORM,
+    MODEL_TENSOR.ROPE_FREQS,
+    MODEL_TENSOR.ATTN_NORM,
+    MODEL_TENSOR.ATTN_NORM_2,
+    MODEL_TENSOR.ATTN_QKV,
+    MODEL_TENSOR.ATTN_Q,
+    MODEL_TENSOR.ATTN_K,
+    MODEL_TENSOR.ATTN_V,
+    MODEL_TENSOR.ATTN_Q_NORM,
+    MODEL_TENSOR.ATTN_K_NORM,
+    MODEL_TENSOR.ATTN_ROT_EMBD,
+    MODEL_TENSOR.ATTN_OUT,
+    MODEL_TENSOR.FFN_NORM,
+    MODEL_TENSOR.FFN_GATE,
+    MODEL_TENSOR.FFN_UP,
+    MODEL_TENSOR.FFN_DOWN,
+    MODEL_TENSOR.OUTPUT_NORM,
+    MODEL_TENSOR.OUTPUT,
+]
+
 #
 # types
 #
@@ -358,6 +399,11 @@ class RopeScalingType(Enum):
     YARN   = 'yarn'
 
 
+class TensorDataLayout(Enum):
+    ADDED     = 'added'      # tensor data in the order the tensors were added
+    EXECUTION = 'execution'  # grouped per block, in MODEL_TENSOR_EXECUTION_ORDER
+
+
 class GGMLQuantizationType(IntEnum):
     F32  = 0
     F16  = 1
@@ -433,6 +479,26 @@ GGML_QUANT_SIZES = {
     GGMLQuantizationType.Q8_K: (256, 4 + QK_K + QK_K // 8),
 }
 
+# The values in a block that are wider than a byte, and so are stored in the byte
+# order of the file. Items here are (offset, value size, value count), the rest of
+# a block are single bytes. The high bits of Q5_0 and Q5_1 are a 32 bit integer.
+GGML_QUANT_ENDIAN_FIELDS: dict[GGMLQuantizationType, tuple[tuple[int, int, int], ...]] = {
+    GGMLQuantizationType.F32:  ((0, 4, 1),),
+    GGMLQuantizationType.F16:  ((0, 2, 1),),
+    GGMLQuantizationType.Q4_0: ((0, 2, 1),),
+    GGMLQuantizationType.Q4_1: ((0, 2, 2),),
+    GGMLQuantizationType.Q5_0: ((0, 2, 1), (2, 4, 1)),
+    GGMLQuantizationType.Q5_1: ((0, 2, 2), (4, 4, 1)),
+    GGMLQuantizationType.Q8_0: ((0, 2, 1),),
+    GGMLQuantizationType.Q8_1: ((0, 4, 2),),
+    GGMLQuantizationType.Q2_K: ((QK_K // 16 + QK_K // 4, 2, 2),),
+    GGMLQuantizationType.Q3_K: ((QK_K // 8 + QK_K // 4 + 12, 2, 1),),
+    GGMLQuantizationType.Q4_K: ((0, 2, 2),),
+    GGMLQuantizationType.Q5_K: ((0, 2, 2),),
+    GGMLQuantizationType.Q6_K: ((QK_K // 2 + QK_K // 4 + QK_K // 16, 2, 1),),
+    GGMLQuantizationType.Q8_K: ((0, 4, 1), (4 + QK_K, 2, QK_K // 16)),
+}
+
 
 # Aliases for backward compatibility.
 
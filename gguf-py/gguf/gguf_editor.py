@@ -0,0 +1,209 @@
+#
+# GGUF metadata editing without rewriting the tensor data.
+#
+from __future__ import annotations
+
+import errno
+import os
+import struct
+import sys
+import tempfile
+from collections import OrderedDict
+from typing import IO, Any, Callable, Sequence, Union
+
+import numpy as np
+
+from .constants import GGUFValueType, Keys
+from .gguf_reader import GGUFReader
+from .gguf_writer import GGUFWriter
+
+# Bytes copied at once when the data can't be copied in the kernel.
+EDITOR_COPY_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Errors of copy_file_range() and sendfile() meaning they can't be used for these files.
+_KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+
+def _copy_file_range(src: int, dst: int, src_offset: int, dst_offset: int, count: int) -> int:
+    return os.copy_file_range(src, dst, count, src_offset, dst_offset)  # type: ignore[attr-defined]
+
+
+def _sendfile(src: int, dst: int, src_offset: int, dst_offset: int, count: int) -> int:
+    os.lseek(dst, dst_offset, os.SEEK_SET)
+    return os.sendfile(dst, src, src_offset, count)
+
+
+_KERNEL_COPIES: list[Callable[[int, int, int, int, int], int]] = [
+    copy for name, copy in (('copy_file_range', _copy_file_range), ('sendfile', _sendfile)) if hasattr(os, name)
+]
+
+
+# Copy count bytes from offset in fin to the end of fout. The data is copied in the kernel
+# when possible, with copy_file_range() (which can share the blocks on file systems with
+# reflinks) or sendfile(), so it doesn't pass through Python.
+def copy_file_data(fin: IO[bytes], fout: IO[bytes], offset: int, count: int) -> None:
+    fout.flush()
+    src, dst = fin.fileno(), fout.fileno()
+    dst_offset = fout.seek(0, os.SEEK_END)
+    end = offset + count
+    for copy in _KERNEL_COPIES:
+        try:
+            while offset < end:
+                n = copy(src, dst, offset, dst_offset, end - offset)
+                if n == 0:
+                    raise EOFError(f'Unexpected end of data copying from offset {offset}')
+                offset += n
+                dst_offset += n
+            break
+        except OSError as e:
+            if e.errno not in _KERNEL_COPY_UNSUPPORTED:
+                raise
+    fin.seek(offset)
+    fout.seek(dst_offset)
+    while offset < end:
+        chunk = fin.read(min(EDITOR_COPY_CHUNK_SIZE, end - offset))
+        if not chunk:
+            raise EOFError(f'Unexpected end of data copying from offset {offset}')
+        fout.write(chunk)
+        offset += len(chunk)
+
+
+# Adds, replaces and deletes key/value pairs of a GGUF file. Only the header (the
+# key/value pairs and the tensor infos) is rebuilt, the pairs that aren't changed are
+# copied as they are without being parsed. write() overwrites the header in place when
+# the tensor data still starts at the same (aligned) offset, otherwise the tensor data
+# is copied after the new header, see copy_file_data(). The edits are applied once,
+# open a new editor to make more.
+class GGUFEditor:
+    def __init__(self, path: os.PathLike[str] | str):
+        self.path = os.fspath(path)
+        self.reader = GGUFReader(path, 'r', lazy = True, split = False)
+        file_little = (sys.byteorder == 'little') == (self.reader.byte_order == 'I')
+        self.pack_prefix = '<' if file_little else '>'
+        # The packed key/value pair of every changed key, None for deleted keys
+        self.changes: OrderedDict[str, Union[bytes, None]] = OrderedDict()
+
+    # The type of the value of key, followed by the item type for arrays, or None if
+    # the file doesn't have the key. Doesn't parse the value.
+    def get_types(self, key: str) -> Union[list[GGUFValueType], None]:
+        field = OrderedDict.get(self.reader.fields, key)
+        if field is None or key.startswith('GGUF.'):
+            return None
+        offs = field.offset if not isinstance(field, int) else field
+        offs += 8 + self.reader._get_int(offs, 'Q')
+        types = [GGUFValueType(self.reader._get_int(offs, 'I'))]
+        if types[0] == GGUFValueType.ARRAY:
+            types.append(GGUFValueType(self.reader._get_int(offs + 4, 'I')))
+        return types
+
+    def has_key(self, key: str) -> bool:
+        if key in self.changes:
+            return self.changes[key] is not None
+        return self.get_types(key) is not None
+
+    # Set key to val. The type defaults to the type the key already has, item_type is
+    # the type of the items of arrays.
+    def set(
+        self, key: str, val: Any, vtype: GGUFValueType | None = None, item_type: GGUFValueType | None = None,
+    ) -> None:
+        if key == Keys.General.ALIGNMENT:
+            raise ValueError('Changing the alignment would move the tensor data, convert the model again instead')
+        if key.startswith('GGUF.'):
+            raise ValueError(f'{key} is not a key/value pair')
+        if vtype is None:
+            types = self.get_types(key)
+            if types is None:
+                raise ValueError(f'The type of the new key {key} has to be specified')
+            vtype = types[0]
+            if item_type is None and len(types) > 1:
+                item_type = types[1]
+        self.changes[key] = self._pack(GGUFValueType.STRING, key)[4:] + self._pack(vtype, val, item_type)
+
+    def delete(self, key: str) -> None:
+        if key == Keys.General.ALIGNMENT:
+            raise ValueError('Changing the alignment would move the tensor data, convert the model again instead')
+        if not self.has_key(key):
+            raise KeyError(f'No key {key} to delete')
+        if self.get_types(key) is None:
+            del self.changes[key]
+        else:
+            self.changes[key] = None
+
+    # The type followed by the value, packed in the byte order of the file.
+    def _pack(self, vtype: GGUFValueType, val: Any, item_type: GGUFValueType | None = None) -> bytes:
+        prefix = self.pack_prefix
+        packed = struct.pack(f'{prefix}I', vtype)
+        pack_fmt = GGUFWriter._simple_value_packing.get(vtype)
+        if pack_fmt is not None:
+            return packed + struct.pack(f'{prefix}{pack_fmt}', val)
+        if vtype == GGUFValueType.STRING:
+            encoded = val.encode('utf-8') if isinstance(val, str) else bytes(val)
+            return packed + struct.pack(f'{prefix}Q', len(encoded)) + encoded
+        if vtype != GGUFValueType.ARRAY:
+            raise ValueError(f'Invalid GGUF metadata value type {vtype}')
+        if item_type is None or item_type == GGUFValueType.ARRAY:
+            raise ValueError('Arrays need an item type other than array')
+        if not isinstance(val, (Sequence, np.ndarray)) or isinstance(val, (str, bytes)):
+            raise ValueError('Value must be a sequence for array type')
+        parts = [packed, struct.pack(f'{prefix}IQ', item_type, len(val))]
+        item_fmt = GGUFWriter._simple_value_packing.get(item_type)
+        if item_fmt is not None:
+            parts.append(GGUFWriter._pack_array(val, f'{prefix}{item_fmt}'))
+        else:
+            # Without the type of every item
+            parts += (self._pack(item_type, item)[4:] for item in val)
+        return b''.join(parts)
+
+    def _kv_size(self, offs: int) -> int:
+        klen = self.reader._get_int(offs, 'Q')
+        raw_type = self.reader._get_int(offs + 8 + klen, 'I')
+        return 12 + klen + self.reader._get_field_size(offs + 12 + klen, raw_type)
+
+    # The new header, without the padding up to the tensor data.
+    def build_header(self) -> bytes:
+        reader = self.reader
+        kv_parts: list[bytes] = []
+        kv_end = 24
+        for key, field in OrderedDict.items(reader.fields):
+            if key.startswith('GGUF.'):
+                continue
+            offs = field.offset if not isinstance(field, int) else field
+            kv_end = offs + self._kv_size(offs)
+            packed = self.changes.get(key, reader.data[offs:kv_end].tobytes())
+            if packed is not None:
+                kv_parts.append(packed)
+        for key, packed in self.changes.items():
+            if packed is not None and key not in reader.fields:
+                kv_parts.append(packed)
+        ti_end = kv_end
+        if reader.tensors:
+            last = reader.tensors[-1].field
+            ti_end = last.offset + sum(int(part.nbytes) for part in last.parts)
+        counts = struct.pack(f'{self.pack_prefix}QQ', len(reader.tensors), len(kv_parts))
+        return b''.join([reader.data[:8].tobytes(), counts, *kv_parts, reader.data[kv_end:ti_end].tobytes()])
+
+    # Write the edited file, over the original or to path. Returns True when the
+    # header could be rewritten in place.
+    def write(self, path: os.PathLike[str] | str | None = None) -> bool:
+        reader = self.reader
+        header = self.build_header()
+        data_offset = GGUFWriter.ggml_pad(len(header), reader.alignment)
+        header += bytes(data_offset - len(header))
+        out_path = self.path if path is None else os.fspath(path)
+        same_file = os.path.exists(out_path) and os.path.samefile(out_path, self.path)
+        if same_file and data_offset == reader.data_offset:
+            with open(out_path, 'r+b') as fout:
+                fout.write(header)
+            return True
+        # Written next to the output and then renamed, so the original stays intact on errors
+        fd, temp_path = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(out_path)), suffix = '.tmp')
+        try:
+            with open(fd, 'wb') as fout, open(self.path, 'rb') as fin:
+                fout.write(header)
+                copy_file_data(fin, fout, reader.data_offset, len(reader.data) - reader.data_offset)
+            os.chmod(temp_path, os.stat(self.path).st_mode & 0o7777)
+            os.replace(temp_path, out_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return False
@@ -4,9 +4,16 @@
 #
 from __future__ import annotations
 
+import hashlib
 import os
+import re
+import struct
+import sys
 from collections import OrderedDict
-from typing import Any, Literal, NamedTuple, TypeVar, Union
+from collections.abc import Collection, ItemsView, Iterable, Iterator, ValuesView
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+from typing import Any, Callable, Literal, NamedTuple, TypeVar, Union
 
 import numpy as np
 import numpy.typing as npt
@@ -22,14 +29,22 @@ from gguf.constants import (
     GGML_QUANT_SIZES,
     GGUF_DEFAULT_ALIGNMENT,
     GGUF_MAGIC,
+    GGUF_SPLIT_PATH,
+    GGUF_TENSOR_HASH_SIZE,
     GGUF_VERSION,
     GGMLQuantizationType,
+    GGUFEndian,
     GGUFValueType,
+    Keys,
 )
+from gguf.quants import dequantize
 
 
 READER_SUPPORTED_VERSIONS = [2, GGUF_VERSION]
 
+# Matches the block number in per-block tensor names like blk.17.attn_q.weight
+READER_BLOCK_TENSOR_NAME = re.compile(r'blk\.(\d+)\.')
+
 
 class ReaderField(NamedTuple):
     # Offset to start of this field.
@@ -57,14 +72,132 @@ class ReaderTensor(NamedTuple):
     n_elements: int
     n_bytes: int
     data_offset: int
-    data: npt.NDArray[Any]
+    # None when the file was opened with header_only.
+    data: Union[npt.NDArray[Any], None]
     field: ReaderField
+    # Index of the file with the data in a split model, data_offset is relative to its start.
+    shard: int = 0
+    # Byte order of the values in the blocks of quantized data.
+    endianess: GGUFEndian = GGUFEndian.LITTLE
+
+    # Dequantize the tensor (or a slice of its rows) to float32. The result has
+    # one row per row of the tensor, the row length is the first dimension in shape.
+    # Only the selected rows are read, so this works on mapped data of any size.
+    def dequantize(self, rows: slice | None = None) -> npt.NDArray[np.float32]:
+        if self.data is None:
+            raise ValueError(f'Tensor {self.name} has no data')
+        n_rows = int(self.n_elements) // int(self.shape[0])
+        block_size, type_size = GGML_QUANT_SIZES[self.tensor_type]
+        row_items = int(self.shape[0]) // block_size * (type_size if self.data.dtype == np.uint8 else block_size)
+        data = self.data.reshape(n_rows, row_items)
+        return dequantize(data if rows is None else data[rows], self.tensor_type, self.endianess)
+
+    # Hash of the data as stored in the file, like the ones in general.tensor_hashes.
+    def content_hash(self) -> str:
+        if self.data is None:
+            raise ValueError(f'Tensor {self.name} has no data')
+        data = self.data.reshape(-1).view(np.uint8)
+        return hashlib.blake2b(data, digest_size = GGUF_TENSOR_HASH_SIZE).hexdigest()
+
+
+class ReaderStringArray(NamedTuple):
+    # Start of each string in data, followed by the end of the last string.
+    # String n is therefore data[offsets[n]:offsets[n + 1]].
+    offsets: npt.NDArray[np.uint64]
+
+    # The string contents with the length prefixes removed, back to back.
+    data: npt.NDArray[np.uint8]
+
+    def as_bytes(self) -> list[bytes]:
+        buf = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        return [buf[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def as_str(self) -> list[str]:
+        return [str(item, encoding = 'utf-8') for item in self.as_bytes()]
+
+
+class LazyFieldDict(OrderedDict):  # type: ignore[type-arg]
+    # Behaves like OrderedDict[str, ReaderField], but entries may hold just the
+    # file offset of a key/value pair. Such an entry is parsed into a ReaderField
+    # the first time it is looked up and the result replaces the offset.
+    def __init__(self, loader: Callable[[int], ReaderField]):
+        super().__init__()
+        self._loader = loader
+
+    def __getitem__(self, key: str) -> ReaderField:
+        val = super().__getitem__(key)
+        if isinstance(val, ReaderField):
+            return val
+        field = self._loader(val)
+        super().__setitem__(key, field)
+        return field
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def values(self) -> ValuesView[ReaderField]:  # type: ignore[override]
+        return ValuesView(self)
+
+    def items(self) -> ItemsView[str, ReaderField]:  # type: ignore[override]
+        return ItemsView(self)
+
+
+class LazyTensorList(list):  # type: ignore[type-arg]
+    # Behaves like list[ReaderTensor] for the tensors of a split model. Entries of shards
+    # that aren't mapped yet have no data, looking one of them up maps its shard through
+    # the loader, which replaces the entries of all the tensors in it.
+    def __init__(self, tensors: list[ReaderTensor], loader: Callable[[int], None]):
+        super().__init__(tensors)
+        self._loader = loader
+
+    def __getitem__(self, idx: Any) -> Any:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        tensor = super().__getitem__(idx)
+        if tensor.data is None:
+            self._loader(tensor.shard)
+            tensor = super().__getitem__(idx)
+        return tensor
+
+    def __iter__(self) -> Iterator[ReaderTensor]:
+        return (self[i] for i in range(len(self)))
+
+
+class LazyTensorDict(dict):  # type: ignore[type-arg]
+    # Same as LazyTensorList, for tensor_names.
+    def __init__(self, tensors: dict[str, ReaderTensor], loader: Callable[[int], None]):
+        super().__init__(tensors)
+        self._loader = loader
+
+    def __getitem__(self, key: str) -> ReaderTensor:
+        tensor = super().__getitem__(key)
+        if tensor.data is None:
+            self._loader(tensor.shard)
+            tensor = super().__getitem__(key)
+        return tensor
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def values(self) -> ValuesView[ReaderTensor]:  # type: ignore[override]
+        return ValuesView(self)
+
+    def items(self) -> ItemsView[str, ReaderTensor]:  # type: ignore[override]
+        return ItemsView(self)
 
 
 class GGUFReader:
     # I - same as host, S - swapped
     byte_order: Literal['I' | 'S'] = 'I'
     alignment: int = GGUF_DEFAULT_ALIGNMENT
+    # When set, key/value fields are only located at open time and parsed on first access.
+    lazy: bool = False
+    # When set, only the header up to the end of the tensor info is read (into memory,
+    # the file isn't mapped) and tensors have no data.
+    header_only: bool = False
+    # Initial amount of data read in header only mode, doubled until the header fits.
+    header_read_size: int = 1024 * 1024
 
     # Note: Internal helper, API may change.
     gguf_scalar_to_np: dict[GGUFValueType, type[np.generic]] = {
@@ -81,8 +214,34 @@ class GGUFReader:
         GGUFValueType.BOOL:    np.bool_,
     }
 
-    def __init__(self, path: os.PathLike[str] | str, mode: Literal['r' | 'r+' | 'c'] = 'r'):
-        self.data = np.memmap(path, mode = mode)
+    def __init__(
+        self, path: os.PathLike[str] | str, mode: Literal['r' | 'r+' | 'c'] = 'r', lazy: bool = False,
+        header_only: bool = False, split: bool = True,
+    ):
+        self.lazy = lazy
+        self.header_only = header_only
+        self.mode = mode
+        if not header_only:
+            self.data = np.memmap(path, mode = mode)
+            self._build()
+        else:
+            if mode != 'r':
+                raise ValueError('Header only mode is read only')
+            with open(path, 'rb') as fp:
+                buf = fp.read(self.header_read_size)
+                while True:
+                    self.data = np.frombuffer(buf, dtype = np.uint8)
+                    try:
+                        self._build()
+                        break
+                    except EOFError:
+                        chunk = fp.read(len(buf))
+                        if not chunk:
+                            raise
+                        buf += chunk
+        self._build_split(os.fspath(path), split)
+
+    def _build(self) -> None:
         offs = 0
         if self._get(offs, np.uint32, override_order = '<')[0] != GGUF_MAGIC:
             raise ValueError('GGUF magic invalid')
@@ -96,8 +255,9 @@ class GGUFReader:
         version = temp_version[0]
         if version not in READER_SUPPORTED_VERSIONS:
             raise ValueError(f'Sorry, file appears to be version {version} which we cannot handle')
-        self.fields: OrderedDict[str, ReaderField] = OrderedDict()
+        self.fields: OrderedDict[str, ReaderField] = LazyFieldDict(self._load_field) if self.lazy else OrderedDict()
         self.tensors: list[ReaderTensor] = []
+        self.tensor_names: dict[str, ReaderTensor] = {}
         offs += self._push_field(ReaderField(offs, 'GGUF.version', [temp_version], [0], [GGUFValueType.UINT32]))
         temp_counts = self._get(offs, np.uint64, 2)
         offs += self._push_field(ReaderField(offs, 'GGUF.tensor_count', [temp_counts[:1]], [0], [GGUFValueType.UINT64]))
@@ -107,36 +267,216 @@ class GGUFReader:
         offs, tensors_fields = self._build_tensors_fields(offs, tensor_count)
         new_align = self.fields.get('general.alignment')
         if new_align is not None:
-            if new_align.types != [GGUFValueType.UINT64]:
+            if new_align.types not in ([GGUFValueType.UINT32], [GGUFValueType.UINT64]):
                 raise ValueError('Bad type for general.alignment field')
-            self.alignment = new_align.parts[-1][0]
+            self.alignment = int(new_align.parts[-1][0])
         padding = offs % self.alignment
         if padding != 0:
             offs += self.alignment - padding
+        self.data_offset = offs
         self._build_tensors(offs, tensors_fields)
 
+    # Opening the first file of a split model presents all of its files as one model: the
+    # fields are the ones of the first file, which has all the metadata, and tensors has the
+    # tensors of all the files. Only the headers of the other files are read here, a file is
+    # mapped when one of its tensors is first looked up. The other files, and the first
+    # one when split is False, are read like any other file.
+    def _build_split(self, path: str, split: bool) -> None:
+        self.split_paths = [path]
+        self.shards: list[Union[GGUFReader, None]] = [self]
+        count = self._get_field_int(Keys.Split.COUNT)
+        if not split or count is None or count <= 1 or self._get_field_int(Keys.Split.NO) != 0:
+            return
+        first_suffix = GGUF_SPLIT_PATH.format(prefix = '', no = 1, count = count)
+        if not path.endswith(first_suffix):
+            # Renamed, the other files can't be found: only the tensors of this one are usable
+            print(
+                f'gguf: WARNING: {path} is file 1 of {count} of a split model but its name doesn\'t end with {first_suffix},'
+                ' only reading its own tensors',
+                file = sys.stderr,
+            )
+            return
+        prefix = path[:-len(first_suffix)]
+        per_shard = self.get_array(Keys.Split.TENSORS_PER_SHARD)
+        if per_shard is None or len(per_shard) != count or int(per_shard[0]) != len(self.tensors):
+            raise ValueError('Bad split.tensors.per_shard field')
+        tensors = list(self.tensors)
+        for no in range(1, count):
+            shard_path = GGUF_SPLIT_PATH.format(prefix = prefix, no = no + 1, count = count)
+            header = GGUFReader(shard_path, header_only = True)
+            if header._get_field_int(Keys.Split.NO) != no or header._get_field_int(Keys.Split.COUNT) != count:
+                raise ValueError(f'{shard_path} is not file {no + 1} of {count} of the split model')
+            if len(header.tensors) != per_shard[no]:
+                raise ValueError(f'Expected {per_shard[no]} tensors in {shard_path}, got {len(header.tensors)}')
+            tensors += (tensor._replace(shard = no) for tensor in header.tensors)
+            self.split_paths.append(shard_path)
+            self.shards.append(None)
+        tensor_names: dict[str, ReaderTensor] = {}
+        for tensor in tensors:
+            if tensor.name in tensor_names:
+                raise KeyError(f'Duplicate tensor {tensor.name} in file {tensor.shard + 1} of the split model')
+            tensor_names[tensor.name] = tensor
+        if self.header_only:
+            self.tensors, self.tensor_names = tensors, tensor_names
+            return
+        self.tensors = LazyTensorList(tensors, self._map_shard)
+        self.tensor_names = LazyTensorDict(tensor_names, self._map_shard)
+
+    def _map_shard(self, no: int) -> None:
+        shard = GGUFReader(self.split_paths[no], mode = self.mode, lazy = True)
+        start = sum(1 for tensor in list.__iter__(self.tensors) if tensor.shard < no)
+        for idx, tensor in enumerate(shard.tensors, start):
+            tensor = tensor._replace(shard = no)
+            list.__setitem__(self.tensors, idx, tensor)
+            dict.__setitem__(self.tensor_names, tensor.name, tensor)
+        self.shards[no] = shard
+
+    def _get_field_int(self, key: str) -> Union[int, None]:
+        field = self.fields.get(key)
+        if field is None:
+            return None
+        return int(field.parts[field.data[0]][0])
+
     _DT = TypeVar('_DT', bound = npt.DTypeLike)
 
     # Fetch a key/value metadata field by key.
     def get_field(self, key: str) -> Union[ReaderField, None]:
         return self.fields.get(key, None)
 
+    # Fetch the items of an array of simple scalars, as a single array. Unlike
+    # going through fields this doesn't create a part for every item.
+    def get_array(self, key: str) -> Union[npt.NDArray[Any], None]:
+        offs = self._get_array_offset(key)
+        if offs is None:
+            return None
+        raw_itype = self._get_int(offs, 'I')
+        nptype = self.gguf_scalar_to_np.get(GGUFValueType(raw_itype))
+        if nptype is None:
+            raise ValueError(f'Field {key} is not an array of simple scalars')
+        return self._get(offs + 12, nptype, self._get_int(offs + 4, 'Q'))
+
+    # Fetch the items of an array of strings in one go. The length prefixes are
+    # scanned in one pass, the string data is gathered with a single copy.
+    def get_string_array(self, key: str) -> Union[ReaderStringArray, None]:
+        offs = self._get_array_offset(key)
+        if offs is None:
+            return None
+        if self._get_int(offs, 'I') != GGUFValueType.STRING:
+            raise ValueError(f'Field {key} is not an array of strings')
+        alen = self._get_int(offs + 4, 'Q')
+        start_offs = offs = offs + 12
+        unpack_len = struct.Struct(self._get_struct_order() + 'Q').unpack_from
+        buf = memoryview(self.data)
+        prefix_offs = []
+        for _ in range(alen):
+            prefix_offs.append(offs - start_offs)
+            offs += 8 + unpack_len(buf, offs)[0]
+        prefixes = np.array(prefix_offs, dtype = np.int64)
+        keep = np.ones(offs - start_offs, dtype = np.bool_)
+        keep[(prefixes[:, None] + np.arange(8)).ravel()] = False
+        lengths = np.diff(np.append(prefixes, offs - start_offs)) - 8
+        offsets = np.zeros(alen + 1, dtype = np.uint64)
+        np.cumsum(lengths, out = offsets[1:])
+        return ReaderStringArray(offsets, np.asarray(self.data[start_offs:offs])[keep])
+
+    # Fetch the hashes in general.tensor_hashes by tensor name, for all the files of a
+    # split model. Tensors of files without hashes are left out.
+    def get_tensor_hashes(self) -> dict[str, str]:
+        hashes: dict[str, str] = {}
+        for no, path in enumerate(self.split_paths):
+            shard = self.shards[no] or GGUFReader(path, header_only = True)
+            items = shard.get_string_array(Keys.General.TENSOR_HASHES)
+            if items is None:
+                continue
+            names = [tensor.name for tensor in list.__iter__(self.tensors) if tensor.shard == no]
+            if len(items.offsets) - 1 != len(names):
+                raise ValueError(f'Expected {len(names)} tensor hashes in {path}, got {len(items.offsets) - 1}')
+            hashes.update(zip(names, items.as_str()))
+        return hashes
+
+    # Check the data of tensors (all of them by default) against general.tensor_hashes, in up
+    # to threads threads. Returns the names of the tensors with data that doesn't match.
+    def verify_tensors(self, tensors: Iterable[ReaderTensor] | None = None, threads: int | None = None) -> list[str]:
+        hashes = self.get_tensor_hashes()
+        selected = list(self.tensors if tensors is None else tensors)
+        for tensor in selected:
+            if tensor.name not in hashes:
+                raise ValueError(f'The file has no hash for tensor {tensor.name}')
+        with ThreadPoolExecutor(threads) as executor:
+            matches = list(executor.map(lambda tensor: tensor.content_hash() == hashes[tensor.name], selected))
+        return [tensor.name for tensor, match in zip(selected, matches) if not match]
+
     # Fetch a tensor from the list by index.
     def get_tensor(self, idx: int) -> ReaderTensor:
         return self.tensors[idx]
 
+    # Fetch a tensor by name.
+    def get_tensor_by_name(self, name: str) -> Union[ReaderTensor, None]:
+        return self.tensor_names.get(name, None)
+
+    # Fetch tensors in file order, filtered by name and block number. The name
+    # pattern is a glob (like ffn_*) unless regex is set, and has to match the
+    # whole name. blocks may be a single block number or a collection of them.
+    def select_tensors(
+        self, pattern: str | None = None, blocks: int | Collection[int] | None = None, regex: bool = False,
+    ) -> list[ReaderTensor]:
+        if isinstance(blocks, int):
+            blocks = (blocks,)
+        compiled = re.compile(pattern) if regex and pattern is not None else None
+        selected = []
+        # Only the selected tensors of a split model get their files mapped.
+        for idx, tensor in enumerate(list.__iter__(self.tensors)):
+            if blocks is not None:
+                match = READER_BLOCK_TENSOR_NAME.match(tensor.name)
+                if match is None or int(match.group(1)) not in blocks:
+                    continue
+            if compiled is not None:
+                if compiled.fullmatch(tensor.name) is None:
+                    continue
+            elif pattern is not None and not fnmatchcase(tensor.name, pattern):
+                continue
+            selected.append(self.tensors[idx])
+        return selected
+
     def _get(
         self, offset: int, dtype: npt.DTypeLike, count: int = 1, override_order: None | Literal['I' | 'S' | '<'] = None,
     ) -> npt.NDArray[Any]:
         count = int(count)
         itemsize = int(np.empty([], dtype = dtype).itemsize)
         end_offs = offset + itemsize * count
+        if end_offs > len(self.data):
+            raise EOFError(f'Unexpected end of data reading {count} item(s) at offset {offset}')
         return (
             self.data[offset:end_offs]
             .view(dtype = dtype)[:count]
             .newbyteorder(override_order or self.byte_order)
         )
 
+    # Read a single unsigned integer using struct format character fmt without
+    # creating an array view. Used when only the value matters, not the part.
+    def _get_int(self, offset: int, fmt: str) -> int:
+        try:
+            return struct.unpack_from(self._get_struct_order() + fmt, self.data, offset)[0]
+        except struct.error:
+            raise EOFError(f'Unexpected end of data reading {fmt} at offset {offset}') from None
+
+    def _get_struct_order(self) -> str:
+        if self.byte_order == 'I':
+            return '='
+        return '>' if sys.byteorder == 'little' else '<'
+
+    # Offset of the array value of a key/value field (the item type), or None
+    # if the key doesn't exist. Doesn't cause lazy fields to get parsed.
+    def _get_array_offset(self, key: str) -> Union[int, None]:
+        field = OrderedDict.get(self.fields, key)
+        if field is None:
+            return None
+        orig_offs = field.offset if isinstance(field, ReaderField) else field
+        offs = orig_offs + 8 + self._get_int(orig_offs, 'Q')
+        if self._get_int(offs, 'I') != GGUFValueType.ARRAY:
+            raise ValueError(f'Field {key} is not an array')
+        return offs + 4
+
     def _push_field(self, field: ReaderField, skip_sum: bool = False) -> int:
         if field.name in self.fields:
             raise KeyError(f'Duplicate {field.name} already in list at offset {field.offset}')
@@ -203,25 +543,67 @@ class GGUFReader:
             [1, 3, 4, 5],
         )
 
+    # Size in bytes of a field value of the specified type, without parsing it.
+    def _get_field_size(self, offs: int, raw_type: int) -> int:
+        gtype = GGUFValueType(raw_type)
+        if gtype == GGUFValueType.STRING:
+            return 8 + self._get_int(offs, 'Q')
+        nptype = self.gguf_scalar_to_np.get(gtype)
+        if nptype is not None:
+            return np.dtype(nptype).itemsize
+        if gtype == GGUFValueType.ARRAY:
+            raw_itype = self._get_int(offs, 'I')
+            alen = self._get_int(offs + 4, 'Q')
+            size = 12
+            item_nptype = self.gguf_scalar_to_np.get(GGUFValueType(raw_itype))
+            if item_nptype is not None:
+                return size + alen * np.dtype(item_nptype).itemsize
+            for _ in range(alen):
+                size += self._get_field_size(offs + size, raw_itype)
+            return size
+        raise ValueError(f'Unknown/unhandled field type {gtype}')
+
+    def _load_field(self, orig_offs: int) -> ReaderField:
+        return self._build_field(orig_offs)[0]
+
+    def _build_field(self, orig_offs: int) -> tuple[ReaderField, int]:
+        offs = orig_offs
+        kv_klen, kv_kdata = self._get_str(offs)
+        offs += int(kv_klen.nbytes + kv_kdata.nbytes)
+        raw_kv_type = self._get(offs, np.uint32)
+        offs += int(raw_kv_type.nbytes)
+        parts: list[npt.NDArray[Any]] = [kv_klen, kv_kdata, raw_kv_type]
+        idxs_offs = len(parts)
+        field_size, field_parts, field_idxs, field_types = self._get_field_parts(offs, raw_kv_type[0])
+        parts += field_parts
+        field = ReaderField(
+            orig_offs,
+            str(bytes(kv_kdata), encoding = 'utf-8'),
+            parts,
+            [idx + idxs_offs for idx in field_idxs],
+            field_types,
+        )
+        return field, offs + field_size - orig_offs
+
     def _build_fields(self, offs: int, count: int) -> int:
         for _ in range(count):
+            if not self.lazy:
+                field, field_size = self._build_field(offs)
+                self._push_field(field, skip_sum = True)
+                offs += field_size
+                continue
             orig_offs = offs
-            kv_klen, kv_kdata = self._get_str(offs)
-            offs += int(kv_klen.nbytes + kv_kdata.nbytes)
-            raw_kv_type = self._get(offs, np.uint32)
-            offs += int(raw_kv_type.nbytes)
-            parts: list[npt.NDArray[Any]] = [kv_klen, kv_kdata, raw_kv_type]
-            idxs_offs = len(parts)
-            field_size, field_parts, field_idxs, field_types = self._get_field_parts(offs, raw_kv_type[0])
-            parts += field_parts
-            self._push_field(ReaderField(
-                orig_offs,
-                str(bytes(kv_kdata), encoding = 'utf-8'),
-                parts,
-                [idx + idxs_offs for idx in field_idxs],
-                field_types,
-            ), skip_sum = True)
-            offs += field_size
+            klen = self._get_int(offs, 'Q')
+            offs += 8
+            name = str(bytes(self._get(offs, np.uint8, klen)), encoding = 'utf-8')
+            offs += klen
+            raw_kv_type = self._get_int(offs, 'I')
+            offs += 4
+            if name in self.fields:
+                raise KeyError(f'Duplicate {name} already in list at offset {orig_offs}')
+            # Store the offset, the field gets parsed when it is first accessed.
+            OrderedDict.__setitem__(self.fields, name, orig_offs)
+            offs += self._get_field_size(offs, raw_kv_type)
         return offs
 
     def _build_tensors_fields(self, offs: int, count: int) -> tuple[int, list[ReaderField]]:
@@ -234,6 +616,9 @@ class GGUFReader:
 
     def _build_tensors(self, start_offs: int, fields: list[ReaderField]) -> None:
         tensors = []
+        tensor_names: dict[str, ReaderTensor] = {}
+        file_little = (sys.byteorder == 'little') == (self.byte_order == 'I')
+        endianess = GGUFEndian.LITTLE if file_little else GGUFEndian.BIG
         for field in fields:
             _name_len, name_data, _n_dims, dims, raw_dtype, offset_tensor = field.parts
             ggml_type = GGMLQuantizationType(raw_dtype[0])
@@ -258,7 +643,12 @@ class GGUFReader:
                 n_elements = n_elems,
                 n_bytes = n_bytes,
                 data_offset = data_offs,
-                data = self._get(data_offs, item_type, item_count),
+                data = None if self.header_only else self._get(data_offs, item_type, item_count),
                 field = field,
+                endianess = endianess,
             ))
+            if tensors[-1].name in tensor_names:
+                raise KeyError(f'Duplicate tensor {tensors[-1].name} at offset {field.offset}')
+            tensor_names[tensors[-1].name] = tensors[-1]
         self.tensors = tensors
+        self.tensor_names = tensor_names
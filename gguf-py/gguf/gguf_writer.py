@@ -1,24 +1,35 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import os
+import re
 import shutil
 import struct
 import tempfile
+import threading
+import zlib
 from enum import Enum, auto
-from io import BufferedWriter
-from typing import IO, Any, Sequence
+from io import BufferedRandom, BufferedWriter
+from typing import IO, Any, NamedTuple, Sequence
 
 import numpy as np
 
 from .constants import (
     GGUF_DEFAULT_ALIGNMENT,
     GGUF_MAGIC,
+    GGUF_SPLIT_PATH,
+    GGUF_TENSOR_HASH_SIZE,
+    GGUF_TENSOR_HASH_TYPE,
     GGUF_VERSION,
+    MODEL_TENSOR_EXECUTION_ORDER,
+    TENSOR_NAMES,
     GGMLQuantizationType,
     GGUFEndian,
     GGUFValueType,
     Keys,
     RopeScalingType,
+    TensorDataLayout,
     TokenType,
 )
 
@@ -30,10 +41,37 @@ class WriterState(Enum):
     TI_DATA = auto()
 
 
+class WriterTensorInfo(NamedTuple):
+    offset: int  # Relative to the start of the tensor data
+    nbytes: int
+
+
+# Tensors can be written in two ways:
+#  - add_tensor() for every tensor, then write_header_to_file(), write_kv_data_to_file()
+#    and write_tensors_to_file(). The tensor data is kept in memory or in a temporary file
+#    until the header is written.
+#  - add_tensor_info() for every tensor, then write_header_to_file(), write_kv_data_to_file(),
+#    write_ti_data_to_file() and write_tensor_data() for every tensor in the same order.
+#    The tensor data goes straight to its final place in the output file.
+#    write_tensor_data_at() can be used instead of write_tensor_data() to write the
+#    tensors in any order, possibly from several threads at once.
+#    With add_tensor_data_order() the tensor data can be placed in another order than the tensors
+#    were added, e.g. in the order they are used. The tensor info keeps the order, but
+#    write_tensor_data() takes the tensors in the order of their data, see tensor_write_order.
+# With journal=True, write_tensor_data_at() records every completed tensor with its
+# checksum in a journal next to the output file, which is removed once all tensors
+# are written. A writer created with resume=True for the same path and the same
+# metadata and tensor infos then keeps the tensors whose data still matches the
+# journal, they are already in tensors_written after write_ti_data_to_file().
+# With tensor_hashes=True the file gets general.tensor_hashes with a hash of the data of
+# every tensor. The hashes are filled in by close(): the ones of tensors written with
+# write_tensor_data() or write_tensor_data_at(), or passed to tensor_data_written(), are
+# computed from the data as it is written, the others are computed from the file.
 class GGUFWriter:
-    fout: BufferedWriter
+    fout: BufferedWriter | BufferedRandom
     temp_file: tempfile.SpooledTemporaryFile[bytes] | None
     tensors: list[np.ndarray[Any, Any]]
+    tensor_infos: dict[str, WriterTensorInfo]
     _simple_value_packing = {
         GGUFValueType.UINT8:   "B",
         GGUFValueType.INT8:    "b",
@@ -47,20 +85,48 @@ class GGUFWriter:
         GGUFValueType.FLOAT64: "d",
         GGUFValueType.BOOL:    "?",
     }
+    _numpy_array_types = {
+        np.dtype(np.uint8):   GGUFValueType.UINT8,
+        np.dtype(np.int8):    GGUFValueType.INT8,
+        np.dtype(np.uint16):  GGUFValueType.UINT16,
+        np.dtype(np.int16):   GGUFValueType.INT16,
+        np.dtype(np.uint32):  GGUFValueType.UINT32,
+        np.dtype(np.int32):   GGUFValueType.INT32,
+        np.dtype(np.float32): GGUFValueType.FLOAT32,
+        np.dtype(np.uint64):  GGUFValueType.UINT64,
+        np.dtype(np.int64):   GGUFValueType.INT64,
+        np.dtype(np.float64): GGUFValueType.FLOAT64,
+        np.dtype(np.bool_):   GGUFValueType.BOOL,
+    }
 
     def __init__(
         self, path: os.PathLike[str] | str, arch: str, use_temp_file: bool = True,
-        endianess: GGUFEndian = GGUFEndian.LITTLE,
+        endianess: GGUFEndian = GGUFEndian.LITTLE, journal: bool = False, resume: bool = False,
+        tensor_hashes: bool = False,
     ):
-        self.fout = open(path, "wb")
+        self.path = os.fspath(path)
+        self.resuming = resume and os.path.exists(path)
+        self.fout = open(path, "r+b" if self.resuming else "wb")
+        self.journal_path = f"{os.fspath(path)}.journal" if journal or resume else None
+        self.journal: IO[str] | None = None
         self.arch = arch
         self.endianess = endianess
         self.offset_tensor = 0
         self.data_alignment = GGUF_DEFAULT_ALIGNMENT
+        self.data_layout = TensorDataLayout.ADDED
         self.kv_data = bytearray()
         self.kv_data_count = 0
         self.ti_data = bytearray()
         self.ti_data_count = 0
+        self.tensor_infos = {}
+        self.tensor_ti_entries: dict[str, bytes] = {}
+        self.tensor_write_order: list[str] = []
+        self.n_tensors_written = 0
+        self.tensors_written: set[str] = set()
+        self.write_lock = threading.Lock()
+        self.data_offset = 0
+        self.tensor_hashes: dict[str, str] | None = {} if tensor_hashes else None
+        self.tensor_hashes_offset = 0
         self.use_temp_file = use_temp_file
         self.temp_file = None
         self.tensors = []
@@ -75,6 +141,10 @@ class GGUFWriter:
         if self.state is not WriterState.EMPTY:
             raise ValueError(f'Expected output file to be empty, got {self.state}')
 
+        if self.data_layout is not TensorDataLayout.ADDED:
+            self.layout_tensor_data()
+        if self.tensor_hashes is not None and self.tensor_infos:
+            self.reserve_tensor_hashes()
         self._write_packed("<I", GGUF_MAGIC, skip_pack_prefix = True)
         self._write_packed("I", GGUF_VERSION)
         self._write_packed("Q", self.ti_data_count)
@@ -95,8 +165,102 @@ class GGUFWriter:
             raise ValueError(f'Expected output file to contain KV data, got {self.state}')
 
         self.fout.write(self.ti_data)
+        self.write_padding(self.fout, self.fout.tell())
         self.flush()
+        self.data_offset = self.fout.tell()
+        self.tensor_write_order = sorted(self.tensor_infos, key=lambda name: self.tensor_infos[name].offset)
         self.state = WriterState.TI_DATA
+        if self.journal_path is not None:
+            self.open_journal()
+
+    def open_journal(self) -> None:
+        # The first line identifies the metadata, the others are the written tensors
+        header = {
+            "data_offset": self.data_offset,
+            "endianess": self.endianess.name,
+            "metadata_crc32": zlib.crc32(self.ti_data, zlib.crc32(self.kv_data)),
+        }
+        assert self.journal_path is not None
+        entries: list[dict[str, Any]] = []
+        if self.resuming and os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+            try:
+                if lines and json.loads(lines[0]) == header:
+                    for line in lines[1:]:
+                        entry = json.loads(line)
+                        if self._journal_entry_is_valid(entry):
+                            entries.append(entry)
+                            self.tensors_written.add(entry["name"])
+            except json.JSONDecodeError:
+                # The last line may have been cut short, the ones before it are still usable
+                pass
+            self.n_tensors_written = len(self.tensors_written)
+        if self.resuming:
+            # Without usable entries all the old tensor data is dropped. Otherwise the file is only
+            # given its full size, in case it was cut short: the data of the tensors that aren't in
+            # the journal stays until they are written again, which overwrites all of it, and the
+            # padding between tensors is never written so it is still zeros
+            self.fout.truncate(self.data_offset if not entries else self.data_offset + self.offset_tensor)
+
+        self.journal = open(self.journal_path, "w", encoding="utf-8")
+        self.journal.write(json.dumps(header) + "\n")
+        for entry in entries:
+            self.journal.write(json.dumps(entry) + "\n")
+        self.journal.flush()
+
+    def _journal_entry_is_valid(self, entry: dict[str, Any]) -> bool:
+        info = self.tensor_infos.get(entry["name"])
+        if info is None or entry["name"] in self.tensors_written:
+            return False
+        if (entry["offset"], entry["nbytes"]) != (info.offset, info.nbytes):
+            return False
+        # Check the data in the file, the journal entry could have been written before the data reached the disk
+        self.fout.seek(self.data_offset + info.offset)
+        checksum = 0
+        remaining = info.nbytes
+        while remaining > 0:
+            chunk = self.fout.read(min(remaining, 16 * 1024 * 1024))
+            if not chunk:
+                return False
+            checksum = zlib.crc32(chunk, checksum)
+            remaining -= len(chunk)
+        return checksum == entry["crc32"]
+
+    def reserve_tensor_hashes(self) -> None:
+        # The hashes are only known once the tensor data is written, the array gets
+        # placeholders of the same size which are overwritten by close()
+        self.add_string(Keys.General.TENSOR_HASH_TYPE, GGUF_TENSOR_HASH_TYPE)
+        self.add_key(Keys.General.TENSOR_HASHES)
+        # After the header, the value type, the item type and the item count
+        self.tensor_hashes_offset = 24 + len(self.kv_data) + 16
+        self.add_val(["0" * 2 * GGUF_TENSOR_HASH_SIZE] * len(self.tensor_infos), GGUFValueType.ARRAY)
+
+    def write_tensor_hashes(self) -> None:
+        assert self.tensor_hashes is not None
+        missing = [name for name in self.tensor_infos if name not in self.tensor_hashes]
+        if missing:
+            with open(self.path, "rb") as f:
+                for name in missing:
+                    info = self.tensor_infos[name]
+                    f.seek(self.data_offset + info.offset)
+                    content_hash = hashlib.blake2b(digest_size = GGUF_TENSOR_HASH_SIZE)
+                    remaining = info.nbytes
+                    while remaining > 0:
+                        chunk = f.read(min(remaining, 16 * 1024 * 1024))
+                        if not chunk:
+                            raise ValueError(f'Tensor {name} is missing data')
+                        content_hash.update(chunk)
+                        remaining -= len(chunk)
+                    self.tensor_hashes[name] = content_hash.hexdigest()
+        item_size = 8 + 2 * GGUF_TENSOR_HASH_SIZE
+        for idx, name in enumerate(self.tensor_infos):
+            self.fout.seek(self.tensor_hashes_offset + idx * item_size + 8)
+            self.fout.write(self.tensor_hashes[name].encode("ascii"))
+
+    @staticmethod
+    def tensor_hash(data: bytes | memoryview | np.ndarray[Any, Any]) -> str:
+        return hashlib.blake2b(data, digest_size = GGUF_TENSOR_HASH_SIZE).hexdigest()
 
     def add_key(self, key: str) -> None:
         self.add_val(key, GGUFValueType.STRING, add_vtype=False)
@@ -151,8 +315,8 @@ class GGUFWriter:
         self.add_key(key)
         self.add_val(val, GGUFValueType.STRING)
 
-    def add_array(self, key: str, val: Sequence[Any]) -> None:
-        if not isinstance(val, Sequence):
+    def add_array(self, key: str, val: Sequence[Any] | np.ndarray[Any, Any]) -> None:
+        if not isinstance(val, (Sequence, np.ndarray)):
             raise ValueError("Value must be a sequence for array type")
 
         self.add_key(key)
@@ -160,7 +324,7 @@ class GGUFWriter:
 
     def add_val(self, val: Any, vtype: GGUFValueType | None = None, add_vtype: bool = True) -> None:
         if vtype is None:
-            vtype = GGUFValueType.get_type(val)
+            vtype = GGUFValueType.ARRAY if isinstance(val, np.ndarray) else GGUFValueType.get_type(val)
 
         if add_vtype:
             self.kv_data += self._pack("I", vtype)
@@ -173,16 +337,65 @@ class GGUFWriter:
             encoded_val = val.encode("utf8") if isinstance(val, str) else val
             self.kv_data += self._pack("Q", len(encoded_val))
             self.kv_data += encoded_val
-        elif vtype == GGUFValueType.ARRAY and isinstance(val, Sequence) and val:
+        elif vtype == GGUFValueType.ARRAY and isinstance(val, (Sequence, np.ndarray)) and len(val):
+            self.add_array_items(val)
+        else:
+            raise ValueError("Invalid GGUF metadata value type or value")
+
+    def add_array_items(self, val: Sequence[Any] | np.ndarray[Any, Any]) -> None:
+        # Packs all the items of an array at once rather than one by one
+        ltype: GGUFValueType | None = None
+        if isinstance(val, np.ndarray):
+            if val.ndim != 1:
+                raise ValueError("Only 1-dimensional NumPy arrays can be used as GGUF arrays")
+            ltype = self._numpy_array_types.get(val.dtype.newbyteorder("="))
+            if ltype is None:
+                val = val.tolist()
+        if ltype is None:
             ltype = GGUFValueType.get_type(val[0])
-            if not all(GGUFValueType.get_type(i) is ltype for i in val[1:]):
+            # Items of the same Python type always have the same GGUF type
+            if len(set(map(type, val))) > 1 and not all(GGUFValueType.get_type(i) is ltype for i in val[1:]):
                 raise ValueError("All items in a GGUF array should be of the same type")
-            self.kv_data += self._pack("I", ltype)
-            self.kv_data += self._pack("Q", len(val))
+        self.kv_data += self._pack("I", ltype)
+        self.kv_data += self._pack("Q", len(val))
+
+        pack_prefix = "<" if self.endianess == GGUFEndian.LITTLE else ">"
+        pack_fmt = self._simple_value_packing.get(ltype)
+        if pack_fmt is not None:
+            self.kv_data += GGUFWriter._pack_array(val, pack_prefix + pack_fmt)
+        elif ltype == GGUFValueType.STRING:
+            pack_len = struct.Struct(pack_prefix + "Q").pack
+            parts: list[bytes] = []
             for item in val:
-                self.add_val(item, add_vtype=False)
+                encoded_item = item.encode("utf8") if isinstance(item, str) else item
+                parts += (pack_len(len(encoded_item)), encoded_item)
+            self.kv_data += b"".join(parts)
         else:
-            raise ValueError("Invalid GGUF metadata value type or value")
+            for item in val:
+                self.add_val(item, ltype, add_vtype=False)
+
+    @staticmethod
+    def _pack_array(val: Sequence[Any] | np.ndarray[Any, Any], fmt: str) -> bytes:
+        # Packs the items of a simple type all at once. Like struct.pack(), values that don't
+        # fit the type are refused rather than wrapped around or turned into infinities
+        dtype = np.dtype(fmt)
+        if len(val) and dtype.kind in "iu":
+            if isinstance(val, np.ndarray):
+                if val.dtype.kind not in "biu":
+                    raise ValueError(f"Expected integers for an array of {dtype.name}, got {val.dtype.name}")
+                lo, hi = int(val.min()), int(val.max())
+            else:
+                if not all(isinstance(item, (int, np.integer)) for item in val):
+                    raise ValueError(f"Expected integers for an array of {dtype.name}")
+                lo, hi = int(min(val)), int(max(val))
+            info = np.iinfo(dtype)
+            if lo < info.min or hi > info.max:
+                raise ValueError(f"Array values from {lo} to {hi} don't fit in {dtype.name}")
+        elif len(val) and dtype.kind == "f":
+            values = np.asarray(val, dtype = np.float64)
+            if np.any(np.abs(values[np.isfinite(values)]) > np.finfo(dtype).max):
+                raise ValueError(f"Array values don't fit in {dtype.name}")
+        return np.asarray(val, dtype = dtype).tobytes()
 
     @staticmethod
     def ggml_pad(x: int, n: int) -> int:
@@ -197,20 +410,27 @@ class GGUFWriter:
 
         if raw_dtype is None and tensor_dtype not in (np.float32, np.float16):
             raise ValueError("Only F32 and F16 tensors are supported for now")
+        if name in self.tensor_infos:
+            raise ValueError(f'Duplicated tensor name {name}')
 
         encoded_name = name.encode("utf8")
-        self.ti_data += self._pack("Q", len(encoded_name))
-        self.ti_data += encoded_name
+        entry = bytearray()
+        entry += self._pack("Q", len(encoded_name))
+        entry += encoded_name
         n_dims = len(tensor_shape)
-        self.ti_data += self._pack("I", n_dims)
+        entry += self._pack("I", n_dims)
         for i in range(n_dims):
-            self.ti_data += self._pack("Q", tensor_shape[n_dims - 1 - i])
+            entry += self._pack("Q", tensor_shape[n_dims - 1 - i])
         if raw_dtype is None:
             dtype = GGMLQuantizationType.F32 if tensor_dtype == np.float32 else GGMLQuantizationType.F16
         else:
             dtype = raw_dtype
-        self.ti_data += self._pack("I", dtype)
+        entry += self._pack("I", dtype)
+        # The offset is left out, it changes when the tensor data is laid out
+        self.tensor_ti_entries[name] = bytes(entry)
+        self.ti_data += entry
         self.ti_data += self._pack("Q", self.offset_tensor)
+        self.tensor_infos[name] = WriterTensorInfo(self.offset_tensor, tensor_nbytes)
         self.offset_tensor += GGUFWriter.ggml_pad(tensor_nbytes, self.data_alignment)
         self.ti_data_count += 1
 
@@ -219,7 +439,7 @@ class GGUFWriter:
         raw_dtype: GGMLQuantizationType | None = None,
     ) -> None:
         if self.endianess == GGUFEndian.BIG:
-            tensor.byteswap(inplace=True)
+            tensor = tensor.byteswap(inplace=tensor.flags.writeable)
         if self.use_temp_file and self.temp_file is None:
             fp = tempfile.SpooledTemporaryFile(mode="w+b", max_size=256 * 1024 * 1024)
             fp.seek(0)
@@ -235,6 +455,44 @@ class GGUFWriter:
         tensor.tofile(self.temp_file)
         self.write_padding(self.temp_file, tensor.nbytes)
 
+    def tensor_data_order(self, names: Sequence[str]) -> list[str]:
+        if self.data_layout is TensorDataLayout.ADDED:
+            return list(names)
+
+        # Block tensors are ordered by block, the others go before or after all the blocks
+        ranks: dict[str, int] = {}
+        for rank, tensor in enumerate(MODEL_TENSOR_EXECUTION_ORDER):
+            ranks[TENSOR_NAMES[tensor].replace("blk.{bid}.", "")] = rank
+        first_block_rank = next(rank for rank, tensor in enumerate(MODEL_TENSOR_EXECUTION_ORDER) if "{bid}" in TENSOR_NAMES[tensor])
+
+        def key(idx: int) -> tuple[int, int, int, int]:
+            base = names[idx].rsplit(".", 1)[0] if names[idx].endswith((".weight", ".bias")) else names[idx]
+            match = re.fullmatch(r"blk\.(\d+)\.(.+)", base)
+            if match is not None:
+                return (1, int(match.group(1)), ranks.get(match.group(2), len(ranks)), idx)
+            rank = ranks.get(base)
+            if rank is None:
+                return (3, 0, 0, idx)
+            return (0 if rank < first_block_rank else 2, 0, rank, idx)
+
+        return [names[idx] for idx in sorted(range(len(names)), key=key)]
+
+    def layout_tensor_data(self) -> None:
+        # Places the tensor data in the order of the data layout, the tensor info keeps its order
+        if self.tensors or self.temp_file is not None:
+            raise ValueError("Only tensors added with add_tensor_info() can be laid out")
+
+        offset = 0
+        for name in self.tensor_data_order(list(self.tensor_infos)):
+            nbytes = self.tensor_infos[name].nbytes
+            self.tensor_infos[name] = WriterTensorInfo(offset, nbytes)
+            offset += GGUFWriter.ggml_pad(nbytes, self.data_alignment)
+        self.offset_tensor = offset
+        self.ti_data = bytearray()
+        for name, info in self.tensor_infos.items():
+            self.ti_data += self.tensor_ti_entries[name]
+            self.ti_data += self._pack("Q", info.offset)
+
     def write_padding(self, fp: IO[bytes], n: int, align: int | None = None) -> None:
         pad = GGUFWriter.ggml_pad(n, align if align is not None else self.data_alignment) - n
         if pad != 0:
@@ -243,17 +501,92 @@ class GGUFWriter:
     def write_tensor_data(self, tensor: np.ndarray[Any, Any]) -> None:
         if self.state is not WriterState.TI_DATA:
             raise ValueError(f'Expected output file to contain tensor info, got {self.state}')
-
+        if self.n_tensors_written >= len(self.tensor_infos):
+            raise ValueError(f'All {len(self.tensor_infos)} tensors have already been written')
+
+        name = self.tensor_write_order[self.n_tensors_written]
+        info = self.tensor_infos[name]
+        if tensor.nbytes != info.nbytes:
+            raise ValueError(f'Tensor {name} was added with {info.nbytes} bytes, got {tensor.nbytes} bytes')
+        if self.tensors_written or self.fout.tell() != self.data_offset + info.offset:
+            raise ValueError('Cannot write tensors in order after writing them out of order')
         if self.endianess == GGUFEndian.BIG:
-            tensor.byteswap(inplace=True)
-        self.write_padding(self.fout, self.fout.tell())
+            tensor = tensor.byteswap(inplace=tensor.flags.writeable)
+        if self.tensor_hashes is not None:
+            self.tensor_hashes[name] = GGUFWriter.tensor_hash(np.ascontiguousarray(tensor).reshape(-1).view(np.uint8))
         tensor.tofile(self.fout)
         self.write_padding(self.fout, tensor.nbytes)
+        self.n_tensors_written += 1
+
+    def write_tensor_data_at(self, name: str, tensor: np.ndarray[Any, Any]) -> None:
+        offset = self.reserve_tensor_data_at(name, tensor.nbytes)
+
+        if self.endianess == GGUFEndian.BIG:
+            tensor = tensor.byteswap(inplace=tensor.flags.writeable)
+        data = memoryview(np.ascontiguousarray(tensor).reshape(-1).view(np.uint8))
+        checksum = zlib.crc32(data) if self.journal is not None else 0
+        content_hash = GGUFWriter.tensor_hash(data) if self.tensor_hashes is not None else None
+        if not hasattr(os, 'pwrite'):
+            with self.write_lock:
+                self.fout.seek(offset)
+                self.fout.write(data)
+                self.fout.flush()
+        else:
+            fd = self.fout.fileno()
+            while data:
+                n = os.pwrite(fd, data, offset)
+                data, offset = data[n:], offset + n
+
+        self.tensor_data_written(name, checksum, content_hash)
+
+    # The tensor data can also be written by other means, e.g. by another process which opens
+    # the output file itself: reserve_tensor_data_at() checks and records the tensor like
+    # write_tensor_data_at() and returns where its data goes in the file, tensor_data_written()
+    # has to be called with the CRC32 of the data once it is there, and may get its tensor_hash().
+    def reserve_tensor_data_at(self, name: str, nbytes: int) -> int:
+        if self.state is not WriterState.TI_DATA:
+            raise ValueError(f'Expected output file to contain tensor info, got {self.state}')
+        info = self.tensor_infos.get(name)
+        if info is None:
+            raise ValueError(f'Tensor {name} was not added')
+        if nbytes != info.nbytes:
+            raise ValueError(f'Tensor {name} was added with {info.nbytes} bytes, got {nbytes} bytes')
+
+        with self.write_lock:
+            if self.n_tensors_written != len(self.tensors_written):
+                raise ValueError('Cannot write tensors out of order after writing them in order')
+            if name in self.tensors_written:
+                raise ValueError(f'Tensor {name} was already written')
+            if not self.tensors_written:
+                # Size the file up front, so the padding after the last tensor is there too
+                self.fout.truncate(self.data_offset + self.offset_tensor)
+            self.tensors_written.add(name)
+            self.n_tensors_written += 1
+        return self.data_offset + info.offset
+
+    # Path of the file the data of a tensor goes to, for writing it by other means
+    def tensor_path(self, name: str) -> str:
+        if name not in self.tensor_infos:
+            raise ValueError(f'Tensor {name} was not added')
+        return self.path
+
+    def is_tensor_written(self, name: str) -> bool:
+        return name in self.tensors_written
+
+    def tensor_data_written(self, name: str, checksum: int, content_hash: str | None = None) -> None:
+        if self.tensor_hashes is not None and content_hash is not None:
+            self.tensor_hashes[name] = content_hash
+        if self.journal is None:
+            return
+        info = self.tensor_infos[name]
+        entry = {"name": name, "offset": info.offset, "nbytes": info.nbytes, "crc32": checksum}
+        with self.write_lock:
+            self.journal.write(json.dumps(entry) + "\n")
+            self.journal.flush()
 
     def write_tensors_to_file(self) -> None:
         self.write_ti_data_to_file()
-
-        self.write_padding(self.fout, self.fout.tell())
+        self.n_tensors_written = len(self.tensor_infos)
 
         if self.temp_file is None:
             while True:
@@ -275,7 +608,18 @@ class GGUFWriter:
         self.fout.flush()
 
     def close(self) -> None:
+        complete = self.state is WriterState.TI_DATA and self.n_tensors_written == len(self.tensor_infos)
+        if complete and self.tensor_hashes is not None and self.tensor_infos:
+            self.flush()
+            self.write_tensor_hashes()
         self.fout.close()
+        if self.journal is not None:
+            self.journal.close()
+        if self.state is WriterState.TI_DATA and not complete:
+            raise ValueError(f'Only {self.n_tensors_written} of {len(self.tensor_infos)} tensors were written')
+        if self.journal is not None:
+            # Everything is written, there is nothing left to resume
+            os.remove(self.journal_path)
 
     def add_architecture(self) -> None:
         self.add_string(Keys.General.ARCHITECTURE, self.arch)
@@ -312,6 +656,10 @@ class GGUFWriter:
         self.data_alignment = alignment
         self.add_uint32(Keys.General.ALIGNMENT, alignment)
 
+    def add_tensor_data_order(self, layout: TensorDataLayout) -> None:
+        self.data_layout = layout
+        self.add_string(Keys.General.TENSOR_DATA_ORDER, layout.value)
+
     def add_context_length(self, length: int) -> None:
         self.add_uint32(Keys.LLM.CONTEXT_LENGTH.format(arch=self.arch), length)
 
@@ -372,10 +720,10 @@ class GGUFWriter:
     def add_token_merges(self, merges: Sequence[str] | Sequence[bytes] | Sequence[bytearray]) -> None:
         self.add_array(Keys.Tokenizer.MERGES, merges)
 
-    def add_token_types(self, types: Sequence[TokenType] | Sequence[int]) -> None:
+    def add_token_types(self, types: Sequence[TokenType] | Sequence[int] | np.ndarray[Any, Any]) -> None:
         self.add_array(Keys.Tokenizer.TOKEN_TYPE, types)
 
-    def add_token_scores(self, scores: Sequence[float]) -> None:
+    def add_token_scores(self, scores: Sequence[float] | np.ndarray[Any, Any]) -> None:
         self.add_array(Keys.Tokenizer.SCORES, scores)
 
     def add_bos_token_id(self, id: int) -> None:
@@ -410,3 +758,138 @@ class GGUFWriter:
 
     def _write_packed(self, fmt: str, value: Any, skip_pack_prefix: bool = False) -> None:
         self.fout.write(self._pack(fmt, value, skip_pack_prefix))
+
+
+# Writes a model split into several GGUF files (shards) named like model-00001-of-00003.gguf.
+# Every shard is a complete GGUF file with the split.* keys and its own part of the tensors.
+# The first shard is this writer, it also gets all the other metadata and the number of
+# tensors in every shard. Only the second way of writing tensors above is supported: the
+# tensors added with add_tensor_info() are split into n_split runs of about the same size
+# when the header is written. write_tensor_data_at() and reserve_tensor_data_at() can then
+# be used for tensors of any shard, so the shards are written in parallel.
+class GGUFSplitWriter(GGUFWriter):
+    def __init__(
+        self, path: os.PathLike[str] | str, arch: str, n_split: int,
+        endianess: GGUFEndian = GGUFEndian.LITTLE, journal: bool = False, resume: bool = False,
+        tensor_hashes: bool = False,
+    ):
+        if n_split < 1:
+            raise ValueError(f'Cannot split a model into {n_split} files')
+        prefix = os.fspath(path)
+        if prefix.endswith(".gguf"):
+            prefix = prefix[:-len(".gguf")]
+        self.paths = [GGUF_SPLIT_PATH.format(prefix=prefix, no=no + 1, count=n_split) for no in range(n_split)]
+        super().__init__(self.paths[0], arch, use_temp_file=False, endianess=endianess, journal=journal, resume=resume,
+                         tensor_hashes=tensor_hashes)
+        self.shards: list[GGUFWriter] = [self]
+        for shard_path in self.paths[1:]:
+            self.shards.append(GGUFWriter(shard_path, arch, use_temp_file=False, endianess=endianess, journal=journal, resume=resume,
+                                          tensor_hashes=tensor_hashes))
+        for no, shard in enumerate(self.shards):
+            shard.add_uint16(Keys.Split.NO, no)
+            shard.add_uint16(Keys.Split.COUNT, n_split)
+        self.split_tensor_infos: list[tuple[str, Sequence[int], np.dtype[Any], int, GGMLQuantizationType | None]] = []
+        self.split_tensor_names: set[str] = set()
+        self.tensor_shards: dict[str, GGUFWriter] = {}
+        self.n_split_tensors_written = 0
+
+    def add_tensor_info(
+        self, name: str, tensor_shape: Sequence[int], tensor_dtype: np.dtype[np.float16] | np.dtype[np.float32],
+        tensor_nbytes: int, raw_dtype: GGMLQuantizationType | None = None,
+    ) -> None:
+        if self.state is not WriterState.EMPTY:
+            raise ValueError(f'Expected output file to be empty, got {self.state}')
+        if name in self.split_tensor_names:
+            raise ValueError(f'Duplicated tensor name {name}')
+        self.split_tensor_infos.append((name, tensor_shape, tensor_dtype, tensor_nbytes, raw_dtype))
+        self.split_tensor_names.add(name)
+
+    def add_tensor(
+        self, name: str, tensor: np.ndarray[Any, Any], raw_shape: Sequence[int] | None = None,
+        raw_dtype: GGMLQuantizationType | None = None,
+    ) -> None:
+        raise ValueError("Split files are written with add_tensor_info() and write_tensor_data_at()")
+
+    def split_tensors(self) -> None:
+        # Every tensor goes to the shard its middle falls into, when the data is cut into equal parts,
+        # but no shard is left empty while there are enough tensors
+        n_split = len(self.shards)
+        infos = {info[0]: info for info in self.split_tensor_infos}
+        self.split_tensor_infos = [infos[name] for name in self.tensor_data_order(list(infos))]
+        sizes = [GGUFWriter.ggml_pad(info[3], self.data_alignment) for info in self.split_tensor_infos]
+        total = sum(sizes)
+        start = 0
+        no = -1
+        for shard in self.shards[1:]:
+            if self.data_alignment != GGUF_DEFAULT_ALIGNMENT:
+                shard.add_custom_alignment(self.data_alignment)
+            # The tensor infos of every shard are added in the order of their data
+            if self.data_layout is not TensorDataLayout.ADDED:
+                shard.add_string(Keys.General.TENSOR_DATA_ORDER, self.data_layout.value)
+        for idx, ((name, shape, dtype, nbytes, raw_dtype), size) in enumerate(zip(self.split_tensor_infos, sizes)):
+            even_no = (2 * start + size) * n_split // (2 * total) if total else 0
+            no = min(n_split - 1, max(min(even_no, no + 1), no, n_split - (len(sizes) - idx)))
+            start += size
+            shard = self.shards[no]
+            GGUFWriter.add_tensor_info(shard, name, shape, dtype, nbytes, raw_dtype = raw_dtype)
+            self.tensor_shards[name] = shard
+        self.add_int32(Keys.Split.TENSORS_COUNT, len(self.split_tensor_infos))
+        self.add_array(Keys.Split.TENSORS_PER_SHARD, np.array([shard.ti_data_count for shard in self.shards], dtype=np.int32))
+
+    def write_header_to_file(self) -> None:
+        if self.state is not WriterState.EMPTY:
+            raise ValueError(f'Expected output file to be empty, got {self.state}')
+
+        self.split_tensors()
+        for shard in self.shards:
+            GGUFWriter.write_header_to_file(shard)
+
+    def write_kv_data_to_file(self) -> None:
+        for shard in self.shards:
+            GGUFWriter.write_kv_data_to_file(shard)
+
+    def write_ti_data_to_file(self) -> None:
+        for shard in self.shards:
+            GGUFWriter.write_ti_data_to_file(shard)
+
+    def _tensor_shard(self, name: str) -> GGUFWriter:
+        shard = self.tensor_shards.get(name)
+        if shard is None:
+            raise ValueError(f'Tensor {name} was not added')
+        return shard
+
+    def write_tensor_data(self, tensor: np.ndarray[Any, Any]) -> None:
+        if self.n_split_tensors_written >= len(self.split_tensor_infos):
+            raise ValueError(f'All {len(self.split_tensor_infos)} tensors have already been written')
+        name = self.split_tensor_infos[self.n_split_tensors_written][0]
+        GGUFWriter.write_tensor_data(self._tensor_shard(name), tensor)
+        self.n_split_tensors_written += 1
+
+    def write_tensor_data_at(self, name: str, tensor: np.ndarray[Any, Any]) -> None:
+        GGUFWriter.write_tensor_data_at(self._tensor_shard(name), name, tensor)
+
+    def reserve_tensor_data_at(self, name: str, nbytes: int) -> int:
+        return GGUFWriter.reserve_tensor_data_at(self._tensor_shard(name), name, nbytes)
+
+    def tensor_path(self, name: str) -> str:
+        return self._tensor_shard(name).path
+
+    def is_tensor_written(self, name: str) -> bool:
+        return GGUFWriter.is_tensor_written(self._tensor_shard(name), name)
+
+    def tensor_data_written(self, name: str, checksum: int, content_hash: str | None = None) -> None:
+        GGUFWriter.tensor_data_written(self._tensor_shard(name), name, checksum, content_hash)
+
+    def write_tensors_to_file(self) -> None:
+        raise ValueError("Split files are written with add_tensor_info() and write_tensor_data_at()")
+
+    def close(self) -> None:
+        # Close all the shards, even if some of them are incomplete
+        error: ValueError | None = None
+        for shard in self.shards:
+            try:
+                GGUFWriter.close(shard)
+            except ValueError as e:
+                error = error or e
+        if error is not None:
+            raise error
@@ -0,0 +1,610 @@
+#
+# NumPy implementations of the GGML block quantization formats. These follow
+# the reference implementations in ggml-quants.c and produce the same results.
+# Only the QK_K == 256 variants of the k-quants are supported.
+#
+from __future__ import annotations
+
+from typing import Any, Callable
+
+import numpy as np
+import numpy.typing as npt
+
+from .constants import GGML_QUANT_ENDIAN_FIELDS, GGML_QUANT_SIZES, QK_K, GGMLQuantizationType, GGUFEndian
+
+# Number of blocks processed at once, this bounds the size of the temporaries.
+DEQUANTIZE_CHUNK_BLOCKS = 16384
+QUANTIZE_CHUNK_BLOCKS   = 4096
+# Number of bytes byte swapped at once.
+BYTESWAP_CHUNK_BYTES    = 4 * 1024 * 1024
+
+
+def _f16(blocks: npt.NDArray[np.uint8], start: int) -> npt.NDArray[np.float32]:
+    return blocks[:, start:start + 2].view('<f2').astype(np.float32)
+
+
+def _nibbles(qs: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint8]:
+    # Low nibbles are the first half of the block, high nibbles the second half.
+    return np.concatenate((qs & 0xF, qs >> 4), axis = -1)
+
+
+def _q5_high_bits(blocks: npt.NDArray[np.uint8], start: int) -> npt.NDArray[np.uint8]:
+    qh = blocks[:, start:start + 4].view('<u4')
+    return ((qh >> np.arange(32, dtype = np.uint32)) & 1).astype(np.uint8)
+
+
+def _k4_scales_mins(scales: npt.NDArray[np.uint8]) -> tuple[npt.NDArray[np.uint8], npt.NDArray[np.uint8]]:
+    # Unpacks the 8 6-bit scales and mins of Q4_K and Q5_K, see get_scale_min_k4.
+    sc = np.empty((scales.shape[0], 8), dtype = np.uint8)
+    mn = np.empty((scales.shape[0], 8), dtype = np.uint8)
+    sc[:, :4] = scales[:, 0:4] & 63
+    mn[:, :4] = scales[:, 4:8] & 63
+    sc[:, 4:] = (scales[:, 8:12] & 0xF) | ((scales[:, 0:4] >> 6) << 4)
+    mn[:, 4:] = (scales[:, 8:12] >> 4) | ((scales[:, 4:8] >> 6) << 4)
+    return sc, mn
+
+
+def _dequantize_q4_0(blocks: npt.NDArray[np.uint8]) -> npt.NDArray[np.float32]:
+    d = _f16(blocks, 0)
+    q = _nibbles(blocks[:, 2:]).astype(np.int8) - np.int8(8)
+    return q * d
+
+
+def _dequantize_q4_1(blocks: npt.NDArray[np.uint8]) -> npt.NDArray[np.float32]:
+    d, m = _f16(blocks, 0), _f16(blocks, 2)
+    return _nibbles(blocks[:, 4:]) * d + m
+
+
+def _dequantize_q5_0(blocks: npt.NDArray[np.uint8]) -> npt.NDArray[np.float32]:
+    d = _f16(blocks, 0)
+    q = (_nibbles(blocks[:, 6:]) | (_q5_high_bits(blocks, 2) << 4)).astype(np.int8) - np.int8(16)
+    return q * d
+
+
+def _dequantize_q5_1(blocks: npt.NDArray[np.uint8]) -> npt.NDArray[np.float32]:
+    d, m = _f16(blocks, 0), _f16(blocks, 2)
+    q = _nibbles(blocks[:, 8:]) | (_q5_high_bits(blocks, 4) << 4)
+    return q * d + m
+
+
+def _dequantize_q8_0(blocks: npt.NDArray[np.uint8]) -> npt.NDArray[np.float32]:
+    d = _f16(blocks, 0)
+    return blocks[:, 2:].view(np.int8) * d
+
+
+def _dequantize_q2_k(blocks: npt.NDArray[np.uint8]) -> npt.NDArray[np.float32]:
+    nb = blocks.shape[0]
+    scales = blocks[:, :QK_K // 16]
+    qs = blocks[:, QK_K // 16:QK_K // 16 + QK_K // 4]
+    d, dmin = _f16(blocks, QK_K // 16 + QK_K // 4), _f16(blocks, QK_K // 16 + QK_K // 4 + 2)
+    # Each 32 bytes of quants hold 128 values, 2 bits per value shifted by 0, 2, 4, 6.
+    shifts = np.array([0, 2, 4, 6], dtype = np.uint8).reshape(1, 1, 4, 1)
+    q = ((qs.reshape(nb, 2, 1, 32) >> shifts) & 3).reshape(nb, QK_K // 16, 16).astype(np.int8)
+    dl = (d * (scales & 0xF))[:, :, None]
+    ml = (dmin * (scales >> 4))[:, :, None]
+    return (dl * q - ml).reshape(nb, QK_K)
+
+
+def _dequantize_q3_k(blocks: npt.NDArray[np.uint8]) -> npt.NDArray[np.float32]:
+    nb = blocks.shape[0]
+    hmask = blocks[:, :QK_K // 8]
+    qs = blocks[:, QK_K // 8:QK_K // 8 + QK_K // 4]
+    scales = blocks[:, QK_K // 8 + QK_K // 4:QK_K // 8 + QK_K // 4 + 12]
+    d = _f16(blocks, QK_K // 8 + QK_K // 4 + 12)
+    # 16 6-bit scales: the low 4 bits are in the first 8 bytes, the high 2 bits in the last 4.
+    idx = np.arange(16)
+    sc_low = (scales[:, idx % 8] >> (4 * (idx // 8)).astype(np.uint8)) & 0xF
+    sc_high = (scales[:, 8 + idx % 4] >> (2 * (idx // 4)).astype(np.uint8)) & 3
+    sc = (sc_low | (sc_high << 4)).astype(np.int8) - np.int8(32)
+    shifts = np.array([0, 2, 4, 6], dtype = np.uint8).reshape(1, 1, 4, 1)
+    q = (qs.reshape(nb, 2, 1, 32) >> shifts) & 3
+    hbits = np.arange(8, dtype = np.uint8).reshape(1, 2, 4, 1)
+    h = (hmask.reshape(nb, 1, 1, 32) >> hbits) & 1
+    q = (q.astype(np.int8) - ((1 - h.astype(np.int8)) << 2)).reshape(nb, QK_K // 16, 16)
+    dl = (d * sc)[:, :, None]
+    return (dl * q).reshape(nb, QK_K)
+
+
+def _dequantize_q4_k(blocks: npt.NDArray[np.uint8]) -> npt.NDArray[np.float32]:
+    nb = blocks.shape[0]
+    d, dmin = _f16(blocks, 0), _f16(blocks, 2)
+    sc, mn = _k4_scales_mins(blocks[:, 4:16])
+    qs = blocks[:, 16:16 + QK_K // 2].reshape(nb, 4, 1, 32)
+    q = (qs >> np.array([0, 4], dtype = np.uint8).reshape(1, 1, 2, 1)) & 0xF
+    q = q.reshape(nb, 8, 32)
+    return ((d * sc)[:, :, None] * q - (dmin * mn)[:, :, None]).reshape(nb, QK_K)
+
+
+def _dequantize_q5_k(blocks: npt.NDArray[np.uint8]) -> npt.NDArray[np.float32]:
+    nb = blocks.shape[0]
+    d, dmin = _f16(blocks, 0), _f16(blocks, 2)
+    sc, mn = _k4_scales_mins(blocks[:, 4:16])
+    qh = blocks[:, 16:16 + QK_K // 8].reshape(nb, 1, 32)
+    qs = blocks[:, 16 + QK_K // 8:16 + QK_K // 8 + QK_K // 2].reshape(nb, 4, 1, 32)
+    q = (qs >> np.array([0, 4], dtype = np.uint8).reshape(1, 1, 2, 1)) & 0xF
+    h = (qh >> np.arange(8, dtype = np.uint8).reshape(1, 8, 1)) & 1
+    q = q.reshape(nb, 8, 32) + (h << 4)
+    return ((d * sc)[:, :, None] * q - (dmin * mn)[:, :, None]).reshape(nb, QK_K)
+
+
+def _dequantize_q6_k(blocks: npt.NDArray[np.uint8]) -> npt.NDArray[np.float32]:
+    nb = blocks.shape[0]
+    ql = blocks[:, :QK_K // 2].reshape(nb, 2, 1, 2, 32)
+    qh = blocks[:, QK_K // 2:QK_K // 2 + QK_K // 4].reshape(nb, 2, 1, 32)
+    sc = blocks[:, QK_K // 2 + QK_K // 4:QK_K // 2 + QK_K // 4 + QK_K // 16].view(np.int8)
+    d = _f16(blocks, QK_K // 2 + QK_K // 4 + QK_K // 16)
+    # Each half of the block takes its low bits from 64 bytes (low then high nibbles)
+    # and its high bits from 32 bytes (2 bits at a time).
+    low = ((ql >> np.array([0, 4], dtype = np.uint8).reshape(1, 1, 2, 1, 1)) & 0xF).reshape(nb, 2, 4, 32)
+    high = (qh >> np.array([0, 2, 4, 6], dtype = np.uint8).reshape(1, 1, 4, 1)) & 3
+    q = (low | (high << 4)).astype(np.int8).reshape(nb, QK_K // 16, 16) - np.int8(32)
+    return ((d * sc)[:, :, None] * q).reshape(nb, QK_K)
+
+
+def _dequantize_q8_k(blocks: npt.NDArray[np.uint8]) -> npt.NDArray[np.float32]:
+    d = blocks[:, :4].view('<f4')
+    return d * blocks[:, 4:4 + QK_K].view(np.int8)
+
+
+_dequantize_blocks: dict[GGMLQuantizationType, Callable[[npt.NDArray[np.uint8]], npt.NDArray[np.float32]]] = {
+    GGMLQuantizationType.Q4_0: _dequantize_q4_0,
+    GGMLQuantizationType.Q4_1: _dequantize_q4_1,
+    GGMLQuantizationType.Q5_0: _dequantize_q5_0,
+    GGMLQuantizationType.Q5_1: _dequantize_q5_1,
+    GGMLQuantizationType.Q8_0: _dequantize_q8_0,
+    GGMLQuantizationType.Q2_K: _dequantize_q2_k,
+    GGMLQuantizationType.Q3_K: _dequantize_q3_k,
+    GGMLQuantizationType.Q4_K: _dequantize_q4_k,
+    GGMLQuantizationType.Q5_K: _dequantize_q5_k,
+    GGMLQuantizationType.Q6_K: _dequantize_q6_k,
+    GGMLQuantizationType.Q8_K: _dequantize_q8_k,
+}
+
+
+# Dequantize data to float32. The last axis of data holds the raw bytes of a row
+# (or any whole number of blocks) and is replaced by the dequantized values.
+# F32 and F16 data is accepted as-is. The blocks of big endian data are swapped
+# to little endian (a chunk at a time) before they are dequantized.
+def dequantize(
+    data: npt.NDArray[Any], qtype: GGMLQuantizationType, endianess: GGUFEndian = GGUFEndian.LITTLE,
+) -> npt.NDArray[np.float32]:
+    if qtype in (GGMLQuantizationType.F32, GGMLQuantizationType.F16):
+        return data.astype(np.float32)
+    dequantize_blocks = _dequantize_blocks.get(qtype)
+    if dequantize_blocks is None:
+        raise NotImplementedError(f'Dequantization of {qtype.name} is not supported')
+    block_size, type_size = GGML_QUANT_SIZES[qtype]
+    row_bytes = data.shape[-1]
+    if row_bytes % type_size != 0:
+        raise ValueError(f'Row of {row_bytes} bytes is not a whole number of {qtype.name} blocks')
+    blocks = data.view(np.uint8).reshape(-1, type_size)
+    result = np.empty((blocks.shape[0], block_size), dtype = np.float32)
+    for start in range(0, blocks.shape[0], DEQUANTIZE_CHUNK_BLOCKS):
+        end = start + DEQUANTIZE_CHUNK_BLOCKS
+        chunk = blocks[start:end]
+        if endianess == GGUFEndian.BIG:
+            chunk = chunk.copy()
+            byteswap(chunk, qtype)
+        result[start:end] = dequantize_blocks(chunk)
+    return result.reshape(*data.shape[:-1], row_bytes // type_size * block_size)
+
+
+#
+# Quantization. The arithmetic is done in float32 in the same order as in
+# ggml-quants.c, sums are accumulated sequentially rather than pairwise, so the
+# output is bit for bit the same as that of the C code (when it is built without
+# FMA contraction).
+#
+
+
+def _nearest_int(fval: npt.NDArray[np.float32]) -> npt.NDArray[np.int32]:
+    # Same trick as nearest_int in ggml-quants.c, rounds half to even.
+    val = fval.astype(np.float32) + np.float32(12582912)
+    return (val.view(np.int32) & 0x007fffff) - 0x00400000
+
+
+def _sequential_sum(
+    values: npt.NDArray[np.float32], total: npt.NDArray[np.float32] | None = None,
+) -> npt.NDArray[np.float32]:
+    # Sums over the first axis one element at a time, like a C loop would.
+    total = np.zeros(values.shape[1:], dtype = np.float32) if total is None else total.copy()
+    for value in values:
+        total += value
+    return total
+
+
+def _to_f16_bytes(val: npt.NDArray[np.float32]) -> npt.NDArray[np.uint8]:
+    return val.astype('<f2').reshape(-1, 1).view(np.uint8)
+
+
+def _f16_round(val: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+    return val.astype(np.float16).astype(np.float32)
+
+
+def _roundf(val: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+    # Rounds half away from zero, like roundf.
+    trunc = np.trunc(val)
+    return trunc + np.where(np.abs(val - trunc) >= np.float32(0.5), np.sign(val), np.float32(0))
+
+
+def _first_absmax(x: npt.NDArray[np.float32]) -> tuple[npt.NDArray[np.float32], npt.NDArray[np.float32]]:
+    # The absolute maximum of each row and the first value with that magnitude.
+    ax = np.abs(x)
+    idx = ax.argmax(axis = -1)[..., None]
+    amax = np.take_along_axis(ax, idx, axis = -1)[..., 0]
+    return amax, np.where(amax > 0, np.take_along_axis(x, idx, axis = -1)[..., 0], np.float32(0))
+
+
+def _pack_nibbles(q: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint8]:
+    half = q.shape[-1] // 2
+    return q[..., :half] | (q[..., half:] << 4)
+
+
+def _pack_q5_high_bits(q: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint8]:
+    bits = ((q >> 4) & 1).astype(np.uint32) << np.arange(32, dtype = np.uint32)
+    return np.bitwise_or.reduce(bits, axis = -1).astype('<u4').reshape(-1, 1).view(np.uint8)
+
+
+def _pack_2bit(L: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint8]:
+    # Groups of 128 values go into 32 bytes, value 32 * k + l at bits 2k of byte l.
+    L = L.reshape(L.shape[0], -1, 4, 32)
+    shifts = np.array([0, 2, 4, 6], dtype = np.uint8).reshape(1, 1, 4, 1)
+    return np.bitwise_or.reduce(L << shifts, axis = 2).reshape(L.shape[0], -1)
+
+
+def _quantize_q4_0(x: npt.NDArray[np.float32]) -> npt.NDArray[np.uint8]:
+    _, vmax = _first_absmax(x)
+    d = vmax / np.float32(-8)
+    inv_d = np.where(d != 0, np.float32(1) / d, np.float32(0))[:, None]
+    q = np.minimum(15, np.trunc(x * inv_d + np.float32(8.5))).astype(np.uint8)
+    return np.concatenate((_to_f16_bytes(d), _pack_nibbles(q)), axis = 1)
+
+
+def _quantize_q4_1(x: npt.NDArray[np.float32]) -> npt.NDArray[np.uint8]:
+    vmin, vmax = x.min(axis = 1), x.max(axis = 1)
+    d = (vmax - vmin) / np.float32(15)
+    inv_d = np.where(d != 0, np.float32(1) / d, np.float32(0))[:, None]
+    q = np.minimum(15, np.trunc((x - vmin[:, None]) * inv_d + np.float32(0.5))).astype(np.uint8)
+    return np.concatenate((_to_f16_bytes(d), _to_f16_bytes(vmin), _pack_nibbles(q)), axis = 1)
+
+
+def _quantize_q5_0(x: npt.NDArray[np.float32]) -> npt.NDArray[np.uint8]:
+    _, vmax = _first_absmax(x)
+    d = vmax / np.float32(-16)
+    inv_d = np.where(d != 0, np.float32(1) / d, np.float32(0))[:, None]
+    q = np.minimum(31, np.trunc(x * inv_d + np.float32(16.5))).astype(np.uint8)
+    return np.concatenate((_to_f16_bytes(d), _pack_q5_high_bits(q), _pack_nibbles(q & 0xF)), axis = 1)
+
+
+def _quantize_q5_1(x: npt.NDArray[np.float32]) -> npt.NDArray[np.uint8]:
+    vmin, vmax = x.min(axis = 1), x.max(axis = 1)
+    d = (vmax - vmin) / np.float32(31)
+    inv_d = np.where(d != 0, np.float32(1) / d, np.float32(0))[:, None]
+    q = np.trunc((x - vmin[:, None]) * inv_d + np.float32(0.5)).astype(np.uint8)
+    return np.concatenate(
+        (_to_f16_bytes(d), _to_f16_bytes(vmin), _pack_q5_high_bits(q), _pack_nibbles(q & 0xF)), axis = 1,
+    )
+
+
+def _quantize_q8_0(x: npt.NDArray[np.float32]) -> npt.NDArray[np.uint8]:
+    amax, _ = _first_absmax(x)
+    d = amax / np.float32(127)
+    inv_d = np.where(d != 0, np.float32(1) / d, np.float32(0))[:, None]
+    qs = _roundf(x * inv_d).astype(np.int8).view(np.uint8)
+    return np.concatenate((_to_f16_bytes(d), qs), axis = 1)
+
+
+# The make_*_quants helpers work on the transpose of their input, so that the
+# sequential sums over the values of a sub-block run over contiguous rows.
+
+
+def _make_qx_quants(
+    x: npt.NDArray[np.float32], nmax: int,
+) -> tuple[npt.NDArray[np.float32], npt.NDArray[np.uint8]]:
+    # make_qx_quants with rmse_type 1, for rows of x.
+    amax, vmax = _first_absmax(x)
+    x = np.ascontiguousarray(x.T)
+    w = x * x
+    wx = w * x
+    nmax_f = np.float32(nmax)
+
+    def try_iscale(iscale: npt.NDArray[np.float32]) -> tuple[Any, Any, Any]:
+        lf = np.clip(_nearest_int(iscale * x), -nmax, nmax - 1).astype(np.float32)
+        return lf, _sequential_sum(wx * lf), _sequential_sum(w * lf * lf)
+
+    lf, sumlx, suml2 = try_iscale(-nmax_f / vmax)
+    L = lf + nmax_f
+    scale = sumlx / suml2
+    best = scale * sumlx
+    for step in range(-9, 10):
+        if step == 0:
+            continue
+        lf, this_sumlx, this_suml2 = try_iscale(-(nmax_f + np.float32(0.1) * np.float32(step)) / vmax)
+        better = (this_suml2 > 0) & (this_sumlx * this_sumlx > best * this_suml2)
+        L[:, better] = lf[:, better] + nmax_f
+        scale = np.where(better, this_sumlx / this_suml2, scale)
+        best = np.where(better, scale * this_sumlx, best)
+    all_zero = amax < np.float32(1e-30)
+    L[:, all_zero] = 0
+    return np.where(all_zero, np.float32(0), scale), L.T.astype(np.uint8)
+
+
+def _make_q3_quants(
+    x: npt.NDArray[np.float32], nmax: int,
+) -> tuple[npt.NDArray[np.float32], npt.NDArray[np.uint8]]:
+    # make_q3_quants with do_rmse, for rows of x.
+    amax, vmax = _first_absmax(x)
+    x = np.ascontiguousarray(x.T)
+    w = x * x
+    wx = w * x
+    L = np.clip(_nearest_int((-np.float32(nmax) / vmax) * x), -nmax, nmax - 1).astype(np.float32)
+    sumlx = _sequential_sum(wx * L)
+    suml2 = _sequential_sum(w * L * L)
+    for _ in range(5):
+        n_changed = 0
+        for wi, xi, wxi, li in zip(w, x, wx, L):
+            slx = sumlx - wxi * li
+            sl2 = suml2 - wi * li * li
+            new_l = np.clip(_nearest_int(xi * sl2 / slx), -nmax, nmax - 1).astype(np.float32)
+            changed = (slx > 0) & (new_l != li)
+            slx = slx + wxi * new_l
+            sl2 = sl2 + wi * new_l * new_l
+            changed &= (sl2 > 0) & (slx * slx * suml2 > sumlx * sumlx * sl2)
+            li[changed] = new_l[changed]
+            sumlx = np.where(changed, slx, sumlx)
+            suml2 = np.where(changed, sl2, suml2)
+            n_changed += int(changed.sum())
+        if not n_changed:
+            break
+    all_zero = amax == 0
+    L += np.float32(nmax)
+    L[:, all_zero] = 0
+    return np.where(all_zero, np.float32(0), sumlx / suml2), L.T.astype(np.uint8)
+
+
+def _make_qkx2_quants(
+    x: npt.NDArray[np.float32], weights: npt.NDArray[np.float32], nmax: int,
+    rmin: float, rdelta: float, nstep: int, use_mad: bool,
+) -> tuple[npt.NDArray[np.float32], npt.NDArray[np.float32], npt.NDArray[np.uint8]]:
+    # make_qkx2_quants for rows of x, returns the scales, the (negated) mins and the quants.
+    vmin, vmax = x.min(axis = 1), x.max(axis = 1)
+    x, weights = np.ascontiguousarray(x.T), np.ascontiguousarray(weights.T)
+    wx = weights * x
+    sum_w = _sequential_sum(weights[1:], weights[0])
+    sum_x = _sequential_sum(wx[1:], wx[0])
+    vmin = np.where(vmin > 0, np.float32(0), vmin)
+    flat = vmax == vmin
+
+    def quants(iscale: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+        return np.clip(_nearest_int(iscale * (x - vmin)), 0, nmax).astype(np.float32)
+
+    def error(scale: npt.NDArray[np.float32], vmin: npt.NDArray[np.float32], lf: npt.NDArray[np.float32]) -> Any:
+        diff = scale * lf + vmin - x
+        return _sequential_sum(weights * (np.abs(diff) if use_mad else diff * diff))
+
+    iscale = np.float32(nmax) / (vmax - vmin)
+    scale = np.float32(1) / iscale
+    L = quants(iscale)
+    best_mad = error(scale, vmin, L)
+    for step in range(nstep + 1):
+        iscale = (np.float32(rmin) + np.float32(rdelta) * np.float32(step) + np.float32(nmax)) / (vmax - vmin)
+        laux = quants(iscale)
+        wl = weights * laux
+        sum_l = _sequential_sum(wl)
+        sum_l2 = _sequential_sum(wl * laux)
+        sum_xl = _sequential_sum(wl * x)
+        D = sum_w * sum_l2 - sum_l * sum_l
+        this_scale = (sum_w * sum_xl - sum_x * sum_l) / D
+        this_min = (sum_l2 * sum_x - sum_l * sum_xl) / D
+        positive_min = this_min > 0
+        this_min = np.where(positive_min, np.float32(0), this_min)
+        this_scale = np.where(positive_min, sum_xl / sum_l2, this_scale)
+        mad = error(this_scale, this_min, laux)
+        better = (D > 0) & (mad < best_mad)
+        L[:, better] = laux[:, better]
+        best_mad = np.where(better, mad, best_mad)
+        scale = np.where(better, this_scale, scale)
+        vmin = np.where(better, this_min, vmin)
+    L[:, flat] = 0
+    return np.where(flat, np.float32(0), scale), -vmin, L.T.astype(np.uint8)
+
+
+def _max_positive(values: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+    return np.maximum(values.max(axis = -1), np.float32(0))
+
+
+def _k_weights(x: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+    # Weights used by Q4_K and Q5_K for rows of 32 values.
+    av_x = np.sqrt(_sequential_sum(np.ascontiguousarray(x.T) ** 2) / np.float32(32))
+    return av_x[:, None] + np.abs(x)
+
+
+def _requantize(
+    x: npt.NDArray[np.float32], L: npt.NDArray[np.uint8], d: npt.NDArray[np.float32],
+    dm: npt.NDArray[np.float32] | None, lmin: int, lmax: int,
+) -> None:
+    # Quantizes x again with the final (fp16) sub-block scales, sub-blocks with
+    # a zero scale keep their previous quants.
+    nb, n_sub = d.shape
+    xs = x.reshape(nb, n_sub, -1)
+    if dm is not None:
+        xs = xs + dm[:, :, None]
+    q = np.clip(_nearest_int(xs / d[:, :, None]), lmin, lmax) - lmin
+    L = L.reshape(nb, n_sub, -1)
+    L[d != 0] = q[d != 0]
+
+
+def _pack_k4_scales(ls: npt.NDArray[np.uint8], lm: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint8]:
+    # Packs 8 6-bit scales and mins of Q4_K and Q5_K into 12 bytes, see get_scale_min_k4.
+    return np.concatenate((
+        ls[:, :4] | ((ls[:, 4:] >> 4) << 6),
+        lm[:, :4] | ((lm[:, 4:] >> 4) << 6),
+        (ls[:, 4:] & 0xF) | ((lm[:, 4:] & 0xF) << 4),
+    ), axis = 1)
+
+
+def _k4_scales(
+    x: npt.NDArray[np.float32], nmax: int, rmin: float, nstep: int,
+) -> tuple[npt.NDArray[np.uint8], npt.NDArray[np.float32], npt.NDArray[np.float32], npt.NDArray[np.uint8]]:
+    # The common part of Q4_K and Q5_K: returns the packed scales, d, dmin and the quants.
+    nb = x.shape[0]
+    xs = x.reshape(-1, 32)
+    scales, mins, L = _make_qkx2_quants(xs, _k_weights(xs), nmax, rmin, 0.1, nstep, False)
+    scales, mins = scales.reshape(nb, 8), mins.reshape(nb, 8)
+    max_scale, max_min = _max_positive(scales), _max_positive(mins)
+    inv_scale = np.where(max_scale > 0, np.float32(63) / max_scale, np.float32(0))
+    inv_min = np.where(max_min > 0, np.float32(63) / max_min, np.float32(0))
+    ls = np.minimum(63, _nearest_int(inv_scale[:, None] * scales) & 0xFF).astype(np.uint8)
+    lm = np.minimum(63, _nearest_int(inv_min[:, None] * mins) & 0xFF).astype(np.uint8)
+    d = _f16_round(max_scale / np.float32(63))
+    dmin = _f16_round(max_min / np.float32(63))
+    L = L.reshape(nb, QK_K)
+    _requantize(x, L, d[:, None] * ls, dmin[:, None] * lm, 0, nmax)
+    return _pack_k4_scales(ls, lm), d, dmin, L
+
+
+def _quantize_q2_k(x: npt.NDArray[np.float32]) -> npt.NDArray[np.uint8]:
+    nb = x.shape[0]
+    xs = x.reshape(-1, 16)
+    scales, mins, L = _make_qkx2_quants(xs, np.abs(xs), 3, -0.5, 0.1, 15, True)
+    scales, mins = scales.reshape(nb, 16), mins.reshape(nb, 16)
+    max_scale, max_min = _max_positive(scales), _max_positive(mins)
+    q4scale = np.float32(15)
+    ls = np.where(max_scale[:, None] > 0, _nearest_int((q4scale / max_scale)[:, None] * scales), 0)
+    lm = np.where(max_min[:, None] > 0, _nearest_int((q4scale / max_min)[:, None] * mins), 0)
+    packed_scales = ((ls & 0xFF) | ((lm << 4) & 0xFF)).astype(np.uint8)
+    d = _f16_round(max_scale / q4scale)
+    dmin = _f16_round(max_min / q4scale)
+    L = L.reshape(nb, QK_K)
+    _requantize(x, L, d[:, None] * (packed_scales & 0xF), dmin[:, None] * (packed_scales >> 4), 0, 3)
+    return np.concatenate((packed_scales, _pack_2bit(L), _to_f16_bytes(d), _to_f16_bytes(dmin)), axis = 1)
+
+
+def _quantize_q3_k(x: npt.NDArray[np.float32]) -> npt.NDArray[np.uint8]:
+    nb = x.shape[0]
+    scales, L = _make_q3_quants(x.reshape(-1, 16), 4)
+    scales = scales.reshape(nb, 16)
+    _, max_scale = _first_absmax(scales)
+    iscale = np.float32(-32) / max_scale
+    l = np.where(max_scale[:, None] != 0, np.clip(_nearest_int(iscale[:, None] * scales), -32, 31) + 32, 0)
+    l = l.astype(np.uint8)
+    high = (l >> 4).reshape(nb, 4, 4) << np.array([0, 2, 4, 6], dtype = np.uint8).reshape(1, 4, 1)
+    packed_scales = np.concatenate((
+        (l[:, :8] & 0xF) | ((l[:, 8:] & 0xF) << 4),
+        np.bitwise_or.reduce(high, axis = 1),
+    ), axis = 1)
+    d = np.where(max_scale != 0, _f16_round(np.float32(1) / iscale), np.float32(0))
+    L = L.reshape(nb, QK_K)
+    _requantize(x, L, d[:, None] * (l.astype(np.int8) - np.int8(32)), None, -4, 3)
+    # The high bit of value 32 * k + m goes into bit k of hmask byte m.
+    hbits = ((L.reshape(nb, 8, 32) >> 2) & 1) << np.arange(8, dtype = np.uint8).reshape(1, 8, 1)
+    hmask = np.bitwise_or.reduce(hbits, axis = 1)
+    return np.concatenate((hmask, _pack_2bit(L & 3), packed_scales, _to_f16_bytes(d)), axis = 1)
+
+
+def _quantize_q4_k(x: npt.NDArray[np.float32]) -> npt.NDArray[np.uint8]:
+    nb = x.shape[0]
+    packed_scales, d, dmin, L = _k4_scales(x, 15, -1.0, 20)
+    L = L.reshape(nb, 4, 2, 32)
+    qs = (L[:, :, 0] | (L[:, :, 1] << 4)).reshape(nb, QK_K // 2)
+    return np.concatenate((_to_f16_bytes(d), _to_f16_bytes(dmin), packed_scales, qs), axis = 1)
+
+
+def _quantize_q5_k(x: npt.NDArray[np.float32]) -> npt.NDArray[np.uint8]:
+    nb = x.shape[0]
+    packed_scales, d, dmin, L = _k4_scales(x, 31, -0.5, 15)
+    hbits = (L.reshape(nb, 8, 32) >> 4) << np.arange(8, dtype = np.uint8).reshape(1, 8, 1)
+    qh = np.bitwise_or.reduce(hbits, axis = 1)
+    L = (L & 0xF).reshape(nb, 4, 2, 32)
+    qs = (L[:, :, 0] | (L[:, :, 1] << 4)).reshape(nb, QK_K // 2)
+    return np.concatenate((_to_f16_bytes(d), _to_f16_bytes(dmin), packed_scales, qh, qs), axis = 1)
+
+
+def _quantize_q6_k(x: npt.NDArray[np.float32]) -> npt.NDArray[np.uint8]:
+    nb = x.shape[0]
+    scales, L = _make_qx_quants(x.reshape(-1, 16), 32)
+    scales = scales.reshape(nb, 16)
+    max_abs_scale, max_scale = _first_absmax(scales)
+    iscale = np.float32(-128) / max_scale
+    d = _f16_round(np.float32(1) / iscale)
+    sc = np.minimum(127, _nearest_int(iscale[:, None] * scales)).astype(np.int8)
+    L = L.reshape(nb, QK_K)
+    _requantize(x, L, d[:, None] * sc, None, -32, 31)
+    Lr = (L & 0xF).reshape(nb, 2, 4, 32)
+    ql = (Lr[:, :, 0:2] | (Lr[:, :, 2:4] << 4)).reshape(nb, QK_K // 2)
+    blocks = np.concatenate((ql, _pack_2bit(L >> 4), sc.view(np.uint8), _to_f16_bytes(d)), axis = 1)
+    # Blocks without any non-zero scale are all zeros.
+    blocks[max_abs_scale == 0] = 0
+    return blocks
+
+
+_quantize_blocks: dict[GGMLQuantizationType, Callable[[npt.NDArray[np.float32]], npt.NDArray[np.uint8]]] = {
+    GGMLQuantizationType.Q4_0: _quantize_q4_0,
+    GGMLQuantizationType.Q4_1: _quantize_q4_1,
+    GGMLQuantizationType.Q5_0: _quantize_q5_0,
+    GGMLQuantizationType.Q5_1: _quantize_q5_1,
+    GGMLQuantizationType.Q8_0: _quantize_q8_0,
+    GGMLQuantizationType.Q2_K: _quantize_q2_k,
+    GGMLQuantizationType.Q3_K: _quantize_q3_k,
+    GGMLQuantizationType.Q4_K: _quantize_q4_k,
+    GGMLQuantizationType.Q5_K: _quantize_q5_k,
+    GGMLQuantizationType.Q6_K: _quantize_q6_k,
+}
+
+
+# Quantize data to qtype. The last axis of data holds the values of a row, it has
+# to be a whole number of blocks and is replaced by the raw bytes of the blocks.
+# The blocks are written to out instead when given, any uint8 array of the right
+# size (like a slice of an np.memmap) can be used.
+def quantize(
+    data: npt.NDArray[Any], qtype: GGMLQuantizationType, out: npt.NDArray[np.uint8] | None = None,
+) -> npt.NDArray[np.uint8]:
+    quantize_blocks = _quantize_blocks.get(qtype)
+    if quantize_blocks is None:
+        raise NotImplementedError(f'Quantization to {qtype.name} is not supported')
+    block_size, type_size = GGML_QUANT_SIZES[qtype]
+    row_items = data.shape[-1]
+    if row_items % block_size != 0:
+        raise ValueError(f'Row of {row_items} items is not a whole number of {qtype.name} blocks')
+    values = data.reshape(-1, block_size)
+    result_shape = (*data.shape[:-1], row_items // block_size * type_size)
+    if out is None:
+        result = np.empty((values.shape[0], type_size), dtype = np.uint8)
+    elif out.dtype != np.uint8 or out.size != values.shape[0] * type_size:
+        raise ValueError(f'Output buffer of {out.size} {out.dtype} items does not fit {values.shape[0]} {qtype.name} blocks')
+    else:
+        # Setting the shape fails rather than copying when out isn't contiguous
+        result = out.view()
+        result.shape = (values.shape[0], type_size)
+    # Divisions by zero and the like only happen in masked out lanes.
+    with np.errstate(divide = 'ignore', invalid = 'ignore', over = 'ignore'):
+        for start in range(0, values.shape[0], QUANTIZE_CHUNK_BLOCKS):
+            end = start + QUANTIZE_CHUNK_BLOCKS
+            result[start:end] = quantize_blocks(values[start:end].astype(np.float32))
+    return result.reshape(result_shape) if out is None else out
+
+
+# Swap the byte order of data of type qtype in place, or into out (which gets a copy of
+# the data with the values swapped). Only the values listed in GGML_QUANT_ENDIAN_FIELDS
+# are swapped. The values are swapped by copying them from a view with the other byte
+# order, which unlike ndarray.byteswap() doesn't hold the GIL, so several tensors can be
+# converted at once in threads.
+def byteswap(data: npt.NDArray[Any], qtype: GGMLQuantizationType, out: npt.NDArray[Any] | None = None) -> None:
+    fields = GGML_QUANT_ENDIAN_FIELDS.get(qtype)
+    if fields is None:
+        raise NotImplementedError(f'Byte swapping {qtype.name} is not supported')
+    type_size = GGML_QUANT_SIZES[qtype][1]
+    if not data.flags.c_contiguous or (out is not None and not out.flags.c_contiguous):
+        raise ValueError('Byte swapping needs contiguous arrays')
+    src = data.reshape(-1).view(np.uint8).reshape(-1, type_size)
+    dst = src if out is None else out.reshape(-1).view(np.uint8).reshape(-1, type_size)
+    if dst.shape != src.shape:
+        raise ValueError(f'Output buffer of {dst.size} bytes does not fit {src.size} bytes of data')
+    chunk_blocks = max(1, BYTESWAP_CHUNK_BYTES // type_size)
+    for start in range(0, src.shape[0], chunk_blocks):
+        end = start + chunk_blocks
+        if dst is not src:
+            dst[start:end] = src[start:end]
+        for offset, size, count in fields:
+            values = dst[start:end, offset:offset + size * count].view(f'<u{size}')
+            values[...] = values.view(f'>u{size}')
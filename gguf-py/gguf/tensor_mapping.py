@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Sequence
+from typing import Iterable, Sequence
 
 from .constants import MODEL_ARCH, MODEL_TENSOR, MODEL_TENSORS, TENSOR_NAMES
 
@@ -198,36 +198,85 @@ class TensorNameMap:
 
     mapping: dict[str, tuple[MODEL_TENSOR, str]]
 
+    # Mappings compiled per architecture, shared by all instances: the names without a block
+    # number, and the block names with the block number replaced by {bid}.
+    _compiled: dict[MODEL_ARCH, tuple[dict[str, tuple[MODEL_TENSOR, str]], dict[str, tuple[MODEL_TENSOR, str]]]] = {}
+
     def __init__(self, arch: MODEL_ARCH, n_blocks: int):
-        self.mapping = {}
-        for tensor, keys in self.mappings_cfg.items():
+        self.arch = arch
+        self.n_blocks = n_blocks
+        compiled = self._compiled.get(arch)
+        if compiled is None:
+            compiled = self._compiled[arch] = self._compile(arch)
+        self.static_mapping, self.block_mapping = compiled
+
+    @classmethod
+    def _compile(cls, arch: MODEL_ARCH) -> tuple[dict[str, tuple[MODEL_TENSOR, str]], dict[str, tuple[MODEL_TENSOR, str]]]:
+        static_mapping = {}
+        for tensor, keys in cls.mappings_cfg.items():
+            if tensor not in MODEL_TENSORS[arch]:
+                continue
+            tensor_name = TENSOR_NAMES[tensor]
+            static_mapping[tensor_name] = (tensor, tensor_name)
+            for key in keys:
+                static_mapping[key] = (tensor, tensor_name)
+        block_mapping = {}
+        for tensor, keys in cls.block_mappings_cfg.items():
             if tensor not in MODEL_TENSORS[arch]:
                 continue
             tensor_name = TENSOR_NAMES[tensor]
-            self.mapping[tensor_name] = (tensor, tensor_name)
+            block_mapping[tensor_name] = (tensor, tensor_name)
             for key in keys:
-                self.mapping[key] = (tensor, tensor_name)
-        for bid in range(n_blocks):
-            for tensor, keys in self.block_mappings_cfg.items():
-                if tensor not in MODEL_TENSORS[arch]:
-                    continue
-                tensor_name = TENSOR_NAMES[tensor].format(bid = bid)
-                self.mapping[tensor_name] = (tensor, tensor_name)
-                for key in keys:
-                    key = key.format(bid = bid)
-                    self.mapping[key] = (tensor, tensor_name)
+                block_mapping[key] = (tensor, tensor_name)
+        return static_mapping, block_mapping
+
+    # Every block name has {bid} between two dots, so a block name is looked up by trying
+    # each number between dots as the block number.
+    def _lookup(self, key: str) -> tuple[MODEL_TENSOR, str] | None:
+        result = self.static_mapping.get(key)
+        if result is not None:
+            return result
+        parts = key.split('.')
+        for i in range(1, len(parts) - 1):
+            bid = parts[i]
+            if not bid.isdecimal():
+                continue
+            parts[i] = '{bid}'
+            result = self.block_mapping.get('.'.join(parts))
+            parts[i] = bid
+            if result is not None and int(bid) < self.n_blocks and bid == str(int(bid)):
+                return result[0], result[1].replace('{bid}', bid)
+        return None
+
+    @property
+    def mapping(self) -> dict[str, tuple[MODEL_TENSOR, str]]:
+        # All the names, with the block names expanded for every block
+        mapping = dict(self.static_mapping)
+        for bid in range(self.n_blocks):
+            for key, (tensor, tensor_name) in self.block_mapping.items():
+                mapping[key.format(bid = bid)] = (tensor, tensor_name.format(bid = bid))
+        return mapping
 
     def get_type_and_name(self, key: str, try_suffixes: Sequence[str] = ()) -> tuple[MODEL_TENSOR, str] | None:
-        result = self.mapping.get(key)
+        result = self._lookup(key)
         if result is not None:
             return result
         for suffix in try_suffixes:
             if key.endswith(suffix):
-                result = self.mapping.get(key[:-len(suffix)])
+                result = self._lookup(key[:-len(suffix)])
                 if result is not None:
                     return result[0], result[1] + suffix
         return None
 
+    # Translate a whole list of names at once, None for the names that aren't known.
+    def get_types_and_names(
+        self, keys: Iterable[str], try_suffixes: Sequence[str] = (),
+    ) -> list[tuple[MODEL_TENSOR, str] | None]:
+        return [self.get_type_and_name(key, try_suffixes = try_suffixes) for key in keys]
+
+    def get_names(self, keys: Iterable[str], try_suffixes: Sequence[str] = ()) -> list[str | None]:
+        return [None if result is None else result[1] for result in self.get_types_and_names(keys, try_suffixes)]
+
     def get_name(self, key: str, try_suffixes: Sequence[str] = ()) -> str | None:
         result = self.get_type_and_name(key, try_suffixes = try_suffixes)
         if result is None:
@@ -241,13 +290,13 @@ class TensorNameMap:
         return result[0]
 
     def __getitem__(self, key: str) -> str:
-        try:
-            return self.mapping[key][1]
-        except KeyError:
+        result = self._lookup(key)
+        if result is None:
             raise KeyError(key)
+        return result[1]
 
     def __contains__(self, key: str) -> bool:
-        return key in self.mapping
+        return self._lookup(key) is not None
 
     def __repr__(self) -> str:
         return repr(self.mapping)
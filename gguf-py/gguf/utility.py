@@ -0,0 +1,73 @@
+#
+# Helpers shared by the conversion scripts.
+#
+from __future__ import annotations
+
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Generator, Iterable, TypeVar
+
+_In = TypeVar('_In')
+_Out = TypeVar('_Out')
+
+
+def bounded_parallel_map(
+    func: Callable[[_In], _Out], iterable: Iterable[_In], concurrency: int, max_workers: int | None = None,
+    use_processpool_executor: bool = False, ordered: bool = True, cost: Callable[[_In], int] | None = None,
+    max_cost: int | None = None,
+) -> Generator[_Out, None, None]:
+    '''Parallel map, but with backpressure.  If the caller doesn't call `next`
+    fast enough, this will stop calling `func` at some point rather than
+    letting results pile up in memory.  Specifically, there is a max of one
+    output value buffered per thread.  If `ordered` is false, results are
+    yielded as soon as they are done rather than in the order of the input.
+    If `max_cost` is given, an item is only started while the total `cost` of
+    the items in flight (including results not yet taken by the caller) stays
+    within it, but there is always at least one item in flight.'''
+    if concurrency < 2:
+        yield from map(func, iterable)
+        return
+    iterable = iter(iterable)
+    executor_class: type[ThreadPoolExecutor] | type[ProcessPoolExecutor]
+    if use_processpool_executor:
+        executor_class = ProcessPoolExecutor
+    else:
+        executor_class = ThreadPoolExecutor
+    with executor_class(max_workers = max_workers) as executor:
+        futures: list[concurrent.futures.Future[_Out]] = []
+        costs: dict[concurrent.futures.Future[_Out], int] = {}
+        in_flight_cost = 0
+        next_items: list[_In] = []
+        done = False
+
+        def submit_items() -> None:
+            nonlocal done, in_flight_cost
+            while not done and len(futures) < concurrency:
+                if not next_items:
+                    try:
+                        next_items.append(next(iterable))
+                    except StopIteration:
+                        done = True
+                        break
+                item_cost = cost(next_items[0]) if cost is not None else 0
+                if max_cost is not None and costs and in_flight_cost + item_cost > max_cost:
+                    break
+                future = executor.submit(func, next_items.pop())
+                futures.append(future)
+                costs[future] = item_cost
+                in_flight_cost += item_cost
+
+        while True:
+            submit_items()
+            if not futures:
+                break
+            if ordered:
+                future = futures[0]
+            else:
+                concurrent.futures.wait(futures, return_when = concurrent.futures.FIRST_COMPLETED)
+                future = next(f for f in futures if f.done())
+            futures.remove(future)
+            result = future.result()
+            submit_items()
+            yield result
+            in_flight_cost -= costs.pop(future)
@@ -4,6 +4,7 @@ from __future__ import annotations
 import argparse
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
@@ -15,7 +16,7 @@ if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent /
 import gguf
 
 
-def convert_byteorder(reader: gguf.GGUFReader, args: argparse.Namespace) -> None:
+def host_and_file_endian(reader: gguf.GGUFReader) -> tuple[str, str]:
     if np.uint32(1) == np.uint32(1).newbyteorder("<"):
         # Host is little endian
         host_endian = "little"
@@ -28,71 +29,68 @@ def convert_byteorder(reader: gguf.GGUFReader, args: argparse.Namespace) -> None
         file_endian = swapped_endian
     else:
         file_endian = host_endian
-    order = host_endian if args.order == "native" else args.order
-    print(f"* Host is {host_endian.upper()} endian, GGUF file seems to be {file_endian.upper()} endian")
-    if file_endian == order:
-        print(f"* File is already {order.upper()} endian. Nothing to do.")
-        sys.exit(0)
-    print("* Checking tensors for conversion compatibility")
+    return host_endian, file_endian
+
+
+def check_convertible(reader: gguf.GGUFReader) -> None:
     for tensor in reader.tensors:
-        if tensor.tensor_type not in (
-            gguf.GGMLQuantizationType.F32,
-            gguf.GGMLQuantizationType.F16,
-            gguf.GGMLQuantizationType.Q8_0,
-        ):
+        if tensor.tensor_type not in gguf.GGML_QUANT_ENDIAN_FIELDS:
             raise ValueError(f"Cannot handle type {tensor.tensor_type.name} for tensor {repr(tensor.name)}")
-    print(f"* Preparing to convert from {file_endian.upper()} to {order.upper()}")
-    if args.dry_run:
-        return
-    print("\n*** Warning *** Warning *** Warning **")
-    print("* This conversion process may damage the file. Ensure you have a backup.")
-    if order != host_endian:
-        print("* Requested endian differs from host, you will not be able to load the model on this machine.")
-    print("* The file will be modified immediately, so if conversion fails or is interrupted")
-    print("* the file will be corrupted. Enter exactly YES if you are positive you want to proceed:")
-    response = input("YES, I am sure> ")
-    if response != "YES":
-        print("You didn't enter YES. Okay then, see ya!")
-        sys.exit(0)
-    print(f"\n* Converting fields ({len(reader.fields)})")
-    for idx, field in enumerate(reader.fields.values()):
+
+
+def copy_header(reader: gguf.GGUFReader, path: str) -> gguf.GGUFReader:
+    # Creates the output file with the header of the input and room for the tensor data,
+    # which is filled in by the conversion. The input file is only ever read.
+    with open(path, "wb") as fout:
+        fout.write(reader.data[:reader.data_offset])
+        fout.truncate(len(reader.data))
+    return gguf.GGUFReader(path, "r+", split = False)
+
+
+def convert_byteorder(reader: gguf.GGUFReader, out_reader: gguf.GGUFReader, threads: int) -> None:
+    # Converts the file of reader into the one of out_reader, which may be reader itself
+    print(f"\n* Converting fields ({len(out_reader.fields)})")
+    for idx, field in enumerate(out_reader.fields.values()):
         print(f"- {idx:4}: Converting field {repr(field.name)}, part count: {len(field.parts)}")
         for part in field.parts:
             part.byteswap(inplace=True)
-    print(f"\n* Converting tensors ({len(reader.tensors)})")
-    for idx, tensor in enumerate(reader.tensors):
-        print(
-            f"  - {idx:4}: Converting tensor {repr(tensor.name)}, type={tensor.tensor_type.name}, "
-            f"elements={tensor.n_elements}... ",
-            end="",
-        )
-        tensor_type = tensor.tensor_type
+    print(f"\n* Converting tensors ({len(out_reader.tensors)})")
+    for tensor in out_reader.tensors:
         for part in tensor.field.parts:
             part.byteswap(inplace=True)
-        if tensor_type != gguf.GGMLQuantizationType.Q8_0:
-            tensor.data.byteswap(inplace=True)
-            print()
-            continue
-        # A Q8_0 block consists of a f16 delta followed by 32 int8 quants, so 34 bytes
-        block_size = 34
-        n_blocks = len(tensor.data) // block_size
-        for block_num in range(n_blocks):
-            block_offs = block_num * block_size
-            # I know I said f16, but it doesn't matter here - any simple 16 bit type works.
-            delta = tensor.data[block_offs:block_offs + 2].view(dtype=np.uint16)
-            delta.byteswap(inplace=True)
-            if block_num % 100000 == 0:
-                print(f"[{(n_blocks - block_num) // 1000}K]", end="")
-                sys.stdout.flush()
-        print()
-    print("* Completion")
+
+    def convert_tensor_data(tensors: tuple[gguf.ReaderTensor, gguf.ReaderTensor]) -> None:
+        tensor, out_tensor = tensors
+        assert tensor.data is not None and out_tensor.data is not None
+        gguf.byteswap(tensor.data, tensor.tensor_type, out = None if out_tensor is tensor else out_tensor.data)
+
+    with ThreadPoolExecutor(threads) as executor:
+        results = executor.map(convert_tensor_data, zip(reader.tensors, out_reader.tensors))
+        for idx, (tensor, _) in enumerate(zip(reader.tensors, results)):
+            print(
+                f"  - {idx:4}: Converted tensor {repr(tensor.name)}, type={tensor.tensor_type.name}, "
+                f"elements={tensor.n_elements}",
+            )
+    # The tensor hashes are of the data as stored, so they change with the byte order
+    hashes = out_reader.get_field(gguf.Keys.General.TENSOR_HASHES)
+    if hashes is not None:
+        print("\n* Updating tensor hashes")
+        for idx, tensor in zip(hashes.data, out_reader.tensors):
+            hashes.parts[idx][:] = np.frombuffer(tensor.content_hash().encode("ascii"), dtype=np.uint8)
+
+
+def output_paths(output: str, n_files: int) -> list[str]:
+    if n_files == 1:
+        return [output]
+    prefix = output[:-len(".gguf")] if output.endswith(".gguf") else output
+    return [gguf.GGUF_SPLIT_PATH.format(prefix = prefix, no = no + 1, count = n_files) for no in range(n_files)]
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Convert GGUF file byte order")
     parser.add_argument(
         "model", type=str,
-        help="GGUF format model filename",
+        help="GGUF format model filename, or the first file of a split model",
     )
     parser.add_argument(
         "order", type=str, choices=['big', 'little', 'native'],
@@ -102,10 +100,55 @@ def main() -> None:
         "--dry-run", action="store_true",
         help="Don't actually change anything",
     )
+    parser.add_argument(
+        "--output", type=str,
+        help="Write the converted model to this file instead of converting the input in place",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=os.cpu_count(),
+        help="Number of tensors converted at once (default: number of CPUs)",
+    )
     args = parser.parse_args(None if len(sys.argv) > 1 else ["--help"])
     print(f'* Loading: {args.model}')
-    reader = gguf.GGUFReader(args.model, 'r' if args.dry_run else 'r+')
-    convert_byteorder(reader, args)
+    # The files of a split model are converted one at a time
+    paths = gguf.GGUFReader(args.model, header_only = True).split_paths
+    in_place = args.output is None and not args.dry_run
+    readers = [gguf.GGUFReader(path, 'r+' if in_place else 'r', split = False) for path in paths]
+    out_paths = paths
+    if args.output is not None:
+        out_paths = output_paths(args.output, len(paths))
+        for path in out_paths:
+            if any(os.path.exists(path) and os.path.samefile(path, in_path) for in_path in paths):
+                raise ValueError(f"Output {path} would overwrite the input")
+
+    host_endian, file_endian = host_and_file_endian(readers[0])
+    order = host_endian if args.order == "native" else args.order
+    print(f"* Host is {host_endian.upper()} endian, GGUF file seems to be {file_endian.upper()} endian")
+    if file_endian == order:
+        print(f"* File is already {order.upper()} endian. Nothing to do.")
+        sys.exit(0)
+    print("* Checking tensors for conversion compatibility")
+    for reader in readers:
+        check_convertible(reader)
+    print(f"* Preparing to convert from {file_endian.upper()} to {order.upper()}")
+    if args.dry_run:
+        return
+    if order != host_endian:
+        print("* Requested endian differs from host, you will not be able to load the model on this machine.")
+    if in_place:
+        print("\n*** Warning *** Warning *** Warning **")
+        print("* This conversion process may damage the file. Ensure you have a backup, or use --output.")
+        print("* The file will be modified immediately, so if conversion fails or is interrupted")
+        print("* the file will be corrupted. Enter exactly YES if you are positive you want to proceed:")
+        response = input("YES, I am sure> ")
+        if response != "YES":
+            print("You didn't enter YES. Okay then, see ya!")
+            sys.exit(0)
+    for path, reader, out_path in zip(paths, readers, out_paths):
+        if len(readers) > 1 or not in_place:
+            print(f"\n* Converting {path} to {out_path}")
+        convert_byteorder(reader, reader if in_place else copy_header(reader, out_path), args.threads)
+    print("* Completion")
 
 
 if __name__ == "__main__":
@@ -78,7 +78,11 @@ def dump_metadata_json(reader: GGUFReader, args: argparse.Namespace) -> None:
             if not args.json_array:
                 continue
             itype = field.types[-1]
-            if itype == GGUFValueType.STRING:
+            if len(field.types) == 2 and itype == GGUFValueType.STRING:
+                curr["value"] = reader.get_string_array(field.name).as_str()
+            elif len(field.types) == 2:
+                curr["value"] = reader.get_array(field.name).tolist()
+            elif itype == GGUFValueType.STRING:
                 curr["value"] = [str(bytes(field.parts[idx]), encoding="utf-8") for idx in field.data]
             else:
                 curr["value"] = [pv for idx in field.data for pv in field.parts[idx].tolist()]
@@ -106,7 +110,7 @@ def main() -> None:
     args = parser.parse_args(None if len(sys.argv) > 1 else ["--help"])
     if not args.json:
         print(f'* Loading: {args.model}')
-    reader = GGUFReader(args.model, 'r')
+    reader = GGUFReader(args.model, 'r', header_only = True)
     if args.json:
         dump_metadata_json(reader, args)
     else:
@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
+from __future__ import annotations
+
 import argparse
+import json
 import os
+import struct
 import sys
 from pathlib import Path
+from typing import Any
 
 # Necessary to load the local gguf package
 if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
     sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from gguf import GGUFReader  # noqa: E402
+from gguf import GGUFEditor, GGUFReader, GGUFValueType  # noqa: E402
 
 
 def minimal_example(filename: str) -> None:
@@ -38,27 +43,81 @@ def minimal_example(filename: str) -> None:
     # field value itself.
 
 
-def set_metadata(reader: GGUFReader, args: argparse.Namespace) -> None:
-    field = reader.get_field(args.key)
-    if field is None:
-        print(f'! Field {repr(args.key)} not found', file = sys.stderr)
-        sys.exit(1)
-    # Note that field.types is a list of types. This is because the GGUF
+def parse_value(text: str, vtype: GGUFValueType) -> Any:
+    if vtype == GGUFValueType.STRING:
+        return text
+    if vtype == GGUFValueType.BOOL:
+        if text.lower() not in ('true', 'false', '1', '0'):
+            raise ValueError(f'Invalid bool value {text!r}')
+        return text.lower() in ('true', '1')
+    if vtype in (GGUFValueType.FLOAT32, GGUFValueType.FLOAT64):
+        return float(text)
+    return int(text, 0)
+
+
+# Arrays are given as JSON lists, like '[1, 2, 3]' or '["a", "b"]'
+def parse_array(text: str, item_type: GGUFValueType) -> list[Any]:
+    items = json.loads(text)
+    if not isinstance(items, list):
+        raise ValueError('Array values have to be JSON lists')
+    return [parse_value(item if isinstance(item, str) else json.dumps(item), item_type) for item in items]
+
+
+def current_value(editor: GGUFEditor, key: str) -> Any:
+    field = editor.reader.get_field(key)
+    assert field is not None
+    if field.types[0] == GGUFValueType.ARRAY:
+        return f'an array of {len(field.data)} item(s)'
+    if field.types[0] == GGUFValueType.STRING:
+        return str(bytes(field.parts[field.data[0]]), encoding = 'utf-8')
+    return field.parts[field.data[0]][0]
+
+
+def set_metadata(editor: GGUFEditor, args: argparse.Namespace) -> None:
+    # Note that the types are a list of types. This is because the GGUF
     # format supports arrays. For example, an array of UINT32 would
     # look like [GGUFValueType.ARRAY, GGUFValueType.UINT32]
-    handler = reader.gguf_scalar_to_np.get(field.types[0]) if field.types else None
-    if handler is None:
-        print(
-            f'! This tool only supports changing simple values, {repr(args.key)} has unsupported type {field.types}',
-            file = sys.stderr,
-        )
-        sys.exit(1)
-    current_value = field.parts[field.data[0]][0]
-    new_value = handler(args.value)
-    print(f'* Preparing to change field {repr(args.key)} from {current_value} to {new_value}')
-    if current_value == new_value:
-        print(f'- Key {repr(args.key)} already set to requested value {current_value}')
-        sys.exit(0)
+    types = editor.get_types(args.key)
+    if args.delete:
+        if types is None:
+            print(f'! Field {repr(args.key)} not found', file = sys.stderr)
+            sys.exit(1)
+        print(f'* Preparing to delete field {repr(args.key)}')
+        editor.delete(args.key)
+    else:
+        if args.value is None:
+            print('! No value given', file = sys.stderr)
+            sys.exit(1)
+        if args.type is not None:
+            vtype = GGUFValueType[args.type.upper()]
+        elif types is not None:
+            vtype = types[0]
+        else:
+            print(f'! Field {repr(args.key)} not found, use --type to add it', file = sys.stderr)
+            sys.exit(1)
+        item_type = None
+        if vtype == GGUFValueType.ARRAY:
+            if args.item_type is not None:
+                item_type = GGUFValueType[args.item_type.upper()]
+            elif types is not None and len(types) > 1:
+                item_type = types[1]
+            else:
+                print('! Use --item-type to set the type of the array items', file = sys.stderr)
+                sys.exit(1)
+        try:
+            new_value = parse_array(args.value, item_type) if item_type is not None else parse_value(args.value, vtype)
+            editor.set(args.key, new_value, vtype, item_type)
+        except (ValueError, struct.error) as e:
+            print(f'! Invalid value for {repr(args.key)}: {e}', file = sys.stderr)
+            sys.exit(1)
+        if types is None:
+            print(f'* Preparing to add field {repr(args.key)} of type {vtype.name} with value {new_value!r}')
+        else:
+            current = current_value(editor, args.key)
+            print(f'* Preparing to change field {repr(args.key)} from {current!r} to {new_value!r}')
+            if types == [vtype] and current == new_value:
+                print(f'- Key {repr(args.key)} already set to requested value {current!r}')
+                sys.exit(0)
     if args.dry_run:
         sys.exit(0)
     if not args.force:
@@ -69,21 +128,29 @@ def set_metadata(reader: GGUFReader, args: argparse.Namespace) -> None:
         if response != 'YES':
             print("You didn't enter YES. Okay then, see ya!")
             sys.exit(0)
-    field.parts[field.data[0]][0] = new_value
+    if editor.write(args.output):
+        print('* The header was rewritten in place.')
+    else:
+        print('* The header changed size, the tensor data was copied after the new header.')
     print('* Field changed. Successful completion.')
 
 
 def main() -> None:
-    parser = argparse.ArgumentParser(description="Set a simple value in GGUF file metadata")
-    parser.add_argument("model",     type=str,            help="GGUF format model filename")
-    parser.add_argument("key",       type=str,            help="Metadata key to set")
-    parser.add_argument("value",     type=str,            help="Metadata value to set")
-    parser.add_argument("--dry-run", action="store_true", help="Don't actually change anything")
-    parser.add_argument("--force",   action="store_true", help="Change the field without confirmation")
+    value_types = [vtype.name.lower() for vtype in GGUFValueType]
+    parser = argparse.ArgumentParser(description="Add, change or delete a value in GGUF file metadata")
+    parser.add_argument("model",       type=str,            help="GGUF format model filename")
+    parser.add_argument("key",         type=str,            help="Metadata key to set")
+    parser.add_argument("value",       type=str, nargs="?", help="Metadata value to set, arrays as a JSON list")
+    parser.add_argument("--type",      choices=value_types, help="Value type, by default the type the key has")
+    parser.add_argument("--item-type", choices=value_types, help="Item type of array values")
+    parser.add_argument("--delete",    action="store_true", help="Delete the key")
+    parser.add_argument("--output",    type=str,            help="Write the changed model to this file instead")
+    parser.add_argument("--dry-run",   action="store_true", help="Don't actually change anything")
+    parser.add_argument("--force",     action="store_true", help="Change the field without confirmation")
     args = parser.parse_args(None if len(sys.argv) > 1 else ["--help"])
     print(f'* Loading: {args.model}')
-    reader = GGUFReader(args.model, 'r' if args.dry_run else 'r+')
-    set_metadata(reader, args)
+    editor = GGUFEditor(args.model)
+    set_metadata(editor, args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from gguf import GGUFReader  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Verify the tensor data of a GGUF file against the hashes in its metadata")
+    parser.add_argument("model",     type=str,            help="GGUF format model filename, or the first file of a split model")
+    parser.add_argument("--tensors", type=str,            help="Only verify the tensors with names matching this glob, e.g. 'blk.*.ffn_*'")
+    parser.add_argument("--regex",   action="store_true", help="The --tensors pattern is a regular expression")
+    parser.add_argument("--threads", type=int,            help="Number of tensors verified at once (default: number of CPUs)", default=os.cpu_count())
+    parser.add_argument("--json",    type=str,            help="Write the hash, location and result of every verified tensor as JSON to this file")
+    args = parser.parse_args(None if len(sys.argv) > 1 else ["--help"])
+    print(f'* Loading: {args.model}')
+    reader = GGUFReader(args.model, 'r', lazy = True)
+    hashes = reader.get_tensor_hashes()
+    if not hashes:
+        print('! The model has no tensor hashes', file = sys.stderr)
+        sys.exit(1)
+    tensors = reader.select_tensors(args.tensors, regex = args.regex) if args.tensors is not None else list(reader.tensors)
+    print(f'* Verifying {len(tensors)} of {len(reader.tensors)} tensor(s)')
+    try:
+        bad = set(reader.verify_tensors(tensors, threads = args.threads))
+    except ValueError as e:
+        print(f'! {e}', file = sys.stderr)
+        sys.exit(1)
+    for tensor in tensors:
+        if tensor.name in bad:
+            print(f'! Tensor {repr(tensor.name)} in {reader.split_paths[tensor.shard]} does not match its hash')
+    if args.json is not None:
+        # The locations allow fetching just the bad tensors again, the hashes finding the same tensors in other models
+        report: list[dict[str, Any]] = [{
+            "name": tensor.name,
+            "file": reader.split_paths[tensor.shard],
+            "offset": tensor.data_offset,
+            "nbytes": int(tensor.n_bytes),
+            "hash": hashes[tensor.name],
+            "valid": tensor.name not in bad,
+        } for tensor in tensors]
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent = 2)
+    if bad:
+        print(f'* {len(bad)} of {len(tensors)} tensor(s) are corrupted')
+        sys.exit(1)
+    print('* All tensors match their hashes.')
+
+
+if __name__ == '__main__':
+    main()
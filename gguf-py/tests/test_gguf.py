@@ -1,7 +1,504 @@
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+
 import gguf  # noqa: F401
 
-# TODO: add tests
 
+def write_test_gguf(path: Path) -> None:
+    writer = gguf.GGUFWriter(path, "llama")
+    writer.add_block_count(2)
+    writer.add_name("test")
+    writer.add_token_list(["<s>", "</s>", "hello", "wörld"])
+    writer.add_token_scores([0.0, -1.0, -2.5, 3.25])
+    writer.add_token_types([1, 3, 1, 1])
+    for bid in range(2):
+        writer.add_tensor(f"blk.{bid}.attn_q.weight", np.arange(64, dtype=np.float32).reshape(2, 32) + bid)
+        writer.add_tensor(f"blk.{bid}.ffn_up.weight", np.ones((2, 32), dtype=np.float16))
+    writer.add_tensor("output.weight", np.full((4, 32), 2, dtype=np.float32))
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+
+
+def test_write_gguf(tmp_path: Path) -> None:
+    path = tmp_path / "test.gguf"
+    write_test_gguf(path)
+    reader = gguf.GGUFReader(path)
+    assert bytes(reader.fields["general.architecture"].parts[-1]) == b"llama"
+    assert [tensor.name for tensor in reader.tensors][-1] == "output.weight"
+    assert np.array_equal(reader.tensors[2].data, np.arange(64, dtype=np.float32) + 1)
+
+
+def test_lazy_fields(tmp_path: Path) -> None:
+    path = tmp_path / "test.gguf"
+    write_test_gguf(path)
+    eager = gguf.GGUFReader(path)
+    lazy = gguf.GGUFReader(path, lazy = True)
+    assert list(lazy.fields) == list(eager.fields)
+    assert lazy.get_field("missing") is None
+    for name, field in eager.fields.items():
+        lazy_field = lazy.fields[name]
+        assert (lazy_field.offset, lazy_field.types, lazy_field.data) == (field.offset, field.types, field.data)
+        assert all(np.array_equal(a, b) for a, b in zip(lazy_field.parts, field.parts))
+
+
+def test_array_accessors(tmp_path: Path) -> None:
+    path = tmp_path / "test.gguf"
+    write_test_gguf(path)
+    reader = gguf.GGUFReader(path, lazy = True)
+    tokens = reader.get_string_array("tokenizer.ggml.tokens")
+    assert tokens is not None
+    assert tokens.as_str() == ["<s>", "</s>", "hello", "wörld"]
+    assert tokens.offsets.tolist() == [0, 3, 7, 12, 18]
+    scores = reader.get_array("tokenizer.ggml.scores")
+    assert scores is not None and scores.tolist() == [0.0, -1.0, -2.5, 3.25]
+    assert reader.get_array("missing") is None
+
+
+def test_header_only(tmp_path: Path) -> None:
+    path = tmp_path / "test.gguf"
+    write_test_gguf(path)
+    full = gguf.GGUFReader(path)
+
+    class SmallReadReader(gguf.GGUFReader):
+        header_read_size = 64
+
+    reader = SmallReadReader(path, header_only = True)
+    assert reader.data.nbytes < path.stat().st_size
+    assert list(reader.fields) == list(full.fields)
+    for tensor, full_tensor in zip(reader.tensors, full.tensors):
+        assert tensor.data is None
+        assert (tensor.name, tensor.data_offset, tensor.n_bytes) == (full_tensor.name, full_tensor.data_offset, full_tensor.n_bytes)
+
+
+def test_select_tensors(tmp_path: Path) -> None:
+    path = tmp_path / "test.gguf"
+    write_test_gguf(path)
+    reader = gguf.GGUFReader(path)
+    tensor = reader.get_tensor_by_name("blk.1.attn_q.weight")
+    assert tensor is not None and tensor is reader.get_tensor(2)
+    assert reader.get_tensor_by_name("blk.2.attn_q.weight") is None
+
+    def names(tensors: list[gguf.ReaderTensor]) -> list[str]:
+        return [tensor.name for tensor in tensors]
+
+    assert names(reader.select_tensors(blocks = 1)) == ["blk.1.attn_q.weight", "blk.1.ffn_up.weight"]
+    assert names(reader.select_tensors("*.ffn_*")) == ["blk.0.ffn_up.weight", "blk.1.ffn_up.weight"]
+    assert names(reader.select_tensors(r"blk\.\d+\.attn_q\.weight", blocks = [0], regex = True)) == ["blk.0.attn_q.weight"]
+    assert len(reader.select_tensors()) == len(reader.tensors)
+
+
+def test_dequantize_rows(tmp_path: Path) -> None:
+    # Q8_0 tensor of 3 rows with 64 elements each, every block has d = 0.5 and quants -16..15
+    d = np.full((6, 1), 0.5, dtype = np.float16).view(np.uint8)
+    qs = np.tile(np.arange(-16, 16, dtype = np.int8), (6, 1)).view(np.uint8)
+    blocks = np.concatenate((d, qs), axis = 1)
+    path = tmp_path / "test.gguf"
+    writer = gguf.GGUFWriter(path, "llama")
+    writer.add_tensor("q8", blocks.reshape(-1), raw_shape = (3, 64), raw_dtype = gguf.GGMLQuantizationType.Q8_0)
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+
+    tensor = gguf.GGUFReader(path).tensors[0]
+    expected = np.tile(np.arange(-16, 16, dtype = np.float32) * 0.5, (3, 2))
+    assert np.array_equal(tensor.dequantize(), expected)
+    assert np.array_equal(tensor.dequantize(rows = slice(1, 3)), expected[1:3])
+    q4_0 = np.concatenate((np.ones(1, dtype = np.float16).view(np.uint8), np.full(16, 0x98, dtype = np.uint8)))
+    assert gguf.dequantize(q4_0, gguf.GGMLQuantizationType.Q4_0).tolist() == [0.0] * 16 + [1.0] * 16
+
+    # The scales of a big endian file are swapped back
+    path = tmp_path / "big.gguf"
+    swapped = blocks.copy()
+    gguf.byteswap(swapped, gguf.GGMLQuantizationType.Q8_0)
+    writer = gguf.GGUFWriter(path, "llama", endianess = gguf.GGUFEndian.BIG)
+    writer.add_tensor("q8", swapped.reshape(-1), raw_shape = (3, 64), raw_dtype = gguf.GGMLQuantizationType.Q8_0)
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+    tensor = gguf.GGUFReader(path).tensors[0]
+    assert tensor.endianess == gguf.GGUFEndian.BIG
+    assert np.array_equal(tensor.dequantize(), expected)
+    assert np.array_equal(tensor.dequantize(rows = slice(1, 3)), expected[1:3])
+
+
+def test_quantize_round_trip() -> None:
+    rng = np.random.default_rng(0)
+    values = rng.standard_normal((4, 512)).astype(np.float32)
+    max_errors = {"Q4_0": 0.4, "Q4_1": 0.4, "Q5_0": 0.2, "Q5_1": 0.2, "Q8_0": 0.02,
+                  "Q2_K": 1.0, "Q3_K": 0.6, "Q4_K": 0.3, "Q5_K": 0.15, "Q6_K": 0.08}
+    for name, max_error in max_errors.items():
+        qtype = gguf.GGMLQuantizationType[name]
+        block_size, type_size = gguf.GGML_QUANT_SIZES[qtype]
+        quantized = gguf.quantize(values, qtype)
+        assert quantized.shape == (4, 512 // block_size * type_size)
+        assert np.abs(gguf.dequantize(quantized, qtype) - values).max() < max_error, name
+    # Integers with a block maximum of 127 are exactly representable in Q8_0
+    exact = rng.integers(-127, 128, (2, 64)).astype(np.float32)
+    exact[:, ::32] = 127
+    q8_0 = gguf.GGMLQuantizationType.Q8_0
+    assert np.array_equal(gguf.dequantize(gguf.quantize(exact, q8_0), q8_0), exact)
+
+
+def test_byteswap() -> None:
+    rng = np.random.default_rng(0)
+    values = rng.standard_normal((4, 512)).astype(np.float32)
+    f16 = values.astype(np.float16)
+    swapped = np.empty_like(f16)
+    gguf.byteswap(f16, gguf.GGMLQuantizationType.F16, out = swapped)
+    assert np.array_equal(swapped.view(">f2"), f16)
+    for name in ("Q4_0", "Q5_1", "Q8_0", "Q2_K", "Q3_K", "Q4_K", "Q6_K"):
+        qtype = gguf.GGMLQuantizationType[name]
+        quantized = gguf.quantize(values, qtype)
+        swapped = np.empty_like(quantized)
+        gguf.byteswap(quantized, qtype, out = swapped)
+        assert not np.array_equal(swapped, quantized), name
+        # Swapping twice in place restores the data
+        gguf.byteswap(swapped, qtype)
+        assert np.array_equal(swapped, quantized), name
+
+
+def test_write_tensor_data(tmp_path: Path) -> None:
+    tensors = {"a": np.arange(10, dtype=np.float32), "b": np.ones((3, 5), dtype=np.float16)}
+    path = tmp_path / "streamed.gguf"
+    writer = gguf.GGUFWriter(path, "llama")
+    for name, tensor in tensors.items():
+        writer.add_tensor_info(name, tensor.shape, tensor.dtype, tensor.nbytes)
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_ti_data_to_file()
+    assert writer.data_offset % writer.data_alignment == 0
+    with pytest.raises(ValueError):
+        writer.write_tensor_data(tensors["b"])
+    for tensor in tensors.values():
+        writer.write_tensor_data(tensor)
+    writer.close()
+
+    # Same file as when the tensors go through the temporary file
+    buffered_path = tmp_path / "buffered.gguf"
+    writer = gguf.GGUFWriter(buffered_path, "llama")
+    for name, tensor in tensors.items():
+        writer.add_tensor(name, tensor)
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+    assert path.read_bytes() == buffered_path.read_bytes()
+
+    writer = gguf.GGUFWriter(tmp_path / "truncated.gguf", "llama")
+    writer.add_tensor_info("a", (10,), np.dtype(np.float32), 40)
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_ti_data_to_file()
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+def test_write_tensor_data_at(tmp_path: Path) -> None:
+    tensors = {f"t{i}": np.full((i + 1, 8), i, dtype=np.float32) for i in range(8)}
+
+    def write(path: Path, names: list[str]) -> None:
+        writer = gguf.GGUFWriter(path, "llama")
+        for name, tensor in tensors.items():
+            writer.add_tensor_info(name, tensor.shape, tensor.dtype, tensor.nbytes)
+        writer.write_header_to_file()
+        writer.write_kv_data_to_file()
+        writer.write_ti_data_to_file()
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda name: writer.write_tensor_data_at(name, tensors[name]), names))
+        with pytest.raises(ValueError):
+            writer.write_tensor_data_at(names[0], tensors[names[0]])
+        writer.close()
+
+    write(tmp_path / "in_order.gguf", list(tensors))
+    write(tmp_path / "reversed.gguf", list(reversed(tensors)))
+    assert (tmp_path / "in_order.gguf").read_bytes() == (tmp_path / "reversed.gguf").read_bytes()
+    reader = gguf.GGUFReader(tmp_path / "reversed.gguf")
+    assert all(np.array_equal(t.data, tensors[t.name].reshape(-1)) for t in reader.tensors)
+
+
+def test_add_array(tmp_path: Path) -> None:
+    for endianess, prefix in ((gguf.GGUFEndian.LITTLE, "<"), (gguf.GGUFEndian.BIG, ">")):
+        writer = gguf.GGUFWriter(tmp_path / "test.gguf", "llama", endianess = endianess)
+        writer.kv_data = bytearray()
+
+        def packed(fmt: str, *values: Any) -> bytes:
+            return struct.pack(prefix + fmt, *values)
+
+        writer.add_val([1, -2, 3])
+        writer.add_val(np.array([1.5, 2.5], dtype = np.float32))
+        writer.add_val(np.array([7, 8], dtype = ">u8"))
+        writer.add_val([True, False])
+        writer.add_val(["a", b"bc", "wörld"])
+        writer.add_val([[1], [2.5, 3.5]])
+        expected = b"".join((
+            packed("IIQiii", gguf.GGUFValueType.ARRAY, gguf.GGUFValueType.INT32, 3, 1, -2, 3),
+            packed("IIQff", gguf.GGUFValueType.ARRAY, gguf.GGUFValueType.FLOAT32, 2, 1.5, 2.5),
+            packed("IIQQQ", gguf.GGUFValueType.ARRAY, gguf.GGUFValueType.UINT64, 2, 7, 8),
+            packed("IIQ??", gguf.GGUFValueType.ARRAY, gguf.GGUFValueType.BOOL, 2, True, False),
+            packed("IIQ", gguf.GGUFValueType.ARRAY, gguf.GGUFValueType.STRING, 3),
+            packed("Q", 1), b"a", packed("Q", 2), b"bc", packed("Q", 6), "wörld".encode("utf8"),
+            packed("IIQ", gguf.GGUFValueType.ARRAY, gguf.GGUFValueType.ARRAY, 2),
+            packed("IQi", gguf.GGUFValueType.INT32, 1, 1),
+            packed("IQff", gguf.GGUFValueType.FLOAT32, 2, 2.5, 3.5),
+        ))
+        assert writer.kv_data == expected
+        with pytest.raises(ValueError):
+            writer.add_val([1, 2.5])
+        with pytest.raises(ValueError):
+            writer.add_val(np.zeros((2, 2), dtype = np.float32))
+        # Values that don't fit the item type aren't wrapped around
+        with pytest.raises(ValueError):
+            writer.add_array("a", [1, 2**40])
+        with pytest.raises(ValueError):
+            writer.add_array("a", [-2**31 - 1])
+        with pytest.raises(ValueError):
+            writer.add_array("a", [1.0, 1e40])
+
+
+def test_resume_tensor_data(tmp_path: Path) -> None:
+    tensors = {f"t{i}": np.full((i + 1, 8), i, dtype=np.float32) for i in range(6)}
+
+    def start(path: Path, resume: bool) -> gguf.GGUFWriter:
+        writer = gguf.GGUFWriter(path, "llama", journal = True, resume = resume)
+        for name, tensor in tensors.items():
+            writer.add_tensor_info(name, tensor.shape, tensor.dtype, tensor.nbytes)
+        writer.write_header_to_file()
+        writer.write_kv_data_to_file()
+        writer.write_ti_data_to_file()
+        return writer
+
+    complete_path = tmp_path / "complete.gguf"
+    writer = start(complete_path, resume = False)
+    for name, tensor in tensors.items():
+        writer.write_tensor_data_at(name, tensor)
+    writer.close()
+    assert not Path(f"{complete_path}.journal").exists()
+
+    path = tmp_path / "resumed.gguf"
+    writer = start(path, resume = False)
+    for name in ("t4", "t1", "t2"):
+        writer.write_tensor_data_at(name, tensors[name])
+    with pytest.raises(ValueError):
+        writer.close()
+
+    # Damage t2, so that it has to be written again
+    with open(path, "r+b") as f:
+        f.seek(writer.data_offset + writer.tensor_infos["t2"].offset)
+        f.write(b"\xff" * 4)
+
+    writer = start(path, resume = True)
+    assert writer.tensors_written == {"t1", "t4"}
+    for name, tensor in tensors.items():
+        if name not in writer.tensors_written:
+            writer.write_tensor_data_at(name, tensor)
+    writer.close()
+    assert path.read_bytes() == complete_path.read_bytes()
+
+
+def test_split_round_trip(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    tensors = {f"blk.{i}.ffn_up.weight": np.full((i + 1, 8), i, dtype=np.float32) for i in range(6)}
+    writer = gguf.GGUFSplitWriter(tmp_path / "model.gguf", "llama", 3)
+    writer.add_name("test")
+    for name, tensor in tensors.items():
+        writer.add_tensor_info(name, tensor.shape, tensor.dtype, tensor.nbytes)
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_ti_data_to_file()
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda name: writer.write_tensor_data_at(name, tensors[name]), reversed(tensors)))
+    writer.close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == [f"model-0000{no}-of-00003.gguf" for no in (1, 2, 3)]
+
+    reader = gguf.GGUFReader(tmp_path / "model-00001-of-00003.gguf")
+    assert bytes(reader.fields["general.name"].parts[-1]) == b"test"
+    assert reader.shards[1:] == [None, None]
+    tensor = reader.get_tensor_by_name("blk.5.ffn_up.weight")
+    assert tensor is not None and tensor.shard == 2 and reader.shards[1] is None
+    assert [t.name for t in reader.select_tensors(blocks = 5)] == ["blk.5.ffn_up.weight"]
+    assert reader.shards[1] is None
+    assert [tensor.name for tensor in reader.tensors] == list(tensors)
+    assert all(np.array_equal(t.data, tensors[t.name].reshape(-1)) for t in reader.tensors)
+    assert [t.shard for t in reader.tensors] == sorted(t.shard for t in reader.tensors)
+    assert {t.shard for t in reader.tensors} == {0, 1, 2}
+
+    # Without the name of the first file, the others can't be found
+    renamed = tmp_path / "renamed.gguf"
+    (tmp_path / "model-00001-of-00003.gguf").rename(renamed)
+    reader = gguf.GGUFReader(renamed)
+    assert "WARNING" in capsys.readouterr().err
+    assert reader.split_paths == [str(renamed)]
+    assert [t.name for t in reader.tensors] == list(tensors)[:len(reader.tensors)]
+    assert all(t.shard == 0 for t in reader.tensors)
+
+
+def test_data_layout(tmp_path: Path) -> None:
+    names = ["output.weight", "blk.1.ffn_up.weight", "blk.0.ffn_up.weight", "blk.1.attn_q.weight",
+             "token_embd.weight", "blk.0.attn_q.weight", "output_norm.weight", "blk.0.attn_q.bias"]
+    tensors = {name: np.full((2, 8), i, dtype=np.float32) for i, name in enumerate(names)}
+    path = tmp_path / "layout.gguf"
+    writer = gguf.GGUFWriter(path, "llama")
+    writer.add_custom_alignment(4096)
+    writer.add_tensor_data_order(gguf.TensorDataLayout.EXECUTION)
+    for name, tensor in tensors.items():
+        writer.add_tensor_info(name, tensor.shape, tensor.dtype, tensor.nbytes)
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_ti_data_to_file()
+    for name, tensor in tensors.items():
+        writer.write_tensor_data_at(name, tensor)
+    writer.close()
+
+    reader = gguf.GGUFReader(path)
+    assert reader.alignment == 4096
+    assert bytes(reader.fields["general.tensor_data_order"].parts[-1]) == b"execution"
+    assert [tensor.name for tensor in reader.tensors] == names
+    assert all(tensor.data_offset % 4096 == 0 for tensor in reader.tensors)
+    assert all(np.array_equal(t.data, tensors[t.name].reshape(-1)) for t in reader.tensors)
+    assert [t.name for t in sorted(reader.tensors, key=lambda t: t.data_offset)] == [
+        "token_embd.weight", "blk.0.attn_q.weight", "blk.0.attn_q.bias", "blk.0.ffn_up.weight",
+        "blk.1.attn_q.weight", "blk.1.ffn_up.weight", "output_norm.weight", "output.weight",
+    ]
+
+    # Every file of a split model has the key, its tensors are in the order of their data
+    writer = gguf.GGUFSplitWriter(tmp_path / "split.gguf", "llama", 2)
+    writer.add_tensor_data_order(gguf.TensorDataLayout.EXECUTION)
+    for name, tensor in tensors.items():
+        writer.add_tensor_info(name, tensor.shape, tensor.dtype, tensor.nbytes)
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_ti_data_to_file()
+    for name, tensor in tensors.items():
+        writer.write_tensor_data_at(name, tensor)
+    writer.close()
+    for path in writer.paths:
+        shard = gguf.GGUFReader(path, split = False)
+        assert bytes(shard.fields["general.tensor_data_order"].parts[-1]) == b"execution"
+        assert [t.name for t in shard.tensors] == [t.name for t in sorted(shard.tensors, key=lambda t: t.data_offset)]
+
+
+def test_tensor_name_map() -> None:
+    tmap = gguf.TensorNameMap(gguf.MODEL_ARCH.LLAMA, 2)
+    names = ["model.layers.1.self_attn.q_proj.weight", "model.layers.2.self_attn.q_proj.weight",
+             "model.embed_tokens.weight", "layers.0.feed_forward.w1.bias", "model.layers.01.mlp.up_proj", "unknown"]
+    assert tmap.get_names(names, try_suffixes = (".weight", ".bias")) == [
+        "blk.1.attn_q.weight", None, "token_embd.weight", "blk.0.ffn_gate.bias", None, None,
+    ]
+    assert tmap.get_type("blk.1.ffn_down") == gguf.MODEL_TENSOR.FFN_DOWN
+    assert "model.layers.1.mlp.down_proj" in tmap and "model.layers.2.mlp.down_proj" not in tmap
+    assert tmap.mapping["model.layers.1.mlp.down_proj"] == (gguf.MODEL_TENSOR.FFN_DOWN, "blk.1.ffn_down")
+
+
+def test_editor(tmp_path: Path) -> None:
+    path = tmp_path / "test.gguf"
+    write_test_gguf(path)
+    original = gguf.GGUFReader(path)
+    tensors = [(tensor.name, tensor.data.copy()) for tensor in original.tensors]
+    # A value of the same size keeps the header size
+    editor = gguf.GGUFEditor(path)
+    editor.set("llama.block_count", 3)
+    assert editor.write()
+    editor = gguf.GGUFEditor(path)
+    editor.set("general.name", "a name long enough to move the tensor data " * 2)
+    editor.set("test.items", ["a", "bc"], gguf.GGUFValueType.ARRAY, gguf.GGUFValueType.STRING)
+    editor.delete("tokenizer.ggml.token_type")
+    with pytest.raises(ValueError):
+        editor.set("test.missing_type", 1)
+    # Array items are range checked like single values
+    with pytest.raises(ValueError):
+        editor.set("test.bytes", [70000], gguf.GGUFValueType.ARRAY, gguf.GGUFValueType.UINT8)
+    with pytest.raises(ValueError):
+        editor.set("test.bytes", np.array([-1]), gguf.GGUFValueType.ARRAY, gguf.GGUFValueType.UINT8)
+    assert not editor.write()
+    reader = gguf.GGUFReader(path, lazy = True)
+    assert list(reader.fields)[-1] == "test.items"
+    assert "tokenizer.ggml.token_type" not in reader.fields
+    assert reader.get_field("llama.block_count").parts[-1][0] == 3
+    assert bytes(reader.get_field("general.name").parts[-1]).startswith(b"a name long")
+    assert reader.get_string_array("test.items").as_str() == ["a", "bc"]
+    assert reader.get_array("tokenizer.ggml.scores").tolist() == [0.0, -1.0, -2.5, 3.25]
+    assert reader.data_offset != original.data_offset
+    for tensor, (name, data) in zip(reader.tensors, tensors):
+        assert tensor.name == name and np.array_equal(tensor.data, data)
+
+
+def test_editor_alignment(tmp_path: Path) -> None:
+    path = tmp_path / "aligned.gguf"
+    writer = gguf.GGUFWriter(path, "llama")
+    writer.add_custom_alignment(64)
+    writer.add_tensor("a", np.arange(3, dtype=np.float32))
+    writer.add_tensor("b", np.arange(100, 103, dtype=np.float32))
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+    original = path.read_bytes()
+    editor = gguf.GGUFEditor(path)
+    with pytest.raises(ValueError):
+        editor.delete("general.alignment")
+    with pytest.raises(ValueError):
+        editor.set("general.alignment", 32)
+    editor.set("general.name", "aligned", gguf.GGUFValueType.STRING)
+    editor.write()
+    reader = gguf.GGUFReader(path)
+    assert reader.alignment == 64 and path.read_bytes() != original
+    assert np.array_equal(reader.tensor_names["b"].data, np.arange(100, 103, dtype=np.float32))
+
+
+def test_tensor_hashes(tmp_path: Path) -> None:
+    tensors = {f"t{i}": np.full((i + 1, 8), i, dtype=np.float32) for i in range(4)}
+    # Hashed while written
+    writer = gguf.GGUFWriter(tmp_path / "at.gguf", "llama", tensor_hashes = True)
+    for name, tensor in tensors.items():
+        writer.add_tensor_info(name, tensor.shape, tensor.dtype, tensor.nbytes)
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_ti_data_to_file()
+    for name in reversed(tensors):
+        writer.write_tensor_data_at(name, tensors[name])
+    writer.close()
+    # Hashed from the file by close()
+    writer = gguf.GGUFWriter(tmp_path / "added.gguf", "llama", tensor_hashes = True)
+    for name, tensor in tensors.items():
+        writer.add_tensor(name, tensor)
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+    assert (tmp_path / "at.gguf").read_bytes() == (tmp_path / "added.gguf").read_bytes()
+
+    reader = gguf.GGUFReader(tmp_path / "at.gguf", "r+")
+    hashes = reader.get_tensor_hashes()
+    assert list(hashes) == list(tensors)
+    assert hashes["t2"] == gguf.GGUFWriter.tensor_hash(tensors["t2"].tobytes())
+    assert reader.verify_tensors() == []
+    reader.tensor_names["t1"].data[3] = 5
+    assert reader.verify_tensors(threads = 2) == ["t1"]
+    assert reader.verify_tensors(reader.select_tensors("t[23]")) == []
+
+
+def test_bounded_parallel_map() -> None:
+    items = list(range(20))
+    assert list(gguf.bounded_parallel_map(lambda x: x * 2, items, concurrency = 4)) == [x * 2 for x in items]
+    assert list(gguf.bounded_parallel_map(lambda x: x * 2, items, concurrency = 1)) == [x * 2 for x in items]
+    assert sorted(gguf.bounded_parallel_map(lambda x: x * 2, items, concurrency = 4, ordered = False)) == [x * 2 for x in items]
+    # With a budget, no more items are taken from the input than it allows
+    taken: list[int] = []
+
+    def source() -> Any:
+        for x in items:
+            taken.append(x)
+            yield x
 
-def test_write_gguf() -> None:
-    pass
+    results = gguf.bounded_parallel_map(lambda x: x, source(), concurrency = 8, cost = lambda x: 10, max_cost = 20)
+    assert next(results) == 0
+    assert len(taken) <= 3
+    assert list(results) == items[1:]
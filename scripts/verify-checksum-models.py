@@ -1,27 +1,128 @@
 #!/usr/bin/env python3
 
-import os
+import argparse
 import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+BLOCK_SIZE = 16 * 1024 * 1024  # 16 MB block size
 
 
 def sha256sum(file):
-    block_size = 16 * 1024 * 1024  # 16 MB block size
-    b = bytearray(block_size)
+    b = bytearray(BLOCK_SIZE)
     file_hash = hashlib.sha256()
     mv = memoryview(b)
     with open(file, 'rb', buffering=0) as f:
+        fd = f.fileno()
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        offset = 0
         while True:
             n = f.readinto(mv)
             if not n:
                 break
+            offset += n
+            # Have the kernel read the next block while this one is hashed
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, offset, BLOCK_SIZE, os.POSIX_FADV_WILLNEED)
+            # hashlib releases the GIL while hashing, so other files are hashed at the same time
             file_hash.update(mv[:n])
 
     return file_hash.hexdigest()
 
 
+# The cache maps the path of a file to its hash, along with the size, modification time
+# and inode the file had when it was hashed. The hash is reused while these still match.
+def cache_key(stat):
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+
+def load_cache(cache_file):
+    if cache_file is None or not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"Ignoring unreadable checksum cache {cache_file}")
+        return {}
+
+
+def save_cache(cache_file, cache):
+    # Written to a temporary file first, so an interrupted run doesn't leave a broken cache
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    temp_file = f"{cache_file}.tmp"
+    with open(temp_file, "w") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(temp_file, cache_file)
+
+
+def file_checksum(file_path, cache):
+    # Returns the hash of the file and whether it came from the cache
+    stat = os.stat(file_path)
+    key = cache_key(stat)
+    entry = cache.get(file_path)
+    if entry is not None and {k: entry.get(k) for k in key} == key:
+        return entry["sha256"], True
+    file_hash = sha256sum(file_path)
+    cache[file_path] = {**key, "sha256": file_hash}
+    return file_hash, False
+
+
+def verify(hash_value, filename, file_path, cache):
+    # Check if the file exists
+    if not os.path.exists(file_path):
+        return {
+            "filename": filename,
+            "valid checksum": "",
+            "file missing": "X",
+            "expected": hash_value,
+            "actual": None,
+            "cached": False,
+            "error": None,
+        }
+    # Calculate the SHA256 checksum of the file, unless it is known from the cache.
+    # A file that can't be read is reported, the other files are still checked
+    try:
+        file_hash, cached = file_checksum(file_path, cache)
+    except OSError as e:
+        return {
+            "filename": filename,
+            "valid checksum": "",
+            "file missing": "",
+            "expected": hash_value,
+            "actual": None,
+            "cached": False,
+            "error": f"{type(e).__name__}: {e.strerror or e}",
+        }
+    return {
+        "filename": filename,
+        "valid checksum": "V" if file_hash == hash_value else "",
+        "file missing": "",
+        "expected": hash_value,
+        "actual": file_hash,
+        "cached": cached,
+        "error": None,
+    }
+
+
 # Define the path to the llama directory (parent folder of script directory)
 llama_path = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 
+# The cache is kept with the user's other caches rather than in the repository
+cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+
+parser = argparse.ArgumentParser(description="Verify the checksums of the models listed in SHA256SUMS")
+parser.add_argument("--threads", type=int, default=min(8, os.cpu_count() or 1),
+                    help="Number of files hashed at once (default: number of CPUs, at most 8)")
+parser.add_argument("--cache", default=os.path.join(cache_dir, "llama.cpp", "sha256-cache.json"),
+                    help="File caching the checksums of unchanged files (default: %(default)s)")
+parser.add_argument("--no-cache", action="store_true", help="Hash every file, and don't update the cache")
+parser.add_argument("--json", help="Also write the results as JSON to this file")
+args = parser.parse_args()
+
 # Define the file with the list of hashes and filenames
 hash_list_file = os.path.join(llama_path, "SHA256SUMS")
 
@@ -32,50 +133,49 @@ if not os.path.exists(hash_list_file):
 
 # Read the hash file content and split it into an array of lines
 with open(hash_list_file, "r") as f:
-    hash_list = f.read().splitlines()
-
-# Create an array to store the results
-results = []
-
-# Loop over each line in the hash list
-for line in hash_list:
-    # Split the line into hash and filename
-    hash_value, filename = line.split("  ")
-
-    # Get the full path of the file by joining the llama path and the filename
-    file_path = os.path.join(llama_path, filename)
-
-    # Informing user of the progress of the integrity check
-    print(f"Verifying the checksum of {file_path}")
-
-    # Check if the file exists
-    if os.path.exists(file_path):
-        # Calculate the SHA256 checksum of the file using hashlib
-        file_hash = sha256sum(file_path)
-
-        # Compare the file hash with the expected hash
-        if file_hash == hash_value:
-            valid_checksum = "V"
-            file_missing = ""
-        else:
-            valid_checksum = ""
-            file_missing = ""
-    else:
-        valid_checksum = ""
-        file_missing = "X"
-
-    # Add the results to the array
-    results.append({
-        "filename": filename,
-        "valid checksum": valid_checksum,
-        "file missing": file_missing
-    })
-
+    hash_list = [line for line in f.read().splitlines() if line]
+
+cache_file = None if args.no_cache else args.cache
+cache = load_cache(cache_file)
+
+# The files are hashed in parallel, the results stay in the order of the hash list.
+# The hashes computed so far are cached even if the run is interrupted
+try:
+    with ThreadPoolExecutor(max(1, args.threads)) as executor:
+        futures = []
+        for line in hash_list:
+            # Split the line into hash and filename
+            hash_value, filename = line.split("  ")
+
+            # Get the full path of the file by joining the llama path and the filename
+            file_path = os.path.join(llama_path, filename)
+
+            # Informing user of the progress of the integrity check
+            print(f"Verifying the checksum of {file_path}")
+            futures.append(executor.submit(verify, hash_value, filename, file_path, cache))
+        results = [future.result() for future in futures]
+finally:
+    if cache_file is not None:
+        save_cache(cache_file, cache)
 
 # Print column headers for results table
-print("\n" + "filename".ljust(40) + "valid checksum".center(20) + "file missing".center(20))
-print("-" * 80)
+print("\n" + "filename".ljust(40) + "valid checksum".center(20) + "file missing".center(20) + "  error")
+print("-" * 100)
 
 # Output the results as a table
 for r in results:
-    print(f"{r['filename']:40} {r['valid checksum']:^20} {r['file missing']:^20}")
+    print(f"{r['filename']:40} {r['valid checksum']:^20} {r['file missing']:^20} {r['error'] or ''}")
+
+# And as JSON for other tools
+if args.json is not None:
+    report = [{
+        "filename": r["filename"],
+        "valid": r["valid checksum"] == "V",
+        "missing": r["file missing"] == "X",
+        "expected": r["expected"],
+        "actual": r["actual"],
+        "cached": r["cached"],
+        "error": r["error"],
+    } for r in results]
+    with open(args.json, "w") as f:
+        json.dump(report, f, indent=2)
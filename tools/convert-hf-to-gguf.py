@@ -3,25 +3,30 @@
 from __future__ import annotations
 
 import argparse
-import contextlib
 import json
+import math
+import mmap
 import os
 import re
+import struct
 import sys
 from enum import IntEnum
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, ContextManager, Iterator, cast
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator
 
 import numpy as np
-import torch
-
-if TYPE_CHECKING:
-    from torch import Tensor
 
 if 'NO_LOCAL_GGUF' not in os.environ:
     sys.path.insert(1, str(Path(__file__).parent / 'gguf-py'))
 import gguf
 
+if TYPE_CHECKING:
+    from typing import TypeAlias
+
+NDArray: TypeAlias = 'np.ndarray[Any, Any]'
+
+DEFAULT_CONCURRENCY = 8
+
 
 ###### MODEL DEFINITIONS ######
 
@@ -34,9 +39,28 @@ class SentencePieceTokenTypes(IntEnum):
     BYTE = 6
 
 
+# NumPy has no bfloat16: such tensors are loaded as their raw 16 bits, tagged by this dtype,
+# and only widened to float32 (see to_float32) by the conversion of each tensor.
+BF16_DTYPE: np.dtype[Any] = np.dtype(np.uint16, metadata={"bfloat16": True})
+
+SAFETENSORS_DATA_TYPES: dict[str, np.dtype[Any]] = {
+    'BF16': BF16_DTYPE,
+    'F16':  np.dtype(np.float16),
+    'F32':  np.dtype(np.float32),
+    'F64':  np.dtype(np.float64),
+    'I8':   np.dtype(np.int8),
+    'I16':  np.dtype(np.int16),
+    'I32':  np.dtype(np.int32),
+    'I64':  np.dtype(np.int64),
+    'U8':   np.dtype(np.uint8),
+    'BOOL': np.dtype(np.bool_),
+}
+
+
 class Model:
-    def __init__(self, dir_model: Path, ftype: int, fname_out: Path, is_big_endian: bool):
+    def __init__(self, dir_model: Path, ftype: int, fname_out: Path, is_big_endian: bool, concurrency: int = DEFAULT_CONCURRENCY):
         self.dir_model = dir_model
+        self.concurrency = concurrency
         self.ftype = ftype
         self.fname_out = fname_out
         self.is_big_endian = is_big_endian
@@ -46,25 +70,18 @@ class Model:
         self.part_names = self._get_part_names()
         self.hparams = Model.load_hparams(self.dir_model)
         self.model_arch = self._get_model_architecture()
-        self.gguf_writer = gguf.GGUFWriter(fname_out, gguf.MODEL_ARCH_NAMES[self.model_arch], endianess=self.endianess)
+        self.gguf_writer = gguf.GGUFWriter(fname_out, gguf.MODEL_ARCH_NAMES[self.model_arch], use_temp_file=False, endianess=self.endianess)
 
     def set_vocab(self):
         self._set_vocab_gpt2()
 
-    def get_tensors(self) -> Iterator[tuple[str, Tensor]]:
+    def get_tensors(self) -> Iterator[tuple[str, NDArray]]:
         for part_name in self.part_names:
             print(f"gguf: loading model part '{part_name}'")
-            ctx: ContextManager[Any]
             if self.is_safetensors:
-                from safetensors import safe_open
-                ctx = cast(ContextManager[Any], safe_open(self.dir_model / part_name, framework="pt", device="cpu"))
+                yield from Model.load_safetensors_file(self.dir_model / part_name)
             else:
-                ctx = contextlib.nullcontext(torch.load(str(self.dir_model / part_name), map_location="cpu", mmap=True, weights_only=True))
-
-            with ctx as model_part:
-                for name in model_part.keys():
-                    data = model_part.get_tensor(name) if self.is_safetensors else model_part[name]
-                    yield name, data
+                yield from Model.load_torch_file(self.dir_model / part_name)
 
     def set_gguf_parameters(self):
         self.gguf_writer.add_name(self.dir_model.name)
@@ -84,18 +101,17 @@ class Model:
     def write_tensors(self):
         block_count = self.hparams.get("n_layers", self.hparams.get("num_hidden_layers", self.hparams.get("n_layer")))
         tensor_map = gguf.get_tensor_name_map(self.model_arch, block_count)
-        for name, data_torch in self.get_tensors():
+
+        def convert(name: str, data: NDArray) -> list[tuple[str, NDArray]]:
             # we don't need these
             if name.endswith((".attention.masked_bias", ".attention.bias", ".attention.rotary_emb.inv_freq")):
-                continue
-
-            old_dtype = data_torch.dtype
+                return []
 
             # convert any unsupported data types to float32
-            if data_torch.dtype not in (torch.float16, torch.float32):
-                data_torch = data_torch.to(torch.float32)
+            if data.dtype not in (np.float16, np.float32):
+                data = Model.to_float32(data)
 
-            data = data_torch.squeeze().numpy()
+            data = data.squeeze()
 
             # map tensor names
             new_name = tensor_map.get_name(name, try_suffixes=(".weight", ".bias"))
@@ -118,15 +134,44 @@ class Model:
             if self.ftype == 1 and data_dtype == np.float32 and name.endswith(".weight") and n_dims == 2:
                 data = data.astype(np.float16)
 
-            print(f"{new_name}, n_dims = {n_dims}, {old_dtype} --> {data.dtype}")
+            return [(new_name, data)]
+
+        self.add_tensors(self.get_tensors(), convert)
+
+    def add_tensors(self, tensors: Iterable[tuple[str, NDArray]], convert: Callable[[str, NDArray], list[tuple[str, NDArray]]]) -> None:
+        # Writes the whole file, the metadata has to be added before. The tensor infos come from
+        # converting stand-ins with the shape and type of every tensor (see meta_tensor), so no
+        # tensor data is read for them. Then the tensors are converted once by a pool of threads,
+        # each written straight to its place in the output as soon as it is ready.
+        items = list(tensors)
+        old_dtypes: dict[str, np.dtype[Any]] = {}
+        for name, data in items:
+            for new_name, meta in convert(name, Model.meta_tensor(data)):
+                self.gguf_writer.add_tensor_info(new_name, meta.shape, meta.dtype, meta.nbytes)
+                old_dtypes[new_name] = data.dtype
+        self.gguf_writer.write_header_to_file()
+        self.gguf_writer.write_kv_data_to_file()
+        self.gguf_writer.write_ti_data_to_file()
+
+        def write_item(item: tuple[str, NDArray]) -> list[tuple[str, int, np.dtype[Any]]]:
+            written = []
+            for new_name, data in convert(*item):
+                self.gguf_writer.write_tensor_data_at(new_name, data)
+                written.append((new_name, len(data.shape), data.dtype))
+            return written
 
-            self.gguf_writer.add_tensor(new_name, data)
+        for written in gguf.bounded_parallel_map(write_item, items, self.concurrency, ordered=False):
+            for new_name, n_dims, dtype in written:
+                print(f"{new_name}, n_dims = {n_dims}, {old_dtypes[new_name]} --> {dtype}")
+
+    @staticmethod
+    def meta_tensor(data: NDArray) -> NDArray:
+        # Same shape and type as data, but all the items are one zero, so it takes no memory.
+        # Operations on it still allocate their results, but never touch the data of the tensor.
+        return np.lib.stride_tricks.as_strided(np.zeros(1, dtype=data.dtype), data.shape, (0,) * data.ndim, writeable=False)
 
     def write(self):
         self.write_tensors()
-        self.gguf_writer.write_header_to_file()
-        self.gguf_writer.write_kv_data_to_file()
-        self.gguf_writer.write_tensors_to_file()
         self.gguf_writer.close()
 
     def write_vocab(self):
@@ -143,6 +188,44 @@ class Model:
 
         return num_parts
 
+    @staticmethod
+    def load_safetensors_file(path: Path) -> Iterator[tuple[str, NDArray]]:
+        # Tensors are read-only views of the mmapped file, so only the parts that are used get loaded
+        with open(path, "rb") as fp:
+            header_size, = struct.unpack("<Q", fp.read(8))
+            header: dict[str, dict[str, Any]] = json.loads(fp.read(header_size))
+            mapped = memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+        byte_buf = mapped[8 + header_size:]
+
+        for name, info in header.items():
+            if name == "__metadata__":
+                continue
+            numpy_dtype = SAFETENSORS_DATA_TYPES[info["dtype"]]
+            shape: list[int] = info["shape"]
+            begin, end = info["data_offsets"]
+            assert 0 <= begin <= end <= len(byte_buf)
+            assert end - begin == math.prod(shape) * numpy_dtype.itemsize
+            yield name, np.frombuffer(byte_buf[begin:end], dtype=numpy_dtype).reshape(shape)
+
+    @staticmethod
+    def load_torch_file(path: Path) -> Iterator[tuple[str, NDArray]]:
+        import torch
+
+        model_part = torch.load(str(path), map_location="cpu", mmap=True, weights_only=True)
+        for name, data_torch in model_part.items():
+            # NumPy can't represent bfloat16, the raw bits are tagged instead
+            if data_torch.dtype == torch.bfloat16:
+                yield name, data_torch.view(torch.int16).numpy().view(BF16_DTYPE)
+                continue
+            yield name, data_torch.numpy()
+
+    @staticmethod
+    def to_float32(data: NDArray) -> NDArray:
+        if data.dtype.metadata is not None and data.dtype.metadata.get("bfloat16"):
+            # bfloat16 is the upper half of a float32
+            return (data.astype(np.uint32) << 16).view(np.float32)
+        return data.astype(np.float32)
+
     @staticmethod
     def load_hparams(dir_model):
         with open(dir_model / "config.json", "r", encoding="utf-8") as f:
@@ -331,23 +414,18 @@ class BloomModel(Model):
         block_count = self.hparams["n_layer"]
         tensors = dict(self.get_tensors())
         tensor_map = gguf.get_tensor_name_map(self.model_arch, block_count)
-        has_lm_head = True
+        has_lm_head = "lm_head.weight" in tensors.keys() or "output.weight" in tensors.keys()
         n_head = self.hparams.get("n_head", self.hparams.get("num_attention_heads"))
         n_embed = self.hparams.get("hidden_size", self.hparams.get("n_embed"))
 
-        for name, data_torch in tensors.items():
-            if "lm_head.weight" not in tensors.keys() and "output.weight" not in tensors.keys():
-                has_lm_head = False
-
+        def convert(name: str, data: NDArray) -> list[tuple[str, NDArray]]:
             name = re.sub(r'transformer\.', '', name)
 
-            old_dtype = data_torch.dtype
-
             # convert any unsupported data types to float32
-            if data_torch.dtype not in (torch.float16, torch.float32):
-                data_torch = data_torch.to(torch.float32)
+            if data.dtype not in (np.float16, np.float32):
+                data = Model.to_float32(data)
 
-            data = data_torch.squeeze().numpy()
+            data = data.squeeze()
 
             if re.match(r"h\.\d+\.self_attention\.query_key_value\.weight", name):
                 # Map bloom-style qkv_linear to gpt-style qkv_linear
@@ -362,7 +440,6 @@ class BloomModel(Model):
                     ),
                     axis=0,
                 )
-                print("re-format attention.linear_qkv.weight")
             elif re.match(r"h\.\d+\.self_attention\.query_key_value\.bias", name):
                 qkv_bias = data.reshape((n_head, 3, n_embed // n_head))
                 data = np.concatenate(
@@ -373,7 +450,6 @@ class BloomModel(Model):
                     ),
                     axis=0,
                 )
-                print("re-format attention.linear_qkv.bias")
 
             # map tensor names
             new_name = tensor_map.get_name(name, try_suffixes=(".weight", ".bias"))
@@ -396,13 +472,11 @@ class BloomModel(Model):
             if self.ftype == 1 and data_dtype == np.float32 and name.endswith(".weight") and n_dims == 2:
                 data = data.astype(np.float16)
 
-            print(f"=> {new_name}, shape = {data.shape}, {old_dtype} --> {data.dtype}")
-
-            self.gguf_writer.add_tensor(new_name, data)
-
             if not has_lm_head and name == "word_embeddings.weight":
-                self.gguf_writer.add_tensor("output.weight", data)
-                print(name, f"=> output.weight, shape = {data.shape}, {old_dtype} --> {data.dtype}")
+                return [(new_name, data), ("output.weight", data)]
+            return [(new_name, data)]
+
+        self.add_tensors(tensors.items(), convert)
 
 
 class MPTModel(Model):
@@ -424,18 +498,17 @@ class MPTModel(Model):
     def write_tensors(self):
         block_count = self.hparams.get("n_layers", self.hparams.get("num_hidden_layers"))
         tensor_map = gguf.get_tensor_name_map(self.model_arch, block_count)
-        for name, data_torch in self.get_tensors():
+
+        def convert(name: str, data: NDArray) -> list[tuple[str, NDArray]]:
             # we don't need these
             if name.endswith((".attention.masked_bias", ".attention.bias", ".attention.rotary_emb.inv_freq")):
-                continue
-
-            old_dtype = data_torch.dtype
+                return []
 
             # convert any unsupported data types to float32
-            if data_torch.dtype not in (torch.float16, torch.float32):
-                data_torch = data_torch.to(torch.float32)
+            if data.dtype not in (np.float16, np.float32):
+                data = Model.to_float32(data)
 
-            data = data_torch.squeeze().numpy()
+            data = data.squeeze()
 
             # map tensor names
             new_name = tensor_map.get_name(name, try_suffixes=(".weight", ".bias"))
@@ -458,14 +531,13 @@ class MPTModel(Model):
             if self.ftype == 1 and data_dtype == np.float32 and name.endswith(".weight") and n_dims == 2:
                 data = data.astype(np.float16)
 
-            print(f"{new_name}, n_dims = {n_dims}, {old_dtype} --> {data.dtype}")
-
-            self.gguf_writer.add_tensor(new_name, data)
-
             # note: MPT output is tied to (same as) wte in original model;
             # for easier implementation in llama.cpp it's duplicated in GGUF, though :/
             if new_name == "token_embd.weight":
-                self.gguf_writer.add_tensor("output.weight", data)
+                return [(new_name, data), ("output.weight", data)]
+            return [(new_name, data)]
+
+        self.add_tensors(self.get_tensors(), convert)
 
 
 class BaichuanModel(Model):
@@ -525,18 +597,16 @@ class BaichuanModel(Model):
                     self._reverse_hf_part(w, 2)
                 del model_kv[f"model.layers.{i}.self_attn.W_pack.weight"]
 
-        for name, data_torch in model_kv.items():
+        def convert(name: str, data: NDArray) -> list[tuple[str, NDArray]]:
             # we don't need these
             if name.endswith(".rotary_emb.inv_freq"):
-                continue
-
-            old_dtype = data_torch.dtype
+                return []
 
             # convert any unsupported data types to float32
-            if data_torch.dtype not in (torch.float16, torch.float32):
-                data_torch = data_torch.to(torch.float32)
+            if data.dtype not in (np.float16, np.float32):
+                data = Model.to_float32(data)
 
-            data = data_torch.squeeze().numpy()
+            data = data.squeeze()
 
             # map tensor names
             new_name = tensor_map.get_name(name, try_suffixes=(".weight", ".bias"))
@@ -559,10 +629,11 @@ class BaichuanModel(Model):
             if self.ftype == 1 and data_dtype == np.float32 and name.endswith(".weight") and n_dims == 2:
                 data = data.astype(np.float16)
 
-            print(f"{name} -> {new_name}, n_dims = {n_dims}, {old_dtype} --> {data.dtype}")
-            self.gguf_writer.add_tensor(new_name, data)
+            return [(new_name, data)]
 
-    def _reverse_hf_permute(self, weights: Tensor, n_head: int, n_kv_head: int | None = None) -> Tensor:
+        self.add_tensors(model_kv.items(), convert)
+
+    def _reverse_hf_permute(self, weights: NDArray, n_head: int, n_kv_head: int | None = None) -> NDArray:
         if n_kv_head is not None and n_head != n_kv_head:
             n_head //= n_kv_head
 
@@ -573,12 +644,12 @@ class BaichuanModel(Model):
         )
 
     def _reverse_hf_permute_part(
-        self, weights: Tensor, n_part: int, n_head: int, n_head_kv: int | None = None,
-    ) -> Tensor:
+        self, weights: NDArray, n_part: int, n_head: int, n_head_kv: int | None = None,
+    ) -> NDArray:
         r = weights.shape[0] // 3
         return self._reverse_hf_permute(weights[r * n_part:r * n_part + r, ...], n_head, n_head_kv)
 
-    def _reverse_hf_part(self, weights: Tensor, n_part: int) -> Tensor:
+    def _reverse_hf_part(self, weights: NDArray, n_part: int) -> NDArray:
         r = weights.shape[0] // 3
         return weights[r * n_part:r * n_part + r, ...]
 
@@ -624,12 +695,10 @@ class FalconModel(Model):
         head_dim = self.hparams["hidden_size"] // n_head
         tensor_map = gguf.get_tensor_name_map(self.model_arch, block_count)
 
-        for name, data_torch in self.get_tensors():
-            old_dtype = data_torch.dtype
-
+        def convert(name: str, data: NDArray) -> list[tuple[str, NDArray]]:
             # convert any unsupported data types to float32
-            if data_torch.dtype not in (torch.float16, torch.float32):
-                data_torch = data_torch.to(torch.float32)
+            if data.dtype not in (np.float16, np.float32):
+                data = Model.to_float32(data)
 
             # QKV tensor transform
             # The original query_key_value tensor contains n_head_kv "kv groups",
@@ -642,13 +711,13 @@ class FalconModel(Model):
             # ref: https://github.com/jploski/ggml/blob/falcon40b/examples/falcon/convert-hf-to-ggml.py
 
             if "query_key_value" in name:
-                qkv = data_torch.view(n_head_kv, n_head // n_head_kv + 2, head_dim, head_dim * n_head)
+                qkv = data.reshape(n_head_kv, n_head // n_head_kv + 2, head_dim, head_dim * n_head)
                 q = qkv[:, :-2].reshape(n_head * head_dim, head_dim * n_head)
                 k = qkv[:, [-2]].reshape(n_head_kv * head_dim, head_dim * n_head)
                 v = qkv[:, [-1]].reshape(n_head_kv * head_dim, head_dim * n_head)
-                data_torch = torch.cat((q, k, v)).reshape_as(data_torch)
+                data = np.concatenate((q, k, v)).reshape(data.shape)
 
-            data = data_torch.squeeze().numpy()
+            data = data.squeeze()
 
             # map tensor names
             new_name = tensor_map.get_name(name, try_suffixes=(".weight", ".bias"))
@@ -671,9 +740,9 @@ class FalconModel(Model):
             if self.ftype == 1 and data_dtype == np.float32 and name.endswith(".weight") and n_dims == 2:
                 data = data.astype(np.float16)
 
-            print(f"{new_name}, n_dims = {n_dims}, {old_dtype} --> {data.dtype}")
+            return [(new_name, data)]
 
-            self.gguf_writer.add_tensor(new_name, data)
+        self.add_tensors(self.get_tensors(), convert)
 
 
 class StarCoderModel(Model):
@@ -740,14 +809,12 @@ class RefactModel(Model):
                 tensors[f"model.layers.{i}.mlp.up_proj.weight"] = w[ff_dim:]
                 del tensors[f"transformer.h.{i}.mlp.gate_up_proj.weight"]
 
-        for name, data_torch in tensors.items():
-            old_dtype = data_torch.dtype
-
+        def convert(name: str, data: NDArray) -> list[tuple[str, NDArray]]:
             # convert any unsupported data types to float32
-            if data_torch.dtype not in (torch.float16, torch.float32):
-                data_torch = data_torch.to(torch.float32)
+            if data.dtype not in (np.float16, np.float32):
+                data = Model.to_float32(data)
 
-            data = data_torch.squeeze().numpy()
+            data = data.squeeze()
 
             # map tensor names
             new_name = tensor_map.get_name(name, try_suffixes=(".weight",))
@@ -770,9 +837,9 @@ class RefactModel(Model):
             if self.ftype == 1 and data_dtype == np.float32 and name.endswith(".weight") and n_dims == 2:
                 data = data.astype(np.float16)
 
-            print(f"{new_name}, n_dims = {n_dims}, {old_dtype} --> {data.dtype}")
+            return [(new_name, data)]
 
-            self.gguf_writer.add_tensor(new_name, data)
+        self.add_tensors(tensors.items(), convert)
 
 
 class PersimmonModel(Model):
@@ -802,19 +869,18 @@ class PersimmonModel(Model):
         block_count = self.hparams.get("num_layers", self.hparams.get("num_hidden_layers"))
         tensor_map = gguf.get_tensor_name_map(self.model_arch, block_count)
 
-        for name, data_torch in self.get_tensors():
+        def convert(name: str, data: NDArray) -> list[tuple[str, NDArray]]:
             if name.endswith(".self_attention.rotary_emb.inv_freq"):
-                continue
-            old_dtype = data_torch.dtype
+                return []
             # TODO: FP16 conversion produces garbage outputs. (Q8_0 does not, so..?)
-            data = data_torch.to(torch.float32).squeeze().numpy()
+            data = Model.to_float32(data).squeeze()
             new_name = tensor_map.get_name(name, try_suffixes=(".weight", ".bias"))
             if new_name is None:
                 print(f"Can not map tensor {name!r}")
                 sys.exit()
-            n_dims = len(data.shape)
-            print(f"{new_name}, n_dims = {n_dims}, {old_dtype} --> {data.dtype}")
-            self.gguf_writer.add_tensor(new_name, data)
+            return [(new_name, data)]
+
+        self.add_tensors(self.get_tensors(), convert)
 
 
 class StableLMModel(Model):
@@ -850,6 +916,10 @@ def parse_args() -> argparse.Namespace:
         help="output format - use f32 for float32, f16 for float16",
     )
     parser.add_argument("--bigendian", action="store_true", help="model is executed on big endian machine")
+    parser.add_argument(
+        "--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+        help=f"number of tensors converted in parallel (default: {DEFAULT_CONCURRENCY})",
+    )
     parser.add_argument(
         "model", type=Path,
         help="directory containing model file",
@@ -880,21 +950,20 @@ print(f"Loading model: {dir_model.name}")
 
 hparams = Model.load_hparams(dir_model)
 
-with torch.inference_mode():
-    model_class = Model.from_model_architecture(hparams["architectures"][0])
-    model_instance = model_class(dir_model, ftype_map[args.outtype], fname_out, args.bigendian)
+model_class = Model.from_model_architecture(hparams["architectures"][0])
+model_instance = model_class(dir_model, ftype_map[args.outtype], fname_out, args.bigendian, args.concurrency)
 
-    print("Set model parameters")
-    model_instance.set_gguf_parameters()
+print("Set model parameters")
+model_instance.set_gguf_parameters()
 
-    print("Set model tokenizer")
-    model_instance.set_vocab()
+print("Set model tokenizer")
+model_instance.set_vocab()
 
-    if args.vocab_only:
-        print(f"Exporting model vocab to '{fname_out}'")
-        model_instance.write_vocab()
-    else:
-        print(f"Exporting model to '{fname_out}'")
-        model_instance.write()
+if args.vocab_only:
+    print(f"Exporting model vocab to '{fname_out}'")
+    model_instance.write_vocab()
+else:
+    print(f"Exporting model to '{fname_out}'")
+    model_instance.write()
 
-    print(f"Model successfully exported to '{fname_out}'")
+print(f"Model successfully exported to '{fname_out}'")
@@ -2,10 +2,10 @@
 from __future__ import annotations
 
 import argparse
-import concurrent.futures
 import enum
 import faulthandler
 import functools
+import hashlib
 import itertools
 import json
 import math
@@ -15,13 +15,15 @@ import re
 import signal
 import struct
 import sys
+import threading
 import time
 import zipfile
+import zlib
 from abc import ABCMeta, abstractmethod
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
+from multiprocessing import shared_memory
 from pathlib import Path
-from typing import IO, TYPE_CHECKING, Any, Callable, Iterable, Literal, TypeVar
+from typing import IO, TYPE_CHECKING, Any, Callable, Iterable, Literal
 
 import numpy as np
 from sentencepiece import SentencePieceProcessor
@@ -42,6 +44,9 @@ NDArray: TypeAlias = 'np.ndarray[Any, Any]'
 ARCH = gguf.MODEL_ARCH.LLAMA
 
 DEFAULT_CONCURRENCY = 8
+# Number of elements converted at a time by UnquantizedTensor.convert_rows()
+CONVERT_CHUNK_ELEMENTS = 4 * 1024 * 1024
+DEFAULT_CACHE_SIZE = 64 * 1024 ** 3
 #
 # data types
 #
@@ -62,10 +67,12 @@ class UnquantizedDataType(DataType):
     pass
 
 
-DT_F16  = UnquantizedDataType('F16', dtype = np.dtype(np.float16), valid_conversions = ['F32', 'Q8_0'])
-DT_F32  = UnquantizedDataType('F32', dtype = np.dtype(np.float32), valid_conversions = ['F16', 'Q8_0'])
+QUANTIZED_TYPE_NAMES = ['Q4_0', 'Q4_1', 'Q5_0', 'Q5_1', 'Q8_0', 'Q2_K', 'Q3_K', 'Q4_K', 'Q5_K', 'Q6_K']
+
+DT_F16  = UnquantizedDataType('F16', dtype = np.dtype(np.float16), valid_conversions = ['F32', *QUANTIZED_TYPE_NAMES])
+DT_F32  = UnquantizedDataType('F32', dtype = np.dtype(np.float32), valid_conversions = ['F16', *QUANTIZED_TYPE_NAMES])
 DT_I32  = UnquantizedDataType('I32', dtype = np.dtype(np.int16), valid_conversions = [])
-DT_BF16 = UnquantizedDataType('BF16', dtype = np.dtype(np.uint16), valid_conversions = ['F32', 'F16', 'Q8_0'])
+DT_BF16 = UnquantizedDataType('BF16', dtype = np.dtype(np.uint16), valid_conversions = ['F32', 'F16', *QUANTIZED_TYPE_NAMES])
 
 
 @dataclass(frozen=True)
@@ -74,9 +81,18 @@ class QuantizedDataType(DataType):
     quantized_dtype: np.dtype[Any]
     ggml_type: gguf.GGMLQuantizationType
 
-    def quantize(self, arr: NDArray) -> NDArray:
+    def quantize(self, arr: NDArray, out: NDArray | None = None) -> NDArray:
         raise NotImplementedError(f'Quantization for {self.name} not implemented')
 
+    def output_buffer(self, n_blocks: int, out: NDArray | None) -> NDArray:
+        # The array of blocks to quantize into, out may also be a raw byte buffer (e.g. part of an mmap)
+        if out is None:
+            return np.empty(n_blocks, dtype = self.quantized_dtype)
+        if out.dtype != self.quantized_dtype:
+            out = out.reshape(-1).view(self.quantized_dtype)
+        assert out.shape == (n_blocks,), f'Bad output buffer shape {out.shape} for {n_blocks} blocks'
+        return out
+
     def elements_to_bytes(self, n_elements: int) -> int:
         assert n_elements % self.block_size == 0, f'Invalid number of elements {n_elements} for {self.name} with block size {self.block_size}'
         return self.quantized_dtype.itemsize * (n_elements // self.block_size)
@@ -85,20 +101,25 @@ class QuantizedDataType(DataType):
 @dataclass(frozen=True)
 class Q8_0QuantizedDataType(QuantizedDataType):
     # Mini Q8_0 quantization in Python!
-    def quantize(self, arr: NDArray) -> NDArray:
+    def quantize(self, arr: NDArray, out: NDArray | None = None) -> NDArray:
         assert arr.size % self.block_size == 0 and arr.size != 0, f'Bad array size {arr.size}'
         assert arr.dtype == np.float32, f'Bad array type {arr.dtype}'
         n_blocks = arr.size // self.block_size
         blocks = arr.reshape((n_blocks, self.block_size))
-        # Much faster implementation of block quantization contributed by @Cebtenzzre
-
-        def quantize_blocks_q8_0(blocks: NDArray) -> Iterable[tuple[Any, Any]]:
-            d = abs(blocks).max(axis = 1) / np.float32(127)
-            with np.errstate(divide = 'ignore'):
-                qs = (blocks / d[:, None]).round()
-            qs[d == 0] = 0
-            yield from zip(d, qs)
-        return np.fromiter(quantize_blocks_q8_0(blocks), count = n_blocks, dtype = self.quantized_dtype)
+        out = self.output_buffer(n_blocks, out)
+        # Same arithmetic as quantize_row_q8_0_reference, the scales and quants
+        # are written straight into the fields of the output blocks.
+        d = abs(blocks).max(axis = 1) / np.float32(127)
+        with np.errstate(divide = 'ignore'):
+            inv_d = np.where(d != 0, np.float32(1) / d, np.float32(0))
+        qs = blocks * inv_d[:, None]
+        # Round halfway cases away from zero like roundf, np.round rounds them to even
+        frac = qs - np.trunc(qs)
+        np.trunc(qs, out = qs)
+        np.add(qs, np.sign(frac), out = qs, where = abs(frac) >= np.float32(0.5))
+        out['d'] = d
+        out['qs'] = qs
+        return out
 
 
 DT_Q8_0 = Q8_0QuantizedDataType('Q8_0',
@@ -106,6 +127,49 @@ DT_Q8_0 = Q8_0QuantizedDataType('Q8_0',
                                 ggml_type = gguf.GGMLQuantizationType.Q8_0, block_size = 32,
                                 quantized_dtype = np.dtype([('d', '<f2'), ('qs', 'i1', (32,))]))
 
+
+@dataclass(frozen=True)
+class GGMLQuantizedDataType(QuantizedDataType):
+    # Block quantization using the NumPy port of ggml-quants.c in gguf-py,
+    # the output is the same as that of the quantize tool.
+    def quantize(self, arr: NDArray, out: NDArray | None = None) -> NDArray:
+        assert arr.size % self.block_size == 0 and arr.size != 0, f'Bad array size {arr.size}'
+        assert arr.dtype == np.float32, f'Bad array type {arr.dtype}'
+        n_blocks = arr.size // self.block_size
+        out = self.output_buffer(n_blocks, out)
+        gguf.quantize(arr.reshape(n_blocks, self.block_size), self.ggml_type, out = out.view(np.uint8).reshape(n_blocks, -1))
+        return out
+
+
+def ggml_quantized_data_type(ggml_type: gguf.GGMLQuantizationType, fields: list[tuple[Any, ...]]) -> GGMLQuantizedDataType:
+    block_size, type_size = gguf.GGML_QUANT_SIZES[ggml_type]
+    quantized_dtype = np.dtype(fields)
+    assert quantized_dtype.itemsize == type_size, f'Bad block layout for {ggml_type.name}'
+    return GGMLQuantizedDataType(ggml_type.name, dtype = np.dtype(np.float32), valid_conversions = [],
+                                 ggml_type = ggml_type, block_size = block_size, quantized_dtype = quantized_dtype)
+
+
+QK_K = gguf.QK_K
+
+DT_Q4_0 = ggml_quantized_data_type(gguf.GGMLQuantizationType.Q4_0, [('d', '<f2'), ('qs', 'u1', (16,))])
+DT_Q4_1 = ggml_quantized_data_type(gguf.GGMLQuantizationType.Q4_1, [('d', '<f2'), ('m', '<f2'), ('qs', 'u1', (16,))])
+DT_Q5_0 = ggml_quantized_data_type(gguf.GGMLQuantizationType.Q5_0, [('d', '<f2'), ('qh', '<u4'), ('qs', 'u1', (16,))])
+DT_Q5_1 = ggml_quantized_data_type(gguf.GGMLQuantizationType.Q5_1, [('d', '<f2'), ('m', '<f2'), ('qh', '<u4'), ('qs', 'u1', (16,))])
+DT_Q2_K = ggml_quantized_data_type(gguf.GGMLQuantizationType.Q2_K,
+                                   [('scales', 'u1', (QK_K // 16,)), ('qs', 'u1', (QK_K // 4,)), ('d', '<f2'), ('dmin', '<f2')])
+DT_Q3_K = ggml_quantized_data_type(gguf.GGMLQuantizationType.Q3_K,
+                                   [('hmask', 'u1', (QK_K // 8,)), ('qs', 'u1', (QK_K // 4,)), ('scales', 'u1', (12,)), ('d', '<f2')])
+DT_Q4_K = ggml_quantized_data_type(gguf.GGMLQuantizationType.Q4_K,
+                                   [('d', '<f2'), ('dmin', '<f2'), ('scales', 'u1', (12,)), ('qs', 'u1', (QK_K // 2,))])
+DT_Q5_K = ggml_quantized_data_type(gguf.GGMLQuantizationType.Q5_K,
+                                   [('d', '<f2'), ('dmin', '<f2'), ('scales', 'u1', (12,)), ('qh', 'u1', (QK_K // 8,)), ('qs', 'u1', (QK_K // 2,))])
+DT_Q6_K = ggml_quantized_data_type(gguf.GGMLQuantizationType.Q6_K,
+                                   [('ql', 'u1', (QK_K // 2,)), ('qh', 'u1', (QK_K // 4,)), ('scales', 'i1', (QK_K // 16,)), ('d', '<f2')])
+
+QUANTIZED_DATA_TYPES: dict[gguf.GGMLQuantizationType, QuantizedDataType] = {
+    dt.ggml_type: dt for dt in (DT_Q4_0, DT_Q4_1, DT_Q5_0, DT_Q5_1, DT_Q8_0, DT_Q2_K, DT_Q3_K, DT_Q4_K, DT_Q5_K, DT_Q6_K)
+}
+
 # Quantized types skipped here because they may also map to np.float32
 NUMPY_TYPE_TO_DATA_TYPE: dict[np.dtype[Any], DataType] = {}
 for dt in (DT_BF16, DT_F16, DT_F32, DT_I32):
@@ -126,22 +190,131 @@ SAFETENSORS_DATA_TYPES: dict[str, DataType] = {
 
 
 class GGMLFileType(enum.IntEnum):
-    AllF32     = 0
-    MostlyF16  = 1  # except 1d tensors
-    MostlyQ8_0 = 7  # except 1d tensors
-
-    def type_for_tensor(self, name: str, tensor: LazyTensor) -> DataType:
+    AllF32       = 0
+    MostlyF16    = 1   # except 1d tensors
+    MostlyQ4_0   = 2   # except 1d tensors
+    MostlyQ4_1   = 3   # except 1d tensors
+    MostlyQ8_0   = 7   # except 1d tensors
+    MostlyQ5_0   = 8   # except 1d tensors
+    MostlyQ5_1   = 9   # except 1d tensors
+    MostlyQ2_K   = 10  # except 1d tensors
+    MostlyQ3_K_S = 11  # except 1d tensors
+    MostlyQ3_K_M = 12  # except 1d tensors
+    MostlyQ3_K_L = 13  # except 1d tensors
+    MostlyQ4_K_S = 14  # except 1d tensors
+    MostlyQ4_K_M = 15  # except 1d tensors
+    MostlyQ5_K_S = 16  # except 1d tensors
+    MostlyQ5_K_M = 17  # except 1d tensors
+    MostlyQ6_K   = 18  # except 1d tensors
+
+    def type_for_tensor(self, name: str, tensor: LazyTensor, n_layer: int = 0, model_70b: bool = False) -> DataType:
         dt = GGML_FILE_TYPE_TO_DATA_TYPE.get(self)
         if dt is None:
             raise ValueError(self)
         # 1D tensors are always F32.
-        return dt if len(tensor.shape) > 1 else DT_F32
+        if len(tensor.shape) == 1:
+            return DT_F32
+        if isinstance(dt, QuantizedDataType):
+            return QUANTIZED_DATA_TYPES[self.quant_type_for_tensor(name, tensor.shape, dt.ggml_type, n_layer, model_70b)]
+        return dt
+
+    def quant_type_for_tensor(self, name: str, shape: list[int], qtype: gguf.GGMLQuantizationType,
+                              n_layer: int, model_70b: bool) -> gguf.GGMLQuantizationType:
+        # Same choices as get_k_quant_type in llama.cpp (for LLaMA models), so that
+        # the result matches converting to F16 and running the quantize tool.
+        Q = gguf.GGMLQuantizationType
+        FT = GGMLFileType
+
+        def use_more_bits(i_layer: int) -> bool:
+            return i_layer < n_layer // 8 or i_layer >= 7 * n_layer // 8 or (i_layer - n_layer // 8) % 3 == 2
+
+        match = re.match(r'blk\.(\d+)\.', name)
+        i_layer = int(match.group(1)) if match else 0
+        if name == 'output.weight':
+            if shape[-1] % QK_K != 0:
+                qtype = Q.Q8_0
+            elif qtype != Q.Q8_0:
+                qtype = Q.Q6_K
+        elif name.endswith('attn_v.weight'):
+            if self == FT.MostlyQ2_K:
+                qtype = Q.Q3_K
+            elif self == FT.MostlyQ3_K_M:
+                qtype = Q.Q5_K if i_layer < 2 else Q.Q4_K
+            elif self == FT.MostlyQ3_K_L:
+                qtype = Q.Q5_K
+            elif self in (FT.MostlyQ4_K_M, FT.MostlyQ5_K_M) and use_more_bits(i_layer):
+                qtype = Q.Q6_K
+            elif self == FT.MostlyQ4_K_S and i_layer < 4:
+                qtype = Q.Q5_K
+            # In the 70B model 8 heads share the same attn_v weights, spending more bits on them is cheap.
+            if model_70b and qtype in (Q.Q3_K, Q.Q4_K):
+                qtype = Q.Q5_K
+        elif name.endswith('ffn_down.weight'):
+            if self == FT.MostlyQ2_K:
+                qtype = Q.Q3_K
+            elif self == FT.MostlyQ3_K_M:
+                qtype = Q.Q5_K if i_layer < 2 else Q.Q4_K
+            elif self == FT.MostlyQ3_K_L:
+                qtype = Q.Q5_K
+            elif self in (FT.MostlyQ4_K_M, FT.MostlyQ5_K_M) and use_more_bits(i_layer):
+                qtype = Q.Q6_K
+            elif self == FT.MostlyQ4_K_S and i_layer < 4:
+                qtype = Q.Q5_K
+        elif name.endswith('attn_output.weight'):
+            if self == FT.MostlyQ2_K:
+                qtype = Q.Q3_K
+            elif self == FT.MostlyQ3_K_M:
+                qtype = Q.Q4_K
+            elif self == FT.MostlyQ3_K_L:
+                qtype = Q.Q5_K
+        elif name.endswith(('ffn_gate.weight', 'ffn_up.weight')):
+            if self == FT.MostlyQ2_K:
+                qtype = Q.Q3_K
+
+        # K-quants need whole super-blocks per row, fall back to a legacy type of similar size.
+        k_quant_fallbacks = {Q.Q2_K: Q.Q4_0, Q.Q3_K: Q.Q4_1, Q.Q4_K: Q.Q5_0, Q.Q5_K: Q.Q5_1, Q.Q6_K: Q.Q8_0}
+        if qtype in k_quant_fallbacks and shape[-1] % QK_K != 0:
+            qtype = k_quant_fallbacks[qtype]
+        return qtype
 
 
 GGML_FILE_TYPE_TO_DATA_TYPE: dict[GGMLFileType, DataType] = {
-    GGMLFileType.AllF32    : DT_F32,
-    GGMLFileType.MostlyF16 : DT_F16,
-    GGMLFileType.MostlyQ8_0: DT_Q8_0,
+    GGMLFileType.AllF32      : DT_F32,
+    GGMLFileType.MostlyF16   : DT_F16,
+    GGMLFileType.MostlyQ4_0  : DT_Q4_0,
+    GGMLFileType.MostlyQ4_1  : DT_Q4_1,
+    GGMLFileType.MostlyQ8_0  : DT_Q8_0,
+    GGMLFileType.MostlyQ5_0  : DT_Q5_0,
+    GGMLFileType.MostlyQ5_1  : DT_Q5_1,
+    GGMLFileType.MostlyQ2_K  : DT_Q2_K,
+    GGMLFileType.MostlyQ3_K_S: DT_Q3_K,
+    GGMLFileType.MostlyQ3_K_M: DT_Q3_K,
+    GGMLFileType.MostlyQ3_K_L: DT_Q3_K,
+    GGMLFileType.MostlyQ4_K_S: DT_Q4_K,
+    GGMLFileType.MostlyQ4_K_M: DT_Q4_K,
+    GGMLFileType.MostlyQ5_K_S: DT_Q5_K,
+    GGMLFileType.MostlyQ5_K_M: DT_Q5_K,
+    GGMLFileType.MostlyQ6_K  : DT_Q6_K,
+}
+
+# Names accepted by --outtype
+GGML_FILE_TYPE_NAMES: dict[GGMLFileType, str] = {
+    GGMLFileType.AllF32      : "f32",
+    GGMLFileType.MostlyF16   : "f16",
+    GGMLFileType.MostlyQ4_0  : "q4_0",
+    GGMLFileType.MostlyQ4_1  : "q4_1",
+    GGMLFileType.MostlyQ5_0  : "q5_0",
+    GGMLFileType.MostlyQ5_1  : "q5_1",
+    GGMLFileType.MostlyQ8_0  : "q8_0",
+    GGMLFileType.MostlyQ2_K  : "q2_k",
+    GGMLFileType.MostlyQ3_K_S: "q3_k_s",
+    GGMLFileType.MostlyQ3_K_M: "q3_k_m",
+    GGMLFileType.MostlyQ3_K_L: "q3_k_l",
+    GGMLFileType.MostlyQ4_K_S: "q4_k_s",
+    GGMLFileType.MostlyQ4_K_M: "q4_k_m",
+    GGMLFileType.MostlyQ5_K_S: "q5_k_s",
+    GGMLFileType.MostlyQ5_K_M: "q5_k_m",
+    GGMLFileType.MostlyQ6_K  : "q6_k",
 }
 
 #
@@ -456,30 +629,71 @@ def bf16_to_fp32(bf16_arr: np.ndarray[Any, np.dtype[np.uint16]]) -> NDArray:
 
 
 class UnquantizedTensor(Tensor):
-    def __init__(self, ndarray: NDArray) -> None:
+    # Permutations and type conversions are only recorded here. They are applied together,
+    # a few rows at a time, when the data is needed, so that each of them doesn't make
+    # another full size copy of the tensor.
+    def __init__(self, ndarray: NDArray, rows: NDArray | None = None, data_type: DataType | None = None) -> None:
         assert isinstance(ndarray, np.ndarray)
-        self.ndarray = ndarray
+        self.source = ndarray
+        self.rows = rows
+        self.data_type = data_type if data_type is not None else NUMPY_TYPE_TO_DATA_TYPE[ndarray.dtype]
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        if self.rows is None:
+            return self.source.shape
+        return (len(self.rows), *self.source.shape[1:])
+
+    @property
+    def ndarray(self) -> NDArray:
+        if self.rows is not None or self.source.dtype != self.data_type.dtype:
+            self.source = self.convert_rows()
+            self.rows = None
+        return self.source
+
+    @ndarray.setter
+    def ndarray(self, ndarray: NDArray) -> None:
+        self.source = ndarray
+        self.rows = None
         self.data_type = NUMPY_TYPE_TO_DATA_TYPE[ndarray.dtype]
 
+    def convert_rows(self, out: NDArray | None = None) -> NDArray:
+        shape = self.shape
+        if out is None:
+            out = np.empty(shape, dtype = self.data_type.dtype)
+        assert out.shape == shape, f'Bad output shape {out.shape} for {shape}'
+        widen_bf16 = self.source.dtype == DT_BF16.dtype and self.data_type != DT_BF16
+        n_rows = shape[0] if shape else 1
+        step = max(1, CONVERT_CHUNK_ELEMENTS // max(1, math.prod(shape[1:])))
+        for start in range(0, n_rows, step):
+            end = min(start + step, n_rows)
+            chunk = self.source[start:end] if self.rows is None else self.source[self.rows[start:end]]
+            if widen_bf16:
+                chunk = bf16_to_fp32(chunk)
+            out[start:end] = chunk
+        return out
+
     def astype(self, data_type: DataType) -> Tensor:
-        dtype = data_type.dtype
-        if self.data_type == DT_BF16:
-            self.ndarray = bf16_to_fp32(self.ndarray)
-        return UnquantizedTensor(self.ndarray.astype(dtype))
+        return UnquantizedTensor(self.source, self.rows, data_type)
 
     def to_ggml(self) -> UnquantizedTensor:
         return self
 
+    def select_rows(self, index: NDArray) -> UnquantizedTensor:
+        return UnquantizedTensor(self.source, index if self.rows is None else self.rows[index], self.data_type)
+
     def permute_part(self, n_part: int, n_head: int, n_head_kv: int) -> UnquantizedTensor:
-        r = self.ndarray.shape[0] // 3
-        return UnquantizedTensor(permute(self.ndarray[r * n_part : r * n_part + r, ...], n_head, n_head_kv))
+        return self.part(n_part).permute(n_head, n_head_kv)
 
     def part(self, n_part: int) -> UnquantizedTensor:
-        r = self.ndarray.shape[0] // 3
-        return UnquantizedTensor(self.ndarray[r * n_part : r * n_part + r, ...])
+        r = self.shape[0] // 3
+        if self.rows is None:
+            return UnquantizedTensor(self.source[r * n_part : r * n_part + r, ...], None, self.data_type)
+        return UnquantizedTensor(self.source, self.rows[r * n_part : r * n_part + r], self.data_type)
 
     def permute(self, n_head: int, n_head_kv: int) -> UnquantizedTensor:
-        return UnquantizedTensor(permute(self.ndarray, n_head, n_head_kv))
+        # permute() only moves whole rows around, so applying it to the row numbers is enough
+        return self.select_rows(permute(np.arange(self.shape[0]), n_head, n_head_kv))
 
 
 def load_unquantized(lazy_tensor: LazyTensor, expected_dtype: Any = None, convert: bool = False) -> NDArray:
@@ -606,7 +820,7 @@ def permute_part_lazy(lazy_tensor: LazyTensor, n_part: int, n_head: int, n_head_
         return lazy_tensor.load().permute_part(n_part, n_head, n_head_kv)
     s = lazy_tensor.shape.copy()
     s[0] = s[0] // 3
-    return LazyTensor(load, s, lazy_tensor.data_type, f'permute({n_head}, {n_head_kv}) ' + lazy_tensor.description)
+    return LazyTensor(load, s, lazy_tensor.data_type, f'permute_part({n_part}, {n_head}, {n_head_kv}) ' + lazy_tensor.description)
 
 
 def part_lazy(lazy_tensor: LazyTensor, n_part: int) -> LazyTensor:
@@ -614,7 +828,65 @@ def part_lazy(lazy_tensor: LazyTensor, n_part: int) -> LazyTensor:
         return lazy_tensor.load().part(n_part)
     s = lazy_tensor.shape.copy()
     s[0] = s[0] // 3
-    return LazyTensor(load, s, lazy_tensor.data_type, 'part ' + lazy_tensor.description)
+    return LazyTensor(load, s, lazy_tensor.data_type, f'part({n_part}) ' + lazy_tensor.description)
+
+
+class TensorCache:
+    '''On-disk cache of loaded (and permuted, unpacked, ...) tensors, before they
+    are converted to the output type.  Entries are keyed by the description of
+    the lazy tensor, which names the source file, offsets, type and transforms,
+    together with the size and modification time of the source files.  The least
+    recently used entries are removed once the cache grows beyond `max_size`.'''
+    def __init__(self, path: Path, max_size: int, source_paths: list[Path]) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.sources = [(str(p.resolve()), p.stat().st_size, p.stat().st_mtime_ns) for p in source_paths if p.exists()]
+        self.lock = threading.Lock()
+        path.mkdir(parents=True, exist_ok=True)
+        self.evict()
+
+    def key(self, lazy_tensor: LazyTensor) -> str:
+        key = [lazy_tensor.description, lazy_tensor.shape, lazy_tensor.data_type.name, self.sources]
+        return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+    def load(self, lazy_tensor: LazyTensor) -> Tensor:
+        path = self.path / f'{self.key(lazy_tensor)}.npy'
+        try:
+            ndarray = np.load(path, mmap_mode='r')
+            # Mark the entry as recently used
+            os.utime(path)
+            return UnquantizedTensor(ndarray)
+        except (OSError, ValueError):
+            pass
+
+        ndarray = lazy_tensor.load().to_ggml().ndarray
+        temp_path = path.with_name(f'{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(temp_path, 'wb') as fp:
+            np.save(fp, ndarray)
+        os.replace(temp_path, path)
+        self.evict()
+        return UnquantizedTensor(ndarray)
+
+    def evict(self) -> None:
+        with self.lock:
+            entries = []
+            for entry in self.path.glob('*.npy'):
+                try:
+                    entries.append((entry.stat(), entry))
+                except FileNotFoundError:
+                    pass
+            total_size = sum(stat.st_size for stat, _ in entries)
+            for stat, entry in sorted(entries, key=lambda e: e[0].st_mtime_ns):
+                if total_size <= self.max_size:
+                    break
+                entry.unlink(missing_ok=True)
+                total_size -= stat.st_size
+
+
+def cache_lazy(lazy_tensor: LazyTensor, cache: TensorCache) -> LazyTensor:
+    def load() -> Tensor:
+        return cache.load(lazy_tensor)
+    return LazyTensor(load, lazy_tensor.shape, lazy_tensor.data_type, lazy_tensor.description)
 
 
 # Functionality that simulates `torch.load` but where individual tensors are
@@ -755,43 +1027,13 @@ def lazy_load_file(path: Path) -> ModelPlus:
         raise ValueError(f"unknown format: {path}")
 
 
-In = TypeVar('In')
-Out = TypeVar('Out')
-
-
-def bounded_parallel_map(func: Callable[[In], Out], iterable: Iterable[In], concurrency: int, max_workers: int | None = None, use_processpool_executor: bool = False) -> Iterable[Out]:
-    '''Parallel map, but with backpressure.  If the caller doesn't call `next`
-    fast enough, this will stop calling `func` at some point rather than
-    letting results pile up in memory.  Specifically, there is a max of one
-    output value buffered per thread.'''
-    if concurrency < 2:
-        yield from map(func, iterable)
-        # Not reached.
-    iterable = iter(iterable)
-    executor_class: type[ThreadPoolExecutor] | type[ProcessPoolExecutor]
-    if use_processpool_executor:
-        executor_class = ProcessPoolExecutor
-    else:
-        executor_class = ThreadPoolExecutor
-    with executor_class(max_workers = max_workers) as executor:
-        futures: list[concurrent.futures.Future[Out]] = []
-        done = False
-        for _ in range(concurrency):
-            try:
-                futures.append(executor.submit(func, next(iterable)))
-            except StopIteration:
-                done = True
-                break
-
-        while futures:
-            result = futures.pop(0).result()
-            while not done and len(futures) < concurrency:
-                try:
-                    futures.append(executor.submit(func, next(iterable)))
-                except StopIteration:
-                    done = True
-                    break
-            yield result
+def parse_size(size: str) -> int:
+    # A number of bytes with an optional binary K, M, G or T suffix, e.g. 24G
+    units = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?', size.strip(), re.IGNORECASE)
+    if match is None:
+        raise argparse.ArgumentTypeError(f'Invalid size {size!r}, expected e.g. 512M or 24G')
+    return int(float(match.group(1)) * units[match.group(2).upper()])
 
 
 def check_vocab_size(params: Params, vocab: Vocab) -> None:
@@ -811,9 +1053,45 @@ def check_vocab_size(params: Params, vocab: Vocab) -> None:
         raise Exception(msg)
 
 
+def close_shared_memory(shm: shared_memory.SharedMemory) -> None:
+    # Fails while a view of the buffer is alive, e.g. held by the traceback of an error being
+    # raised, which must not be hidden. The mapping then goes away with the last view.
+    try:
+        shm.close()
+    except BufferError:
+        pass
+
+
+def unlink_shared_memory(name: str) -> None:
+    try:
+        shm = shared_memory.SharedMemory(name = name)
+    except FileNotFoundError:
+        return
+    close_shared_memory(shm)
+    shm.unlink()
+
+
+@dataclass(frozen=True)
+class QuantizeJob:
+    # A loaded tensor waiting in shared memory to be quantized into its place in the output file
+    name: str
+    data_type: QuantizedDataType
+    shape: tuple[int, ...]
+    shm_name: str
+    path: Path
+    offset: int
+    byteswap: bool
+    journal: bool
+    tensor_hash: bool
+
+
 class OutputFile:
-    def __init__(self, fname_out: Path, endianess:gguf.GGUFEndian = gguf.GGUFEndian.LITTLE) -> None:
-        self.gguf = gguf.GGUFWriter(fname_out, gguf.MODEL_ARCH_NAMES[ARCH], endianess=endianess)
+    def __init__(self, fname_out: Path, endianess:gguf.GGUFEndian = gguf.GGUFEndian.LITTLE, journal: bool = False, resume: bool = False, n_split: int = 1, tensor_hashes: bool = False) -> None:
+        self.gguf: gguf.GGUFWriter
+        if n_split > 1:
+            self.gguf = gguf.GGUFSplitWriter(fname_out, gguf.MODEL_ARCH_NAMES[ARCH], n_split, endianess=endianess, journal=journal, resume=resume, tensor_hashes=tensor_hashes)
+        else:
+            self.gguf = gguf.GGUFWriter(fname_out, gguf.MODEL_ARCH_NAMES[ARCH], endianess=endianess, journal=journal, resume=resume, tensor_hashes=tensor_hashes)
 
     def add_meta_arch(self, params: Params) -> None:
         name = "LLaMA"
@@ -874,6 +1152,12 @@ class OutputFile:
     def add_meta_special_vocab(self, svocab: gguf.SpecialVocab) -> None:
         svocab.add_to_gguf(self.gguf)
 
+    def add_meta_data_layout(self, layout: gguf.TensorDataLayout, alignment: int | None) -> None:
+        if alignment is not None:
+            self.gguf.add_custom_alignment(alignment)
+        if layout is not gguf.TensorDataLayout.ADDED:
+            self.gguf.add_tensor_data_order(layout)
+
     def add_tensor_info(self, name: str, tensor: LazyTensor) -> None:
         n_elements = int(np.prod(tensor.shape))
         raw_dtype = getattr(tensor.data_type, 'ggml_type', None)
@@ -907,28 +1191,100 @@ class OutputFile:
         of.close()
 
     @staticmethod
-    def do_item(item: tuple[str, LazyTensor]) -> tuple[DataType, NDArray]:
+    def do_item(item: tuple[str, LazyTensor]) -> tuple[str, DataType, NDArray]:
         name, lazy_tensor = item
         tensor = lazy_tensor.load().to_ggml()
-        return (lazy_tensor.data_type, tensor.ndarray)
+        return (name, lazy_tensor.data_type, tensor.ndarray)
+
+    @staticmethod
+    def load_cost(item: tuple[str, LazyTensor]) -> int:
+        # Loading produces an array of the output type, float32 for quantized types
+        _, lazy_tensor = item
+        return math.prod(lazy_tensor.shape) * lazy_tensor.data_type.dtype.itemsize
 
     @staticmethod
-    def maybe_do_quantize(item: tuple[DataType, NDArray]) -> NDArray:
-        dt, arr = item
+    def quantize_cost(item: tuple[str, DataType, NDArray]) -> int:
+        # The input array and the quantized output, which also has to be sent back from the worker
+        _, dt, arr = item
         if not isinstance(dt, QuantizedDataType):
-            return arr
-        return dt.quantize(arr)
+            return arr.nbytes
+        return arr.nbytes + dt.elements_to_bytes(arr.size)
 
     @staticmethod
-    def write_all(fname_out: Path, ftype: GGMLFileType, params: Params, model: LazyModel, vocab: Vocab, svocab: gguf.SpecialVocab, concurrency: int = DEFAULT_CONCURRENCY, endianess: gguf.GGUFEndian = gguf.GGUFEndian.LITTLE) -> None:
+    def maybe_do_quantize(item: tuple[str, DataType, NDArray]) -> tuple[str, NDArray]:
+        name, dt, arr = item
+        if not isinstance(dt, QuantizedDataType):
+            return (name, arr)
+        return (name, dt.quantize(arr))
+
+    @staticmethod
+    def prepare_quantize(gguf_writer: gguf.GGUFWriter, item: tuple[str, LazyTensor]) -> QuantizeJob:
+        # Loads the tensor straight into shared memory and reserves its place in the output file
+        name, lazy_tensor = item
+        dt = lazy_tensor.data_type
+        assert isinstance(dt, QuantizedDataType)
+        shape = tuple(lazy_tensor.shape)
+        tensor = lazy_tensor.load().to_ggml()
+        shm = shared_memory.SharedMemory(create = True, size = max(1, math.prod(shape) * dt.dtype.itemsize))
+        try:
+            out = np.ndarray(shape, dtype = dt.dtype, buffer = shm.buf)
+            tensor.convert_rows(out = out)
+            offset = gguf_writer.reserve_tensor_data_at(name, dt.elements_to_bytes(math.prod(shape)))
+        except BaseException:
+            shm.unlink()
+            raise
+        finally:
+            out = None
+            close_shared_memory(shm)
+        return QuantizeJob(name, dt, shape, shm.name, Path(gguf_writer.tensor_path(name)), offset, gguf_writer.endianess == gguf.GGUFEndian.BIG,
+                           gguf_writer.journal_path is not None, gguf_writer.tensor_hashes is not None)
+
+    @staticmethod
+    def do_quantize_job(job: QuantizeJob | tuple[str, int, int | None, str | None]) -> tuple[str, int, int | None, str | None]:
+        # Runs in the process pool, the quantized blocks are written straight into the output file.
+        # The shared memory is unlinked by the parent, which also does it for jobs that never run.
+        if not isinstance(job, QuantizeJob):
+            return job
+        shm = shared_memory.SharedMemory(name = job.shm_name)
+        try:
+            arr = np.ndarray(job.shape, dtype = job.data_type.dtype, buffer = shm.buf)
+            nbytes = job.data_type.elements_to_bytes(math.prod(job.shape))
+            out = np.memmap(job.path, dtype = np.uint8, mode = 'r+', offset = job.offset, shape = (nbytes,))
+            blocks = job.data_type.quantize(arr, out = out)
+        finally:
+            arr = None
+            close_shared_memory(shm)
+        if job.byteswap:
+            gguf.byteswap(blocks.view(np.uint8).reshape(-1), job.data_type.ggml_type)
+        checksum = zlib.crc32(out) if job.journal else 0
+        content_hash = gguf.GGUFWriter.tensor_hash(out) if job.tensor_hash else None
+        out.flush()
+        return (job.name, nbytes, checksum, content_hash)
+
+    @staticmethod
+    def quantize_job_cost(job: QuantizeJob | tuple[str, int, int | None, str | None]) -> int:
+        # The shared memory holding the input, the output goes to the page cache of the output file
+        if not isinstance(job, QuantizeJob):
+            return 0
+        return math.prod(job.shape) * job.data_type.dtype.itemsize
+
+    @staticmethod
+    def write_all(fname_out: Path, ftype: GGMLFileType, params: Params, model: LazyModel, vocab: Vocab, svocab: gguf.SpecialVocab, concurrency: int = DEFAULT_CONCURRENCY, endianess: gguf.GGUFEndian = gguf.GGUFEndian.LITTLE, max_memory: int | None = None, journal: bool = False, resume: bool = False, split_max_size: int | None = None, data_layout: gguf.TensorDataLayout = gguf.TensorDataLayout.ADDED, data_alignment: int | None = None, tensor_hashes: bool = False) -> list[str]:
         check_vocab_size(params, vocab)
 
-        of = OutputFile(fname_out, endianess=endianess)
+        n_split = 1
+        if split_max_size is not None:
+            total_size = sum(lazy_tensor.data_type.elements_to_bytes(math.prod(lazy_tensor.shape)) for lazy_tensor in model.values())
+            n_split = max(1, min(len(model), math.ceil(total_size / split_max_size)))
+
+        # The journal allows an interrupted conversion to be resumed, resuming keeps it going
+        of = OutputFile(fname_out, endianess=endianess, journal=journal or resume, resume=resume, n_split=n_split, tensor_hashes=tensor_hashes)
 
         # meta data
         of.add_meta_arch(params)
         of.add_meta_vocab(vocab)
         of.add_meta_special_vocab(svocab)
+        of.add_meta_data_layout(data_layout, data_alignment)
 
         # tensor info
         for name, lazy_tensor in model.items():
@@ -937,22 +1293,70 @@ class OutputFile:
         of.write_meta()
         of.write_tensor_info()
 
-        # tensor data
-        ndarrays_inner = bounded_parallel_map(OutputFile.do_item, model.items(), concurrency = concurrency)
-        if ftype == GGMLFileType.MostlyQ8_0:
-            ndarrays = bounded_parallel_map(OutputFile.maybe_do_quantize, ndarrays_inner, concurrency = concurrency, max_workers = concurrency, use_processpool_executor = True)
+        items = [(name, lazy_tensor) for name, lazy_tensor in model.items() if not of.gguf.is_tensor_written(name)]
+        if len(items) < len(model):
+            print(f"Resuming, {len(model) - len(items)} of {len(model)} tensors are already written")
+
+        # tensor data, every tensor is written to its own offset as soon as it is ready
+        def write_item(item: tuple[str, NDArray]) -> tuple[str, int]:
+            name, ndarray = item
+            of.gguf.write_tensor_data_at(name, ndarray)
+            return (name, ndarray.nbytes)
+
+        # The memory limit is split between the loading and the quantizing/writing stage
+        max_cost = max_memory // 2 if max_memory is not None else None
+        if isinstance(GGML_FILE_TYPE_TO_DATA_TYPE[ftype], QuantizedDataType):
+            # Tensors to quantize are passed to the process pool in shared memory rather than pickled,
+            # the others are written right away
+            # Shared memory of the jobs that aren't finished yet, by tensor name
+            shm_names: dict[str, str] = {}
+
+            def prepare_item(item: tuple[str, LazyTensor]) -> QuantizeJob | tuple[str, int, int | None, str | None]:
+                if isinstance(item[1].data_type, QuantizedDataType):
+                    job = OutputFile.prepare_quantize(of.gguf, item)
+                    shm_names[job.name] = job.shm_name
+                    return job
+                return (*write_item(OutputFile.maybe_do_quantize(OutputFile.do_item(item))), None, None)
+
+            def finish_item(result: tuple[str, int, int | None, str | None]) -> tuple[str, int]:
+                name, nbytes, checksum, content_hash = result
+                if name in shm_names:
+                    unlink_shared_memory(shm_names.pop(name))
+                if checksum is not None:
+                    of.gguf.tensor_data_written(name, checksum, content_hash)
+                return (name, nbytes)
+
+            jobs = gguf.bounded_parallel_map(prepare_item, items, concurrency = concurrency, ordered = False,
+                                        cost = OutputFile.load_cost, max_cost = max_cost)
+            results = gguf.bounded_parallel_map(OutputFile.do_quantize_job, jobs, concurrency = concurrency, max_workers = concurrency, use_processpool_executor = True, ordered = False,
+                                           cost = OutputFile.quantize_job_cost, max_cost = max_cost)
+            written = map(finish_item, results)
         else:
-            ndarrays = map(OutputFile.maybe_do_quantize, ndarrays_inner)
+            ndarrays_inner = gguf.bounded_parallel_map(OutputFile.do_item, items, concurrency = concurrency, ordered = False,
+                                                  cost = OutputFile.load_cost, max_cost = max_cost)
+            written = gguf.bounded_parallel_map(lambda item: write_item(OutputFile.maybe_do_quantize(item)), ndarrays_inner, concurrency = concurrency, ordered = False,
+                                           cost = OutputFile.quantize_cost, max_cost = max_cost)
 
         start = time.time()
-        for i, ((name, lazy_tensor), ndarray) in enumerate(zip(model.items(), ndarrays)):
-            elapsed = time.time() - start
-            size = ' x '.join(f"{dim:6d}" for dim in lazy_tensor.shape)
-            padi = len(str(len(model)))
-            print(f"[{i+1:{padi}d}/{len(model)}] Writing tensor {name:38s} | size {size:16} | type {lazy_tensor.data_type.name:4} | T+{int(elapsed):4}")
-            of.gguf.write_tensor_data(ndarray)
+        total_bytes = 0
+        padi = len(str(len(model)))
+        try:
+            for i, (name, nbytes) in enumerate(written, len(model) - len(items)):
+                elapsed = time.time() - start
+                total_bytes += nbytes
+                lazy_tensor = model[name]
+                size = ' x '.join(f"{dim:6d}" for dim in lazy_tensor.shape)
+                print(f"[{i+1:{padi}d}/{len(model)}] Wrote tensor {name:38s} | size {size:16} | type {lazy_tensor.data_type.name:4} | T+{int(elapsed):4} | {total_bytes / max(elapsed, 1e-3) / 1024**2:7.1f} MiB/s")
+        finally:
+            if isinstance(GGML_FILE_TYPE_TO_DATA_TYPE[ftype], QuantizedDataType):
+                # On errors, wait for the jobs in flight and free the shared memory of the ones that didn't finish
+                results.close()
+                jobs.close()
+                for shm_name in list(shm_names.values()):
+                    unlink_shared_memory(shm_name)
 
         of.close()
+        return of.gguf.paths if isinstance(of.gguf, gguf.GGUFSplitWriter) else [of.gguf.path]
 
 
 def pick_output_type(model: LazyModel, output_type_str: str | None) -> GGMLFileType:
@@ -962,8 +1366,9 @@ def pick_output_type(model: LazyModel, output_type_str: str | None) -> GGMLFileT
         return GGMLFileType.AllF32
     if output_type_str == "f16" or (output_type_str is None and wq_type in (DT_F16, DT_BF16)):
         return GGMLFileType.MostlyF16
-    if output_type_str == "q8_0":
-        return GGMLFileType.MostlyQ8_0
+    for ftype, ftype_str in GGML_FILE_TYPE_NAMES.items():
+        if output_type_str == ftype_str:
+            return ftype
 
     name_to_type = {name: lazy_tensor.data_type for (name, lazy_tensor) in model.items()}
 
@@ -971,7 +1376,13 @@ def pick_output_type(model: LazyModel, output_type_str: str | None) -> GGMLFileT
 
 
 def convert_to_output_type(model: LazyModel, output_type: GGMLFileType) -> LazyModel:
-    return {name: tensor.astype(output_type.type_for_tensor(name, tensor))
+    # The k-quant mixes depend on the number of layers and on whether attn_v is shared between heads (70B).
+    n_layer = sum(1 for name in model if name.endswith('.attn_v.weight'))
+    model_70b = False
+    if n_layer == 80:
+        attn_q, attn_v = model.get('blk.0.attn_q.weight'), model.get('blk.0.attn_v.weight')
+        model_70b = attn_q is not None and attn_v is not None and attn_v.shape[0] < attn_q.shape[0]
+    return {name: tensor.astype(output_type.type_for_tensor(name, tensor, n_layer, model_70b))
             for (name, tensor) in model.items()}
 
 
@@ -1111,11 +1522,7 @@ def load_vocab(path: Path, vocabtype: str | None) -> Vocab:
 
 
 def default_outfile(model_paths: list[Path], file_type: GGMLFileType) -> Path:
-    namestr = {
-        GGMLFileType.AllF32:    "f32",
-        GGMLFileType.MostlyF16: "f16",
-        GGMLFileType.MostlyQ8_0:"q8_0",
-    }[file_type]
+    namestr = GGML_FILE_TYPE_NAMES[file_type]
     ret = model_paths[0].parent / f"ggml-model-{namestr}.gguf"
     if ret in model_paths:
         sys.stderr.write(
@@ -1136,22 +1543,33 @@ def do_dump_model(model_plus: ModelPlus) -> None:
 def main(args_in: list[str] | None = None) -> None:
     output_choices = ["f32", "f16"]
     if np.uint32(1) == np.uint32(1).newbyteorder("<"):
-        # We currently only support Q8_0 output on little endian systems.
-        output_choices.append("q8_0")
+        # We currently only support quantized output on little endian systems.
+        output_choices += [name for name in GGML_FILE_TYPE_NAMES.values() if name not in output_choices]
     parser = argparse.ArgumentParser(description="Convert a LLaMa model to a GGML compatible file")
     parser.add_argument("--dump",        action="store_true",    help="don't convert, just show what's in the model")
     parser.add_argument("--dump-single", action="store_true",    help="don't convert, just show what's in a single model file")
     parser.add_argument("--vocab-only",  action="store_true",    help="extract only the vocab")
-    parser.add_argument("--outtype",     choices=output_choices, help="output format - note: q8_0 may be very slow (default: f16 or f32 based on input)")
+    parser.add_argument("--outtype",     choices=output_choices, help="output format - note: quantized types may be very slow (default: f16 or f32 based on input)")
     parser.add_argument("--vocab-dir",   type=Path,              help="directory containing tokenizer.model, if separate from model file")
     parser.add_argument("--outfile",     type=Path,              help="path to write to; default: based on input")
     parser.add_argument("model",         type=Path,              help="directory containing model file, or model file itself (*.pth, *.pt, *.bin, *.safetensors)")
     parser.add_argument("--vocabtype",   choices=["spm", "bpe"], help="vocab format (default: spm)", default="spm")
     parser.add_argument("--ctx",         type=int,               help="model training context (default: based on input)")
     parser.add_argument("--concurrency", type=int,               help=f"concurrency used for conversion (default: {DEFAULT_CONCURRENCY})", default = DEFAULT_CONCURRENCY)
+    parser.add_argument("--max-memory",  type=parse_size,        help="approximate limit on the memory used by tensors being converted, e.g. 24G (default: no limit)")
     parser.add_argument("--bigendian",   action="store_true",    help="model is executed on big endian machine")
+    parser.add_argument("--journal",     action="store_true",    help="record the written tensors in a .journal file next to the output, so an interrupted conversion can be resumed")
+    parser.add_argument("--resume",      action="store_true",    help="keep the tensors of an interrupted conversion to the same output file, written with --journal or --resume")
+    parser.add_argument("--cache-dir",   type=Path,              help="directory for caching the loaded tensors between conversions of the same model (default: no caching)")
+    parser.add_argument("--cache-size",  type=parse_size,        help=f"maximum size of the tensor cache (default: {DEFAULT_CACHE_SIZE // 1024**3}G)", default = DEFAULT_CACHE_SIZE)
+    parser.add_argument("--split-max-size", type=parse_size,     help="split the output into files of about this size, named like model-00001-of-00003.gguf, e.g. 4G (default: one file)")
+    parser.add_argument("--data-layout", choices=[layout.value for layout in gguf.TensorDataLayout], help="order of the tensor data in the output: as added, or grouped per block in execution order (default: added)", default = gguf.TensorDataLayout.ADDED.value)
+    parser.add_argument("--tensor-hashes", action="store_true", help="store a hash of the data of every tensor in the metadata, checked by gguf-verify")
+    parser.add_argument("--data-alignment", type=parse_size,     help=f"alignment of the tensor data, a power of two, e.g. 2M for huge pages (default: {gguf.GGUF_DEFAULT_ALIGNMENT})")
 
     args = parser.parse_args(args_in)
+    if args.data_alignment is not None and (args.data_alignment < gguf.GGUF_DEFAULT_ALIGNMENT or args.data_alignment & (args.data_alignment - 1)):
+        raise ValueError(f"--data-alignment must be a power of two of at least {gguf.GGUF_DEFAULT_ALIGNMENT}")
     if args.dump_single:
         model_plus = lazy_load_file(args.model)
         do_dump_model(model_plus)
@@ -1179,11 +1597,7 @@ def main(args_in: list[str] | None = None) -> None:
         params.n_ctx = args.ctx
 
     if args.outtype:
-        params.ftype = {
-            "f32": GGMLFileType.AllF32,
-            "f16": GGMLFileType.MostlyF16,
-            "q8_0": GGMLFileType.MostlyQ8_0,
-        }[args.outtype]
+        params.ftype = {name: ftype for ftype, name in GGML_FILE_TYPE_NAMES.items()}[args.outtype]
 
     print(f"params = {params}")
 
@@ -1213,6 +1627,9 @@ def main(args_in: list[str] | None = None) -> None:
 
     model   = model_plus.model
     model   = convert_model_names(model, params)
+    if args.cache_dir is not None:
+        cache = TensorCache(args.cache_dir, args.cache_size, model_plus.paths)
+        model = {name: cache_lazy(lazy_tensor, cache) for name, lazy_tensor in model.items()}
     ftype   = pick_output_type(model, args.outtype)
     model   = convert_to_output_type(model, ftype)
     outfile = args.outfile or default_outfile(model_plus.paths, ftype)
@@ -1220,8 +1637,9 @@ def main(args_in: list[str] | None = None) -> None:
     params.ftype = ftype
     print(f"Writing {outfile}, format {ftype}")
 
-    OutputFile.write_all(outfile, ftype, params, model, vocab, special_vocab, concurrency = args.concurrency, endianess=endianess)
-    print(f"Wrote {outfile}")
+    paths = OutputFile.write_all(outfile, ftype, params, model, vocab, special_vocab, concurrency = args.concurrency, endianess=endianess, max_memory = args.max_memory, journal = args.journal, resume = args.resume, split_max_size = args.split_max_size,
+                                 data_layout = gguf.TensorDataLayout(args.data_layout), data_alignment = args.data_alignment, tensor_hashes = args.tensor_hashes)
+    print(f"Wrote {', '.join(paths)}")
 
 
 if __name__ == '__main__':